@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+#  -*- coding:utf-8 -*-
+
+"""Guard the import time of the lyric package.
+
+Imports lyric in fresh interpreters and fails when the HTTP/OAuth stack is
+loaded at import time or the median import takes longer than the budget.
+
+    python benchmarks/import_time.py [--runs 20] [--budget-ms 25]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAZY_MODULES = ("requests", "requests_oauthlib", "oauthlib")
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import lyric
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def measure():
+    """Import lyric in a fresh interpreter."""
+
+    output = subprocess.check_output([sys.executable, "-c", PROBE], cwd=ROOT)
+    return json.loads(output.decode("utf-8"))
+
+
+def main():
+    """Run the benchmark."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--budget-ms", type=float, default=25.0)
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        result = measure()
+        loaded = [module for module in LAZY_MODULES if module in result["modules"]]
+        if loaded:
+            print("import lyric loaded %s eagerly" % ", ".join(loaded))
+            return 1
+        timings.append(result["elapsed"] * 1000)
+
+    median = statistics.median(timings)
+    print(
+        "import lyric: median %.2f ms, min %.2f ms, max %.2f ms over %s runs"
+        % (median, min(timings), max(timings), args.runs)
+    )
+    if median > args.budget_ms:
+        print("import lyric exceeds the budget of %.2f ms" % args.budget_ms)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+#  -*- coding:utf-8 -*-
+
+"""Compare main process CPU time of parsing locations in and out of process.
+
+Builds a simulated locations payload and replays poll cycles in which a
+few thermostats report a new indoor temperature. Each cycle is decoded and
+indexed in process, and through an IngestPool that only sends back the
+locations that changed.
+
+    python benchmarks/ingest.py [--locations 2000] [--changed 20] [--runs 10]
+"""
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from lyric import _build_index  # noqa: E402
+from lyric.ingest import IngestPool  # noqa: E402
+from lyric.simulator import Simulation  # noqa: E402
+
+
+def cycles(locations, changed, runs, seed=1):
+    """Yield the response bodies of successive poll cycles."""
+
+    rng = random.Random(seed)
+    thermostats = [
+        device
+        for location in locations
+        for device in location["devices"]
+        if device.get("deviceType") == "Thermostat"
+    ]
+    for _ in range(runs):
+        for device in rng.sample(thermostats, changed):
+            device["indoorTemperature"] = round(rng.uniform(15, 25), 1)
+        yield json.dumps(locations).encode("utf-8")
+
+
+def measure(function):
+    """Return the main process CPU and wall time of a call in ms."""
+
+    cpu = time.process_time()
+    wall = time.perf_counter()
+    function()
+    return (time.process_time() - cpu) * 1000, (time.perf_counter() - wall) * 1000
+
+
+def main():
+    """Run the benchmark."""
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--locations", type=int, default=2000)
+    parser.add_argument("--changed", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+
+    simulation = Simulation(
+        locations=args.locations, thermostats=2, leak_detectors=1, speed=0, seed=1
+    )
+    _, locations = simulation.handle("GET", "locations", {}, None)
+    bodies = list(cycles(locations, args.changed, args.runs + 1))
+    print(
+        "%s locations, %.1f MB per response, %s thermostats changed per cycle"
+        % (args.locations, len(bodies[0]) / 1e6, args.changed)
+    )
+
+    in_process = [
+        measure(lambda: _build_index(json.loads(body))) for body in bodies[1:]
+    ]
+
+    ingested = []
+    with IngestPool(max_workers=args.workers) as pool:
+        known = pool.parse(bodies[0], "locations")[2]
+        for body in bodies[1:]:
+            result = []
+            ingested.append(
+                measure(lambda: result.append(pool.parse(body, "locations", known)))
+            )
+            known = result[0][2]
+
+    for name, timings in (("in process", in_process), ("ingest pool", ingested)):
+        print(
+            "%-12s main process CPU %7.1f ms, wall %7.1f ms (median of %s)"
+            % (
+                name,
+                statistics.median(cpu for cpu, _ in timings),
+                statistics.median(wall for _, wall in timings),
+                len(timings),
+            )
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,15 +2,32 @@
 
 """Library to restfully handle Honeywell Home Assistant API calls."""
 
+import collections
+import heapq
+import itertools
 import logging
-import os
+import threading
 import time
 import urllib.parse
 
-import requests
-from requests.auth import HTTPBasicAuth
-from requests.compat import json
-from requests_oauthlib import OAuth2Session
+from .context import INTERACTIVE, current_context, default_context, use_context
+from .exceptions import (
+    AuthError,
+    CircuitOpenError,
+    DeadlineExceeded,
+    HTTPError,
+    LyricError,
+    PermanentError,
+    RateLimitError,
+    TransientError,
+    TransportError,
+)
+from .frozen import freeze
+from .token import TokenBroker, token_expired
+from .transport import RequestsTransport
+
+# requests and requests_oauthlib are imported on first network use to keep
+# importing lyric fast, see benchmarks/import_time.py.
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -19,10 +36,332 @@ AUTHORIZATION_BASE_URL = "https://api.honeywell.com/oauth2/authorize"
 TOKEN_URL = "https://api.honeywell.com/oauth2/token"
 REFRESH_URL = TOKEN_URL
 
+# Cache value of a fetch that failed.
+_NEGATIVE = object()
+
+WriteResult = collections.namedtuple("WriteResult", ["device", "status_code", "error"])
+
+
+class _PendingWrite(object):
+    """Write overlaid on reads until the server confirms it."""
+
+    def __init__(self, overlay, endpoint, expires, next_check):
+        """Initialize the pending write."""
+
+        self.overlay = overlay
+        self.endpoint = endpoint
+        self.expires = expires
+        self.next_check = next_check
+        self.base = None
+        self.device = None
+        self.derived = None
+
+
+def _merge(base, overlay):
+    """Return a copy of base with the values of overlay merged in."""
+
+    merged = dict(base)
+    for key, value in overlay.items():
+        if isinstance(value, dict) and isinstance(merged.get(key), dict):
+            merged[key] = _merge(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+
+def _contains(value, overlay):
+    """Return whether value contains all values of overlay."""
+
+    for key, expected in overlay.items():
+        if key not in value:
+            return False
+        if isinstance(expected, dict) and isinstance(value[key], dict):
+            if not _contains(value[key], expected):
+                return False
+        elif value[key] != expected:
+            return False
+    return True
+
+
+_IndexEntry = collections.namedtuple(
+    "_IndexEntry", ["location", "devices", "users", "derived"]
+)
+
+
+def _thermostat_derived(device, location):
+    """Return values derived from a thermostat payload and its location."""
+
+    changeableValues = device.get("changeableValues") or {}
+    allowedModes = device.get("allowedModes") or []
+
+    schedule = device.get("scheduleType") or {}
+    scheduleType = schedule.get("scheduleType")
+    if scheduleType is None:
+        scheduleType = (device.get("schedule") or {}).get("scheduleType")
+    scheduleSubType = schedule.get("scheduleSubType")
+
+    away = None
+    period = (device.get("currentSchedulePeriod") or {}).get("period")
+    if scheduleType == "Geofence":
+        if location.get("geoFenceEnabled"):
+            geoFences = location.get("geoFences") or [{}]
+            geoOccupancy = geoFences[0].get("geoOccupancy") or {}
+            away = geoOccupancy.get("withinFence") == 0
+    elif scheduleType == "Timed" and scheduleSubType == "NA":
+        # North America
+        away = period == "Away"
+    elif scheduleType == "Timed" and scheduleSubType == "EMEA":
+        # Europe, Middle-East, Africa
+        away = period == "P3"
+
+    if changeableValues.get("mode") == "Heat":
+        temperatureSetpoint = changeableValues.get("heatSetpoint")
+    else:
+        temperatureSetpoint = changeableValues.get("coolSetpoint")
+
+    if "Heat" in allowedModes:
+        maxSetpoint = device.get("maxHeatSetpoint")
+    else:
+        maxSetpoint = device.get("maxCoolSetpoint")
+    if "Cool" in allowedModes:
+        minSetpoint = device.get("minCoolSetpoint")
+    else:
+        minSetpoint = device.get("minHeatSetpoint")
+
+    return {
+        "away": away,
+        "scheduleType": scheduleType,
+        "scheduleSubType": scheduleSubType,
+        "temperatureSetpoint": temperatureSetpoint,
+        "maxSetpoint": maxSetpoint,
+        "minSetpoint": minSetpoint,
+    }
+
+
+class _RateLimiter(object):
+    """Token bucket limiting the number of requests per second."""
+
+    def __init__(self, rate, burst=None):
+        """Initialize the rate limiter."""
+
+        self._rate = float(rate)
+        self._burst = float(burst if burst is not None else max(rate, 1))
+        self._tokens = self._burst
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline=None):
+        """Block until a request may be sent.
+
+        Raises DeadlineExceeded instead of waiting past deadline.
+        """
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self._burst, self._tokens + (now - self._last) * self._rate
+                )
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self._rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("Deadline passed waiting for the rate limit")
+            time.sleep(wait)
+
+
+class _PriorityGate(object):
+    """Limit the number of requests in flight, admitting by priority.
+
+    Waiting requests get a slot in order of priority, then of arrival, and
+    give up with DeadlineExceeded when their deadline passes first.
+    """
+
+    def __init__(self, slots):
+        """Initialize the gate."""
+
+        self._slots = slots
+        self._busy = 0
+        self._waiting = []
+        self._order = itertools.count()
+        self._condition = threading.Condition()
+
+    def acquire(self, priority, deadline=None):
+        """Block until a slot is free for this request."""
+
+        with self._condition:
+            ticket = (priority, next(self._order))
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while self._busy >= self._slots or self._waiting[0] != ticket:
+                    timeout = None
+                    if deadline is not None:
+                        timeout = deadline - time.monotonic()
+                        if timeout <= 0:
+                            raise DeadlineExceeded(
+                                "Deadline passed waiting for a connection"
+                            )
+                    self._condition.wait(timeout)
+            except BaseException:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._condition.notify_all()
+                raise
+            heapq.heappop(self._waiting)
+            self._busy += 1
+            # The next waiter may fit in a slot that is still free.
+            self._condition.notify_all()
+
+    def release(self):
+        """Free the slot of a finished request."""
+
+        with self._condition:
+            self._busy -= 1
+            self._condition.notify_all()
+
+
+class _CircuitBreaker(object):
+    """Stop calling endpoints that keep failing.
+
+    After threshold consecutive failures an endpoint is not called for
+    cooldown seconds, doubling up to max_cooldown while trial requests
+    keep failing. A throttled endpoint is not called until its Retry-After
+    passed.
+    """
+
+    def __init__(self, threshold=5, cooldown=30, max_cooldown=600):
+        """Initialize the circuit breaker."""
+
+        self._threshold = threshold
+        self._cooldown = cooldown
+        self._max_cooldown = max_cooldown
+        self._state = {}
+        self._lock = threading.Lock()
+
+    def check(self, key):
+        """Raise CircuitOpenError while calls to key are suspended."""
+
+        with self._lock:
+            state = self._state.get(key)
+            if state is None:
+                return
+            now = time.time()
+            failures, open_until, cooldown = state
+            if open_until > now:
+                raise CircuitOpenError(
+                    "Circuit for %s is open" % key, retry_after=open_until - now
+                )
+            if failures >= self._threshold:
+                # Let a single trial request through.
+                self._state[key] = (failures, now + cooldown, cooldown)
+
+    def success(self, key):
+        """Close the circuit of key."""
+
+        if key in self._state:
+            with self._lock:
+                self._state.pop(key, None)
+
+    def failure(self, key, retry_after=None):
+        """Record a failed call to key."""
+
+        with self._lock:
+            now = time.time()
+            failures, open_until, cooldown = self._state.get(
+                key, (0, 0, self._cooldown)
+            )
+            failures += 1
+            if retry_after is not None:
+                open_until = now + retry_after
+            elif failures >= self._threshold:
+                open_until = now + cooldown
+                cooldown = min(self._max_cooldown, cooldown * 2)
+            self._state[key] = (failures, open_until, cooldown)
+
+
+def _retry_after(headers):
+    """Return the seconds to wait requested by a Retry-After header."""
+
+    value = None
+    for key in headers:
+        if key.lower() == "retry-after":
+            value = headers[key]
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        import email.utils
+
+        retry_at = email.utils.parsedate_to_datetime(value).timestamp()
+        return max(0.0, retry_at - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _http_error(response, endpoint):
+    """Return the typed error of a failed response."""
+
+    status_code = response.status_code
+    message = "%s Error for url: %s" % (status_code, endpoint)
+    if status_code in (401, 403):
+        return AuthError(message, response)
+    if status_code == 429:
+        return RateLimitError(message, response, _retry_after(response.headers))
+    if status_code == 408 or status_code >= 500:
+        return TransientError(message, response)
+    return PermanentError(message, response)
+
+
+def _round_period_time(nextPeriodTime, increment):
+    """Round a HH:MM[:SS] period time to the allowed time increment in minutes."""
+
+    try:
+        parts = [int(part) for part in str(nextPeriodTime).split(":")]
+        hours, minutes = parts[0], parts[1]
+    except (ValueError, IndexError):
+        raise ValueError("nextPeriodTime must be formatted as HH:MM:SS")
+    if len(parts) > 3 or not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError("nextPeriodTime must be formatted as HH:MM:SS")
+
+    total = hours * 60 + minutes
+    if increment:
+        total = int(round(float(total) / increment) * increment) % (24 * 60)
+    return "%02d:%02d:00" % (total // 60, total % 60)
+
+
+def _index_location(location):
+    """Index the devices and users of a location payload."""
+
+    devices = {}
+    derived = {}
+    for device in location.get("devices") or []:
+        deviceId = device.get("deviceID")
+        devices[deviceId] = device
+        if device.get("deviceType") == "Thermostat":
+            derived[deviceId] = _thermostat_derived(device, location)
+    users = {user.get("userID"): user for user in location.get("users") or []}
+    return _IndexEntry(location, devices, users, derived)
+
+
+def _build_index(locations):
+    """Index a locations payload by location id."""
+
+    return {
+        location.get("locationID"): _index_location(location)
+        for location in locations
+    }
+
 
 class lyricDevice(object):
     """Class definition for Lyric devices."""
 
+    _endpoint = None
+
     def __init__(self, deviceId, location, lyric_api, local_time=False):
         """Intializes and configures lyricDevice class."""
 
@@ -37,12 +376,36 @@ class lyricDevice(object):
 
         return "<%s: %s>" % (self.__class__.__name__, self._repr_name)
 
-    def _set(self, endpoint, data, **params):
+    def _set(self, endpoint, data, callback=None, overlay=None, **params):
         """Setter Magic Method."""
 
         params["locationId"] = self._location.locationId
-        print(self._lyric_api._post(endpoint, data, **params))
-        self._lyric_api._bust_cache_all()
+        command_queue = self._lyric_api._command_queue
+        if command_queue is not None:
+            return command_queue.put(endpoint, data, callback, **params)
+
+        status_code, error = self._lyric_api._post_result(endpoint, data, **params)
+        if overlay is not None and self._lyric_api._read_your_writes:
+            if error is None:
+                self._lyric_api._add_pending_write(self, overlay)
+        else:
+            self._lyric_api._bust_cache_all()
+        if callback is not None:
+            callback(None, status_code, error)
+        return status_code
+
+    def refresh(self):
+        """Refresh just this device from its own endpoint."""
+
+        if self._endpoint is None:
+            locations = self._lyric_api.refresh()
+            # A failed refetch keeps the cached locations without a fetch time.
+            if not locations or self._lyric_api._checkCache("locations")[1] == 0:
+                return False
+            return self._lyric_api._location(self._locationId) is not None
+        return self._lyric_api._refresh_device(
+            self._locationId, self._endpoint + self._deviceId
+        )
 
     @property
     def id(self):
@@ -56,6 +419,12 @@ class lyricDevice(object):
 
         return self._lyric_api._device(self._locationId, self._deviceId)
 
+    @property
+    def _derived(self):
+        """Return state derived from the device payload."""
+
+        return self._lyric_api._derived(self._locationId, self._deviceId)
+
     @property
     def name(self):
         """Return Name."""
@@ -423,6 +792,8 @@ class Device(lyricDevice):
 class Thermostat(lyricDevice):
     """Thermostat Class."""
 
+    _endpoint = "devices/thermostats/"
+
     def updateThermostat(
         self,
         mode=None,
@@ -431,23 +802,63 @@ class Thermostat(lyricDevice):
         AutoChangeover=None,
         thermostatSetpointStatus=None,
         nextPeriodTime=None,
+        callback=None,
     ):
         """Update Themostate."""
 
+        data = self._update_data(
+            mode,
+            heatSetpoint,
+            coolSetpoint,
+            AutoChangeover,
+            thermostatSetpointStatus,
+            nextPeriodTime,
+        )
+        if self._unchanged(data):
+            _LOGGER.debug("Skipping update of %s, nothing changed" % self._deviceId)
+            if callback is not None:
+                callback(None, None, None)
+            return
+
+        return self._set(
+            "devices/thermostats/" + self._deviceId,
+            data=data,
+            callback=callback,
+            overlay={"changeableValues": data},
+        )
+
+    def _update_data(
+        self,
+        mode=None,
+        heatSetpoint=None,
+        coolSetpoint=None,
+        AutoChangeover=None,
+        thermostatSetpointStatus=None,
+        nextPeriodTime=None,
+    ):
+        """Return the validated request body of a thermostat update.
+
+        Values that are not given keep their cached value, or the value of
+        an update still waiting in the command queue.
+        """
+
+        changeableValues = self._queued_values()
         if mode is None:
-            mode = self.operationMode
+            mode = changeableValues.get("mode")
         if heatSetpoint is None:
-            heatSetpoint = self.heatSetpoint
+            heatSetpoint = changeableValues.get("heatSetpoint")
         if coolSetpoint is None:
-            coolSetpoint = self.coolSetpoint
+            coolSetpoint = changeableValues.get("coolSetpoint")
 
-        if "thermostatSetpointStatus" in self.changeableValues:
+        if "thermostatSetpointStatus" in changeableValues:
             if thermostatSetpointStatus is None:
-                thermostatSetpointStatus = self.thermostatSetpointStatus
+                thermostatSetpointStatus = changeableValues.get(
+                    "thermostatSetpointStatus"
+                )
 
-        if "autoChangeoverActive" in self.changeableValues:
+        if "autoChangeoverActive" in changeableValues:
             if AutoChangeover is None:
-                AutoChangeover = self.changeableValues.get("autoChangeoverActive")
+                AutoChangeover = changeableValues.get("autoChangeoverActive")
 
         data = {
             "mode": mode,
@@ -455,36 +866,105 @@ class Thermostat(lyricDevice):
             "coolSetpoint": coolSetpoint,
         }
 
-        if "thermostatSetpointStatus" in self.changeableValues:
+        if "thermostatSetpointStatus" in changeableValues:
             data["thermostatSetpointStatus"] = thermostatSetpointStatus
-        if "autoChangeoverActive" in self.changeableValues:
+        if "autoChangeoverActive" in changeableValues:
             data["autoChangeoverActive"] = AutoChangeover
         if nextPeriodTime is not None:
-            data["nextPeriodTime"] = nextPeriodTime
+            data["nextPeriodTime"] = _round_period_time(
+                nextPeriodTime, self.allowedTimeIncrements
+            )
+
+        self._validate(data)
+        return data
+
+    def _validate(self, data):
+        """Check an update against the limits of the thermostat."""
+
+        device = self.device or {}
+        mode = data.get("mode")
+        allowedModes = device.get("allowedModes")
+        if allowedModes and mode not in allowedModes:
+            raise ValueError(
+                "mode %s is not one of the allowed modes %s" % (mode, allowedModes)
+            )
+
+        for setpoint in ("heat", "cool"):
+            value = data.get(setpoint + "Setpoint")
+            minimum = device.get("min%sSetpoint" % setpoint.capitalize())
+            maximum = device.get("max%sSetpoint" % setpoint.capitalize())
+            if value is None:
+                continue
+            if minimum is not None and value < minimum:
+                raise ValueError(
+                    "%sSetpoint %s is below the minimum of %s"
+                    % (setpoint, value, minimum)
+                )
+            if maximum is not None and value > maximum:
+                raise ValueError(
+                    "%sSetpoint %s is above the maximum of %s"
+                    % (setpoint, value, maximum)
+                )
+
+        deadband = device.get("deadband")
+        heatSetpoint = data.get("heatSetpoint")
+        coolSetpoint = data.get("coolSetpoint")
+        if (
+            deadband
+            and (mode == "Auto" or data.get("autoChangeoverActive"))
+            and heatSetpoint is not None
+            and coolSetpoint is not None
+            and coolSetpoint - heatSetpoint < deadband
+        ):
+            raise ValueError(
+                "coolSetpoint %s and heatSetpoint %s are closer than the deadband %s"
+                % (coolSetpoint, heatSetpoint, deadband)
+            )
 
-        self._set("devices/thermostats/" + self._deviceId, data=data)
+    def _queued_values(self):
+        """Return the changeable values with a queued update applied."""
+
+        changeableValues = self.changeableValues or {}
+        command_queue = self._lyric_api._command_queue
+        if command_queue is None:
+            return changeableValues
+        queued = command_queue.pending(self._endpoint + self._deviceId)
+        if not queued:
+            return changeableValues
+        return _merge(changeableValues, queued)
+
+    def _unchanged(self, data):
+        """Return whether an update matches the cached changeable values.
+
+        An update still waiting in the command queue counts as applied.
+        """
+
+        changeableValues = self._queued_values()
+        if not changeableValues:
+            return False
+        return all(
+            key in changeableValues and changeableValues[key] == value
+            for key, value in data.items()
+        )
 
-    def updateFan(self, mode):
+    def updateFan(self, mode, callback=None):
         """Update Fan."""
 
         if mode is None:
             mode = self.fanMode
 
-        self._set("devices/thermostats/" + self._deviceId + "/fan", data={"mode": mode})
+        return self._set(
+            "devices/thermostats/" + self._deviceId + "/fan",
+            data={"mode": mode},
+            callback=callback,
+            overlay={"settings": {"fan": {"changeableValues": {"mode": mode}}}},
+        )
 
     @property
     def away(self):
         """Get away status."""
 
-        if self.scheduleType == "Geofence":
-            if self._location.geoFenceEnabled:
-                return self._location.withInFence == 0
-        elif self.scheduleType == "Timed" and self.scheduleSubType == "NA":
-            # North America
-            return self.currentSchedulePeriod.get("period") == "Away"
-        elif self.scheduleType == "Timed" and self.scheduleSubType == "EMEA":
-            # Europe, Middle-East, Africa
-            return self.currentSchedulePeriod.get("period") == "P3"
+        return self._derived.get("away")
 
     @property
     def vacationHold(self):
@@ -576,10 +1056,7 @@ class Thermostat(lyricDevice):
     def temperatureSetpoint(self):
         """Return temperature set point."""
 
-        if self.operationMode == "Heat":
-            return self.changeableValues.get("heatSetpoint")
-        else:
-            return self.changeableValues.get("coolSetpoint")
+        return self._derived.get("temperatureSetpoint")
 
     @temperatureSetpoint.setter
     def temperatureSetpoint(self, setpoint):
@@ -675,19 +1152,13 @@ class Thermostat(lyricDevice):
     def maxSetpoint(self):
         """Return max setpoint."""
 
-        if self.can_heat:
-            return self.maxHeatSetpoint
-        else:
-            return self.maxCoolSetpoint
+        return self._derived.get("maxSetpoint")
 
     @property
     def minSetpoint(self):
         """Return min setpoint."""
 
-        if self.can_cool:
-            return self.minCoolSetpoint
-        else:
-            return self.minHeatSetpoint
+        return self._derived.get("minSetpoint")
 
     @property
     def changeableValues(self):
@@ -814,28 +1285,45 @@ class Thermostat(lyricDevice):
 
         return self.device.get("scheduleCapabilities")
 
+    @property
+    def schedule(self):
+        """Return the schedule, None without a schedule engine."""
+
+        if self._lyric_api._schedules is not None:
+            return self._lyric_api._schedules.schedule(self)
+
+    @property
+    def localSchedulePeriod(self):
+        """Return the current scheduled period, evaluated locally."""
+
+        if self._lyric_api._schedules is not None:
+            return self._lyric_api._schedules.current(self)
+
+    @property
+    def nextSchedulePeriod(self):
+        """Return the next scheduled period, evaluated locally."""
+
+        if self._lyric_api._schedules is not None:
+            return self._lyric_api._schedules.next(self)
+
     @property
     def scheduleType(self):
         """Return schedule type."""
 
-        if (
-            "scheduleType" in self.device
-            and "scheduleType" in self.device["scheduleType"]
-        ):
-            return self.device.get("scheduleType").get("scheduleType")
-        elif "schedule" in self.device and "scheduleType" in self.device["schedule"]:
-            return self.device.get("schedule").get("scheduleType")
+        return self._derived.get("scheduleType")
 
     @property
     def scheduleSubType(self):
         """Return schedule subtype."""
 
-        return self.device.get("scheduleType").get("scheduleSubType")
+        return self._derived.get("scheduleSubType")
 
 
 class WaterLeakDetector(lyricDevice):
     """Water Leak Detector Class."""
 
+    _endpoint = "devices/waterLeakDetectors/"
+
     @property
     def waterPresent(self):
         """Return water present."""
@@ -941,6 +1429,22 @@ class Lyric(object):
         local_time=False,
         app_name=None,
         redirect_uri=None,
+        history=None,
+        rate_limit=None,
+        command_queue=None,
+        read_your_writes=False,
+        confirm_interval=5,
+        confirm_timeout=60,
+        token_broker=None,
+        transport=None,
+        circuit_threshold=5,
+        circuit_cooldown=30,
+        negative_cache_ttl=60,
+        schedules=None,
+        search_index=None,
+        freeze_payloads=False,
+        ingest=None,
+        max_connections=None,
     ):
         """Intializes and configures the Lyric class."""
 
@@ -952,10 +1456,52 @@ class Lyric(object):
         self._token_cache_file = token_cache_file
         self._cache_ttl = cache_ttl
         self._cache = {}
+        # Guards swapping cache entries and the index, which background
+        # threads update next to the thread reading properties.
+        self._cache_lock = threading.RLock()
         self._local_time = local_time
         self._user_agent = user_agent
+        self._session = None
+        self._transport = transport or RequestsTransport()
+        self._circuit_breaker = _CircuitBreaker(circuit_threshold, circuit_cooldown)
+        self._location_breaker = _CircuitBreaker(circuit_threshold, circuit_cooldown)
+        self._negative_cache_ttl = negative_cache_ttl
+        self._backoff = {}
+        self._last_error = None
+        self._token_lock = threading.RLock()
+        self._token_broker = token_broker
+        if token_broker is None and token_cache_file is not None:
+            self._token_broker = TokenBroker(token_cache_file)
+        self._history = history
+        self._index = {}
+        self._indexed = None
+        self._rate_limiter = None
+        if rate_limit is not None:
+            self._rate_limiter = _RateLimiter(rate_limit)
+        self._command_queue = command_queue
+        self._read_your_writes = read_your_writes
+        self._confirm_interval = confirm_interval
+        self._confirm_timeout = confirm_timeout
+        self._pending_writes = {}
+        self._schedules = schedules
+        self._search_index = search_index
+        self._freeze_payloads = freeze_payloads
+        self._ingest = ingest
+        self._prebuilt = None
+        self._ingested = None
+        self._gate = None
+        if max_connections is not None:
+            self._gate = _PriorityGate(max_connections)
+        if command_queue is not None:
+            command_queue.start(self)
 
-        if token is None and token_cache_file is None and redirect_uri is None:
+        if (
+            token is None
+            and token_cache_file is None
+            and token_broker is None
+            and transport is None
+            and redirect_uri is None
+        ):
             print(
                 "You need to supply a token or a cached token file,"
                 "or define a redirect uri"
@@ -977,14 +1523,28 @@ class Lyric(object):
         """Token saver."""
 
         self._token = token
-        if self._token_cache_file is not None:
-            with os.fdopen(
-                os.open(
-                    self._token_cache_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
-                ),
-                "w",
-            ) as f:
-                return json.dump(token, f)
+        if self._token_broker is not None:
+            self._token_broker.save(token)
+
+    def _adopt_token(self, token):
+        """Use a token refreshed by another thread or process."""
+
+        self._token = token
+        if self._session is not None:
+            self._session.token = token
+
+    def _ensure_token(self):
+        """Refresh the token before it expires."""
+
+        broker = self._token_broker
+        if broker is not None and broker.changed():
+            stored = broker.load()
+            if stored and stored is not self._token:
+                self._adopt_token(stored)
+
+        token = self._token
+        if token is not None and token_expired(token):
+            self._lyricReauth(token)
 
     @property
     def token(self):
@@ -992,6 +1552,12 @@ class Lyric(object):
 
         return self._token
 
+    @property
+    def history(self):
+        """Return history recorder."""
+
+        return self._history
+
     @property
     def authorized(self):
         """Return authorized."""
@@ -999,16 +1565,37 @@ class Lyric(object):
         return self._lyricApi.authorized
 
     @property
-    def getauthorize_url(self):
-        """Return session."""
+    def _lyricApi(self):
+        """Return the OAuth2 session, creating it on first use."""
 
-        self._lyricApi = OAuth2Session(
+        if self._session is None and self._token is not None:
+            self._session = self._oauth_session(token=self._token)
+        return self._session
+
+    @_lyricApi.setter
+    def _lyricApi(self, session):
+        """Set the OAuth2 session."""
+
+        self._session = session
+
+    def _oauth_session(self, **kwargs):
+        """Create an OAuth2 session."""
+
+        from requests_oauthlib import OAuth2Session
+
+        return OAuth2Session(
             self._client_id,
-            redirect_uri=self._redirect_uri,
             auto_refresh_url=REFRESH_URL,
             token_updater=self._token_saver,
+            **kwargs
         )
 
+    @property
+    def getauthorize_url(self):
+        """Return session."""
+
+        self._lyricApi = self._oauth_session(redirect_uri=self._redirect_uri)
+
         authorization_url, state = self._lyricApi.authorization_url(
             AUTHORIZATION_BASE_URL, app=self._app_name
         )
@@ -1018,6 +1605,8 @@ class Lyric(object):
     def authorization_response(self, authorization_response):
         """Get authorized response."""
 
+        from requests.auth import HTTPBasicAuth
+
         auth = HTTPBasicAuth(self._client_id, self._client_secret)
         headers = {"Accept": "application/json"}
 
@@ -1033,6 +1622,8 @@ class Lyric(object):
     def authorization_code(self, code, state):
         """Return authorization status."""
 
+        from requests.auth import HTTPBasicAuth
+
         auth = HTTPBasicAuth(self._client_id, self._client_secret)
         headers = {"Accept": "application/json"}
 
@@ -1042,101 +1633,218 @@ class Lyric(object):
 
         self._token_saver(token)
 
+    def _load_token(self):
+        """Load the token from the token broker or token_cache_file."""
+
+        if self._token is None and self._token_broker is not None:
+            stored = self._token_broker.load()
+            if stored is not None:
+                self._token = dict(stored)
+
     def _lyricAuth(self):
         """Get lyric authorization."""
 
-        if (
-            self._token_cache_file is not None
-            and self._token is None
-            and os.path.exists(self._token_cache_file)
-        ):
-            with open(self._token_cache_file, "r") as f:
-                self._token = json.load(f)
+        self._load_token()
 
         if self._token is not None:
-            # force token refresh
-            self._token["expires_at"] = time.time() - 10
-            self._token["expires_in"] = "-30"
-
-            self._lyricApi = OAuth2Session(
-                self._client_id,
-                token=self._token,
-                auto_refresh_url=REFRESH_URL,
-                token_updater=self._token_saver,
-            )
+            if self._token_broker is None or self._token_cache_file is not None:
+                # force token refresh
+                self._token["expires_at"] = time.time() - 10
+                self._token["expires_in"] = "-30"
 
-    def _lyricReauth(self):
-        """Lyric reauth."""
+            # The session is created on first network use.
+            self._lyricApi = None
 
-        if (
-            self._token_cache_file is not None
-            and self._token is None
-            and os.path.exists(self._token_cache_file)
-        ):
-            with open(self._token_cache_file, "r") as f:
-                self._token = json.load(f)
+    def _refresh_token(self, token):
+        """Request a new token with the refresh token of token."""
 
-        if self._token is not None:
-            auth = HTTPBasicAuth(self._client_id, self._client_secret)
-            headers = {"Accept": "application/json"}
-
-            self._lyricApi = OAuth2Session(
-                self._client_id,
-                token=self._token,
-                auto_refresh_url=REFRESH_URL,
-                token_updater=self._token_saver,
-            )
+        import requests
+        from requests.auth import HTTPBasicAuth
+
+        auth = HTTPBasicAuth(self._client_id, self._client_secret)
+        headers = {"Accept": "application/json"}
+
+        self._lyricApi = self._oauth_session(token=token)
 
-            token = self._lyricApi.refresh_token(
+        try:
+            return self._lyricApi.refresh_token(
                 REFRESH_URL,
-                refresh_token=self._token.get("refresh_token"),
+                refresh_token=token.get("refresh_token"),
                 headers=headers,
                 auth=auth,
+                timeout=current_context().timeout("refreshing the token"),
+            )
+        except requests.exceptions.RequestException as e:
+            raise TransportError(e)
+
+    def _lyricReauth(self, stale_token=None):
+        """Lyric reauth.
+
+        Only one thread refreshes at a time, and the token broker keeps
+        processes sharing a token file from refreshing at the same time.
+        A token refreshed meanwhile by someone else is used instead of
+        refreshing again. Waiting for a refresh by another thread or process
+        gives up, without refreshing, when the deadline of the request context
+        passes.
+        """
+
+        context = current_context()
+        timeout = context.remaining()
+        if not self._token_lock.acquire(timeout=-1 if timeout is None else timeout):
+            _LOGGER.debug("Deadline passed waiting for a token refresh")
+            return
+        try:
+            self._load_token()
+            if self._token is None:
+                return
+            if stale_token is None:
+                stale_token = self._token
+            if self._token is not stale_token and not token_expired(self._token):
+                return
+
+            if self._token_broker is None:
+                self._token = self._refresh_token(self._token)
+                return
+
+            token = self._token_broker.refresh(
+                stale_token, self._refresh_token, context.remaining()
             )
-            self._token_saver(token)
+            self._adopt_token(token)
+        except DeadlineExceeded as e:
+            _LOGGER.debug("Skipped token refresh: %s" % e)
+        finally:
+            self._token_lock.release()
+
+    def _request(self, method, endpoint, data=None, **params):
+        """Send a request through the transport, raising LyricError on failure.
+
+        A request whose context deadline passed before it could be sent is
+        dropped with DeadlineExceeded, and the transport only gets the time
+        left to complete it. Location scoped requests have a circuit per
+        location, so a failing location does not suspend the endpoint for
+        the others.
+        """
+
+        context = current_context()
+        request = "%s %s" % (method, endpoint)
+        context.check(request)
+        circuit = endpoint
+        if "locationId" in params:
+            circuit = "%s@%s" % (endpoint, params["locationId"])
+        self._circuit_breaker.check(circuit)
+        params["apikey"] = self._client_id
+        query_string = urllib.parse.urlencode(params)
+        url = BASE_URL + endpoint + "?" + query_string
+        if self._rate_limiter is not None:
+            self._rate_limiter.acquire(context.deadline)
+        self._ensure_token()
+        if self._gate is not None:
+            self._gate.acquire(context.priority, context.deadline)
+        try:
+            kwargs = {}
+            timeout = context.timeout(request)
+            if timeout is not None:
+                kwargs["timeout"] = timeout
+            response = self._transport.request(self, method, url, json=data, **kwargs)
+        except TransportError:
+            if context.expired():
+                raise DeadlineExceeded("Deadline passed during %s" % request)
+            self._circuit_breaker.failure(circuit)
+            raise
+        finally:
+            if self._gate is not None:
+                self._gate.release()
+        if response.status_code >= 400:
+            error = _http_error(response, endpoint)
+            if isinstance(error, (TransientError, RateLimitError)):
+                self._circuit_breaker.failure(
+                    circuit, getattr(error, "retry_after", None)
+                )
+            raise error
+        self._circuit_breaker.success(circuit)
+        return response
+
+    def _get_json(self, endpoint, **params):
+        """Lyric get request method raising LyricError on failure."""
+
+        token = self._token
+        try:
+            response = self._request("GET", endpoint, **params)
+            try:
+                if self._ingest is None:
+                    return response.json()
+                try:
+                    value, index, ingested = self._ingest.parse(
+                        response.content, endpoint, self._ingested
+                    )
+                except ValueError:
+                    raise
+                except Exception:  # noqa: B902
+                    # A crashed worker or a result that failed to pickle.
+                    _LOGGER.exception(
+                        "Error ingesting %s, parsing in process" % endpoint
+                    )
+                    return response.json()
+                if index is not None:
+                    with self._cache_lock:
+                        self._prebuilt = index
+                        self._ingested = ingested
+                return value
+            except ValueError as e:
+                raise TransientError(
+                    "Invalid response for url: %s: %s" % (endpoint, e), response
+                )
+        except LyricError as e:
+            self._last_error = e
+            if isinstance(e, (CircuitOpenError, DeadlineExceeded)):
+                _LOGGER.debug("Error Lyric API: %s" % e)
+            elif isinstance(e, HTTPError):
+                _LOGGER.error("HTTP Error Lyric API: %s" % e)
+            else:
+                _LOGGER.error("Error Lyric API: %s" % e)
+            if isinstance(e, AuthError):
+                self._lyricReauth(token)
+            raise
 
     def _get(self, endpoint, **params):
         """Lyric get request method."""
 
-        params["apikey"] = self._client_id
-        query_string = urllib.parse.urlencode(params)
-        url = BASE_URL + endpoint + "?" + query_string
         try:
-            response = self._lyricApi.get(
-                url, client_id=self._client_id, client_secret=self._client_secret
-            )
-            response.raise_for_status()
-            return response.json()
-        except requests.HTTPError as e:
-            _LOGGER.error("HTTP Error Lyric API: %s" % e)
-            if e.response.status_code == 401:
-                self._lyricReauth()
-        except requests.exceptions.RequestException as e:
-            # print("Error Lyric API: %s with data: %s" % (e, data))
-            _LOGGER.error("Error Lyric API: %s" % e)
+            return self._get_json(endpoint, **params)
+        except LyricError:
+            return None
+
+    def _post_raw(self, endpoint, data, **params):
+        """Lyric post request method raising on errors."""
+
+        return self._request("POST", endpoint, data, **params).status_code
 
     def _post(self, endpoint, data, **params):
         """Lyric post request method."""
 
-        params["apikey"] = self._client_id
-        query_string = urllib.parse.urlencode(params)
-        url = BASE_URL + endpoint + "?" + query_string
-        try:
-            response = self._lyricApi.post(
-                url,
-                json=data,
-                client_id=self._client_id,
-                client_secret=self._client_secret,
-            )
-            response.raise_for_status()
-            return response.status_code
-        except requests.HTTPError as e:
-            _LOGGER.error("HTTP Error Lyric API: %s" % e)
-            if e.response.status_code == 401:
-                self._lyricReauth()
-        except requests.exceptions.RequestException as e:
-            # print("Error Lyric API: %s with data: %s" % (e, data))
-            _LOGGER.error("Error Lyric API: %s with data: %s" % (e, data))
+        return self._post_result(endpoint, data, **params)[0]
+
+    def _post_result(self, endpoint, data, **params):
+        """Post a request, returning its status code and LyricError.
+
+        Posts are sent at interactive priority unless the caller made a
+        request context.
+        """
+
+        token = self._token
+        with default_context(INTERACTIVE):
+            try:
+                return self._post_raw(endpoint, data, **params), None
+            except HTTPError as e:
+                self._last_error = e
+                _LOGGER.error("HTTP Error Lyric API: %s" % e)
+                if isinstance(e, AuthError):
+                    self._lyricReauth(token)
+                return e.status_code, e
+            except LyricError as e:
+                self._last_error = e
+                _LOGGER.error("Error Lyric API: %s with data: %s" % (e, data))
+                return None, e
 
     def _checkCache(self, cache_key):
         """Check cache status."""
@@ -1151,47 +1859,163 @@ class Lyric(object):
     def _bust_cache_all(self):
         """Destroy Cache."""
 
-        self._cache = {}
+        with self._cache_lock:
+            self._cache = {}
 
     def _bust_cache(self, cache_key):
         """Destroy specific cache entry."""
 
-        self._cache[cache_key] = (None, 0)
+        with self._cache_lock:
+            self._cache[cache_key] = (None, 0)
+
+    def refresh(self, raise_errors=False):
+        """Refetch locations now, keeping the cached ones if that fails.
+
+        With raise_errors, a failed fetch raises its LyricError instead, also
+        while the fetch is backed off after an earlier failure.
+        """
+
+        with self._cache_lock:
+            value, _ = self._checkCache("locations")
+            self._cache["locations"] = (value, 0)
+        return self._load_locations(raise_errors)
+
+    def _index_entry(self, locationId):
+        """Return the index entry of a location in the current payload."""
+
+        locations = self._locations
+        if locations is None:
+            return None
+        with self._cache_lock:
+            if self._indexed is not locations:
+                self._reindex(locations)
+            return self._index.get(locationId)
+
+    def _reindex(self, locations):
+        """Index a locations payload.
+
+        Entries of the current index and of an index built during ingest are
+        reused for the locations that are the very same dicts, which covers
+        unchanged locations of ingested and of frozen payloads.
+        """
+
+        with self._cache_lock:
+            prebuilt, self._prebuilt = self._prebuilt, None
+            entries = {}
+            for index in (self._index, prebuilt or {}):
+                for entry in index.values():
+                    entries[id(entry.location)] = entry
+            index = {}
+            for location in locations:
+                entry = entries.get(id(location))
+                if entry is None or entry.location is not location:
+                    entry = _index_location(location)
+                index[location.get("locationID")] = entry
+            self._index = index
+            self._indexed = locations
 
     def _location(self, locationId):
         """Return location."""
 
-        for location in self._locations:
-            if location.get("locationID") == locationId:
-                return location
+        entry = self._index_entry(locationId)
+        if entry is not None:
+            return entry.location
 
     @property
     def _locations(self):
         """Return locations."""
 
+        return self._load_locations()
+
+    def _load_locations(self, raise_errors=False):
+        """Return locations, fetching them when stale.
+
+        A failed fetch returns the cached locations, or raises its LyricError
+        with raise_errors.
+        """
+
         cache_key = "locations"
         value, last_update = self._checkCache(cache_key)
         now = time.time()
 
-        if not value or now - last_update > self._cache_ttl:
-            new_value = self._get("locations")
-            if new_value:
-                self._cache[cache_key] = (new_value, now)
-                return new_value
+        if value and now - last_update <= self._cache_ttl:
+            return value
+        if not self._may_fetch(cache_key, now):
+            error = self._backoff.get(cache_key, (0, 0, None))[2]
+            if raise_errors and error is not None:
+                raise error
+            return value
+        try:
+            new_value = self._get_json("locations")
+        except DeadlineExceeded:
+            # Dropped for the caller's deadline, the API did not fail.
+            if raise_errors:
+                raise
+            return value
+        except LyricError as e:
+            self._retry_later(cache_key, e, now)
+            if raise_errors:
+                raise
+            return value
+        if not new_value:
+            self._retry_later(cache_key, None, now)
+            return value
+
+        if self._freeze_payloads:
+            new_value = freeze(new_value, value)
+        self._backoff.pop(cache_key, None)
+        with self._cache_lock:
+            if self._checkCache(cache_key)[1] > now:
+                # A fetch started later was stored meanwhile.
+                return self._checkCache(cache_key)[0]
+            self._cache[cache_key] = (new_value, now)
+        if self._history is not None:
+            self._history.record(new_value, now)
+        if self._search_index is not None:
+            self._search_index.update(self, new_value)
+        return new_value
+
+    def _may_fetch(self, cache_key, now):
+        """Return whether a failed fetch may be retried yet."""
+
+        backoff = self._backoff.get(cache_key)
+        return backoff is None or now >= backoff[1]
+
+    def _retry_later(self, cache_key, error, now):
+        """Back off from refetching a cache entry after a failed fetch.
+
+        Throttled and suspended endpoints are retried once the API or the
+        circuit breaker allows, rejected requests after cache_ttl and other
+        failures with an exponential backoff starting at 5 seconds.
+        """
+
+        failures = self._backoff.get(cache_key, (0, 0, None))[0] + 1
+        delay = getattr(error, "retry_after", None)
+        if delay is None:
+            if isinstance(error, PermanentError):
+                delay = self._cache_ttl
+            elif isinstance(error, AuthError):
+                delay = 5
             else:
-                self._cache[cache_key] = (
-                    value,
-                    last_update + 5,
-                )  # try again in 5 seconds
+                delay = min(self._cache_ttl, 5 * 2 ** (failures - 1))
+        self._backoff[cache_key] = (failures, now + delay, error)
 
-        return value
+    @property
+    def last_error(self):
+        """Return the error of the last failed request of any thread.
+
+        Use refresh(raise_errors=True), or the error passed to update
+        callbacks, for the error of a particular call.
+        """
+
+        return self._last_error
 
     def _user(self, locationId, userId):
         """Return user."""
 
-        for user in self._users(locationId):
-            if user.get("userID") == userId:
-                return user
+        entry = self._index_entry(locationId)
+        if entry is not None:
+            return entry.users.get(userId)
 
     def _users(self, locationId):
         """Return users."""
@@ -1202,51 +2026,340 @@ class Lyric(object):
     def _device(self, locationId, deviceId):
         """Return device."""
 
-        for device in self._devices(locationId):
-            if device.get("deviceID") == deviceId:
-                return device
+        entry = self._index_entry(locationId)
+        if entry is not None:
+            if self._pending_writes:
+                pending = self._pending_write(entry, deviceId)
+                if pending is not None:
+                    return pending.device
+                entry = self._index.get(locationId, entry)
+            return entry.devices.get(deviceId)
+
+    def _derived(self, locationId, deviceId):
+        """Return state derived from a device payload."""
+
+        entry = self._index_entry(locationId)
+        if entry is not None:
+            if self._pending_writes:
+                pending = self._pending_write(entry, deviceId)
+                if pending is not None:
+                    return pending.derived
+                entry = self._index.get(locationId, entry)
+            if deviceId in entry.derived:
+                return entry.derived[deviceId]
+        return {}
+
+    def _add_pending_write(self, device, overlay):
+        """Overlay a write on reads of a device until the server confirms it."""
+
+        key = (device._locationId, device.id)
+        now = time.time()
+        pending = self._pending_writes.get(key)
+        if pending is not None:
+            overlay = _merge(pending.overlay, overlay)
+        self._pending_writes[key] = _PendingWrite(
+            overlay,
+            device._endpoint + device.id,
+            now + self._confirm_timeout,
+            now + self._confirm_interval,
+        )
+
+    def _pending_write(self, entry, deviceId):
+        """Return the pending write of a device, confirming it when due."""
+
+        key = (entry.location.get("locationID"), deviceId)
+        pending = self._pending_writes.get(key)
+        if pending is None:
+            return None
+        device = entry.devices.get(deviceId)
+        now = time.time()
+
+        if device is not None and _contains(device, pending.overlay):
+            self._pending_writes.pop(key, None)
+            return None
+        if now > pending.expires:
+            _LOGGER.debug("Write to %s was not confirmed in time" % deviceId)
+            self._pending_writes.pop(key, None)
+            self._bust_cache("locations")
+            return None
+        if now >= pending.next_check:
+            pending.next_check = now + self._confirm_interval
+            try:
+                fetched = self._location_get(key[0], pending.endpoint)
+            except DeadlineExceeded:
+                fetched = None
+            if fetched and _contains(fetched, pending.overlay):
+                self._pending_writes.pop(key, None)
+                self._replace_device(key[0], fetched)
+                return None
+
+        if device is None:
+            return None
+        if pending.base is not device:
+            pending.base = device
+            pending.device = _merge(device, pending.overlay)
+            if deviceId in entry.derived:
+                pending.derived = _thermostat_derived(pending.device, entry.location)
+            else:
+                pending.derived = {}
+        return pending
+
+    def _refresh_device(self, locationId, endpoint):
+        """Fetch a single device and replace it in the cache."""
+
+        try:
+            device = self._location_get(locationId, endpoint)
+        except DeadlineExceeded:
+            return False
+        if not device:
+            return False
+        self._replace_device(locationId, device)
+        if self._history is not None:
+            self._history.record([{"devices": [device]}])
+        return True
+
+    def _replace_device(self, locationId, device):
+        """Replace a single device in the cached locations payload."""
+
+        self._replace_devices([(locationId, device)])
+
+    def _replace_devices(self, replacements):
+        """Replace devices in the cached locations payload in one swap.
+
+        ``replacements`` is a list of ``(locationId, device)`` tuples. The
+        payload is copied and reindexed once for all of them, only for the
+        locations that changed. It is read and written back under the cache
+        lock, so a payload fetched meanwhile by another thread is never
+        reverted. The cached device lists of the locations are updated in
+        the same swap.
+        """
+
+        with self._cache_lock:
+            for locationId, device in replacements:
+                self._replace_listed_device(locationId, device)
+            value, last_update = self._checkCache("locations")
+            if not value:
+                return
+            if self._indexed is not value:
+                self._reindex(value)
+            index = self._index
+
+            changed = {}
+            for locationId, device in replacements:
+                if self._freeze_payloads:
+                    entry = index.get(locationId)
+                    if entry is not None:
+                        device = freeze(
+                            device, entry.devices.get(device.get("deviceID"))
+                        )
+                changed.setdefault(locationId, {})[device.get("deviceID")] = device
+
+            index = dict(index)
+            locations = []
+            for location in value:
+                devices = changed.get(location.get("locationID"))
+                if devices:
+                    previous = location
+                    location = dict(location)
+                    location["devices"] = [
+                        devices.get(item.get("deviceID"), item)
+                        for item in location.get("devices") or []
+                    ]
+                    if self._freeze_payloads:
+                        location = freeze(location, previous)
+                    index[location.get("locationID")] = _index_location(location)
+                locations.append(location)
+
+            if self._freeze_payloads:
+                locations = tuple(locations)
+            self._cache["locations"] = (locations, last_update)
+            self._index = index
+            self._indexed = locations
+        if self._search_index is not None:
+            for locationId, devices in changed.items():
+                for device in devices.values():
+                    self._search_index.update_device(self, locationId, device)
+
+    def _replace_listed_device(self, locationId, device):
+        """Replace a device in the cached device lists of its location."""
+
+        deviceId = device.get("deviceID")
+        devices_key = "devices-%s" % locationId
+        prefix = "devices_type-%s_" % locationId
+        for cache_key, (value, last_update) in list(self._cache.items()):
+            if cache_key != devices_key and not cache_key.startswith(prefix):
+                continue
+            if not isinstance(value, (list, tuple)):
+                continue
+            if not any(item.get("deviceID") == deviceId for item in value):
+                continue
+            devices = [
+                device if item.get("deviceID") == deviceId else item for item in value
+            ]
+            if self._freeze_payloads:
+                devices = freeze(devices, value)
+            self._cache[cache_key] = (devices, last_update)
 
     def _devices(self, locationId, forceGet=False):
         """Return devices."""
 
         if forceGet:
-            cache_key = "devices-%s" % locationId
-            value, last_update = self._checkCache(cache_key)
-            now = time.time()
-
-            if not value or now - last_update > self._cache_ttl:
-                new_value = self._get("devices", locationId=locationId)
-                if new_value:
-                    self._cache[cache_key] = (new_value, now)
-                    return new_value
+            return self._location_cached(
+                "devices-%s" % locationId, locationId, "devices"
+            )
         else:
-            if self._location(locationId):
-                return self._location(locationId).get("devices")
+            location = self._location(locationId)
+            if location:
+                return location.get("devices")
             else:
                 return None
 
-        return value
-
     def _device_type(self, locationId, deviceType, deviceId):
         """Return devices of a specific type."""
 
-        for device in self._devices_type(deviceType, locationId):
+        for device in self._devices_type(deviceType, locationId) or []:
             if device.get("deviceID") == deviceId:
                 return device
 
     def _devices_type(self, deviceType, locationId):
         """Return device type."""
 
-        cache_key = "devices_type-%s_%s" % (locationId, deviceType)
+        return self._location_cached(
+            "devices_type-%s_%s" % (locationId, deviceType),
+            locationId,
+            "devices/" + deviceType,
+        )
+
+    def _location_cached(self, cache_key, locationId, endpoint):
+        """Return a location scoped endpoint through the cache.
+
+        A failed fetch is remembered for negative_cache_ttl seconds, serving
+        the previous value if there is one, so a broken location is not
+        requested again on every property read.
+        """
+
         value, last_update = self._checkCache(cache_key)
         now = time.time()
+        if value is _NEGATIVE:
+            if now - last_update <= self._negative_cache_ttl:
+                return None
+            value = None
+        elif value is not None and now - last_update <= self._cache_ttl:
+            return value
+
+        try:
+            new_value = self._location_get(locationId, endpoint)
+        except DeadlineExceeded:
+            # Dropped for the caller's deadline, the API did not fail.
+            return value
+        if new_value is None:
+            with self._cache_lock:
+                if value is None:
+                    self._cache[cache_key] = (_NEGATIVE, now)
+                else:
+                    self._cache[cache_key] = (
+                        value,
+                        now - self._cache_ttl + self._negative_cache_ttl,
+                    )
+            return value
 
-        if not value or now - last_update > self._cache_ttl:
-            value = self._get("devices/" + deviceType, locationId=locationId)
-            self._cache[cache_key] = (value, now)
+        if self._freeze_payloads:
+            new_value = freeze(new_value, value)
+        with self._cache_lock:
+            self._cache[cache_key] = (new_value, now)
+        return new_value
 
+    def _location_get(self, locationId, endpoint, **params):
+        """Get a location scoped endpoint, guarded by the location's circuit.
+
+        Returns None when the request failed or the location's circuit is
+        open after repeated failures. Raises DeadlineExceeded when the
+        request was dropped for the deadline of its request context, which
+        says nothing about the location.
+        """
+
+        try:
+            self._location_breaker.check(locationId)
+        except CircuitOpenError as e:
+            _LOGGER.debug("Error Lyric API: %s" % e)
+            return None
+        try:
+            value = self._get_json(endpoint, locationId=locationId, **params)
+        except (TransientError, TransportError) as e:
+            self._location_breaker.failure(locationId, getattr(e, "retry_after", None))
+            return None
+        except DeadlineExceeded:
+            raise
+        except LyricError:
+            return None
+        self._location_breaker.success(locationId)
         return value
 
+    def _bulk_write(self, device, changes):
+        """Send a single update of a bulk write."""
+
+        try:
+            if not isinstance(device, Thermostat):
+                raise ValueError("%r does not support updates" % device)
+            data = device._update_data(**changes)
+            if device._unchanged(data):
+                return WriteResult(device, None, None)
+            status_code = self._post_raw(
+                "devices/thermostats/" + device.id,
+                data,
+                locationId=device._locationId,
+            )
+            return WriteResult(device, status_code, None)
+        except HTTPError as e:
+            _LOGGER.error("HTTP Error Lyric API: %s" % e)
+            return WriteResult(device, e.status_code, e)
+        except LyricError as e:
+            _LOGGER.error("Error Lyric API: %s with data: %s" % (e, changes))
+            return WriteResult(device, None, e)
+        except ValueError as e:
+            return WriteResult(device, None, e)
+
+    def bulk_update(self, changes, max_workers=8):
+        """Update many thermostats concurrently.
+
+        ``changes`` is a list of ``(thermostat, kwargs)`` tuples where kwargs
+        are the keyword arguments of ``Thermostat.updateThermostat``. Returns
+        a WriteResult per change, in order. Updates that would not change
+        anything are not sent and have neither a status code nor an error.
+        The updates run within the caller's request context, those not sent
+        before its deadline fail with DeadlineExceeded.
+        """
+
+        import concurrent.futures
+
+        changes = list(changes)
+        context = current_context()
+
+        def write(change):
+            with use_context(context):
+                return self._bulk_write(*change)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            results = list(executor.map(write, changes))
+
+        if any(result.status_code == 401 for result in results):
+            self._lyricReauth()
+        if self._read_your_writes:
+            for (device, kwargs), result in zip(changes, results):
+                if result.status_code is not None and result.error is None:
+                    data = device._update_data(**kwargs)
+                    self._add_pending_write(device, {"changeableValues": data})
+        elif any(result.status_code is not None for result in results):
+            self._bust_cache_all()
+        return results
+
+    def fleet_state(self, use_numpy=None):
+        """Return the cached state of all devices as columnar FleetState."""
+
+        from .analytics import FleetState
+
+        return FleetState.from_lyric(self, use_numpy=use_numpy)
+
     @property
     def locations(self):
         """Return locations."""
@@ -0,0 +1,60 @@
+#  -*- coding:utf-8 -*-
+
+"""Command line entry point, ``python -m lyric serve``."""
+
+import argparse
+import logging
+import os
+import sys
+
+from . import Lyric
+from .server import DEFAULT_PORT, serve
+
+
+def main(argv=None):
+    """Run the command line."""
+
+    parser = argparse.ArgumentParser(prog="python -m lyric")
+    subparsers = parser.add_subparsers(dest="command")
+
+    serve_parser = subparsers.add_parser(
+        "serve", help="poll the Lyric API and serve its state locally"
+    )
+    serve_parser.add_argument(
+        "--client-id", default=os.environ.get("LYRIC_CLIENT_ID")
+    )
+    serve_parser.add_argument(
+        "--client-secret", default=os.environ.get("LYRIC_CLIENT_SECRET")
+    )
+    serve_parser.add_argument(
+        "--token-cache-file", default=os.environ.get("LYRIC_TOKEN_CACHE_FILE")
+    )
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    serve_parser.add_argument("--socket", help="listen on a Unix socket instead")
+    serve_parser.add_argument(
+        "--interval", type=float, help="seconds between polls, defaults to cache ttl"
+    )
+    serve_parser.add_argument("--cache-ttl", type=float, default=270)
+    serve_parser.add_argument("-v", "--verbose", action="store_true")
+
+    args = parser.parse_args(argv)
+    if args.command != "serve":
+        parser.print_help()
+        return 2
+    if not args.client_id or not args.client_secret or not args.token_cache_file:
+        parser.error("--client-id, --client-secret and --token-cache-file are required")
+
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.INFO)
+    lyric_api = Lyric(
+        args.client_id,
+        args.client_secret,
+        cache_ttl=args.cache_ttl,
+        token_cache_file=args.token_cache_file,
+    )
+    serve(lyric_api, args.host, args.port, args.socket, args.interval)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#  -*- coding:utf-8 -*-
+
+"""Fast polling lane for water leak detector alarms."""
+
+import logging
+import threading
+
+from . import Location, WaterLeakDetector, _RateLimiter
+from .context import INTERACTIVE, request_context
+from .exceptions import DeadlineExceeded
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _alarm_keys(device):
+    """Return what identifies the active alarms of a detector payload."""
+
+    keys = set()
+    if device.get("waterPresent"):
+        keys.add("waterPresent")
+    for alarm in device.get("currentAlarms") or []:
+        if isinstance(alarm, dict):
+            alarm = tuple(sorted((key, repr(value)) for key, value in alarm.items()))
+        keys.add(repr(alarm))
+    return frozenset(keys)
+
+
+class AlarmLane(object):
+    """Poll only water leak detectors, on their own short interval.
+
+    Every interval seconds ``devices/waterLeakDetectors`` is fetched for
+    each location that has a detector, and the detectors of all locations
+    are replaced in the cached locations payload at once.
+    ``callback(detector)`` is called when ``waterPresent`` or an alarm
+    first appears on a detector. The lane's requests are sent at
+    interactive priority, so with ``max_connections`` set on the Lyric
+    instance they get a connection before thermostat reads and background
+    polls. They still count against the Lyric rate limit. ``rate_limit``
+    caps the requests per second of the lane itself, so a fleet with many
+    detector locations does not use up the rate limit of the others.
+    """
+
+    def __init__(self, lyric_api, interval=10, rate_limit=None, callback=None):
+        """Initialize and configure the AlarmLane class."""
+
+        self._lyric_api = lyric_api
+        self._interval = interval
+        self._callback = callback
+        self._rate_limiter = None
+        if rate_limit is not None:
+            self._rate_limiter = _RateLimiter(rate_limit)
+        self._alarms = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: every %ss>" % (self.__class__.__name__, self._interval)
+
+    @property
+    def alarms(self):
+        """Return the ids of detectors with an active alarm."""
+
+        return [deviceId for deviceId, keys in self._alarms.items() if keys]
+
+    def start(self):
+        """Start polling in a background thread."""
+
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="lyric-alarm-lane", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Poll until stopped."""
+
+        while not self._stopped.is_set():
+            try:
+                self.poll()
+            except Exception:  # noqa: B902
+                _LOGGER.exception("Error polling water leak detectors")
+            self._stopped.wait(self._interval)
+
+    def _location_ids(self):
+        """Return the ids of locations with a water leak detector."""
+
+        return [
+            location.get("locationID")
+            for location in self._lyric_api._locations or []
+            if any(
+                device.get("deviceType") == "Water Leak Detector"
+                for device in location.get("devices") or []
+            )
+        ]
+
+    def poll(self):
+        """Fetch the detectors of every location once."""
+
+        replacements = []
+        with request_context(priority=INTERACTIVE):
+            for locationId in self._location_ids():
+                if self._rate_limiter is not None:
+                    self._rate_limiter.acquire()
+                try:
+                    devices = self._lyric_api._location_get(
+                        locationId, "devices/waterLeakDetectors"
+                    )
+                except DeadlineExceeded:
+                    break
+                for device in devices or []:
+                    replacements.append((locationId, device))
+        if replacements:
+            self._lyric_api._replace_devices(replacements)
+        for locationId, device in replacements:
+            self._check(locationId, device)
+
+    def _check(self, locationId, device):
+        """Call the callback for alarms that were not active before."""
+
+        deviceId = device.get("deviceID")
+        keys = _alarm_keys(device)
+        previous = self._alarms.get(deviceId, frozenset())
+        self._alarms[deviceId] = keys
+        if not keys - previous or self._callback is None:
+            return
+
+        local_time = self._lyric_api._local_time
+        location = Location(locationId, self._lyric_api, local_time)
+        detector = WaterLeakDetector(deviceId, location, self._lyric_api, local_time)
+        try:
+            self._callback(detector)
+        except Exception:  # noqa: B902
+            _LOGGER.exception("Error in alarm callback")
@@ -0,0 +1,263 @@
+#  -*- coding:utf-8 -*-
+
+"""Columnar analytics over the cached state of a device fleet.
+
+NumPy is used when it is installed, otherwise columns are plain lists.
+"""
+
+import operator
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+NUMERIC_COLUMNS = (
+    "indoorTemperature",
+    "outdoorTemperature",
+    "indoorHumidity",
+    "heatSetpoint",
+    "coolSetpoint",
+    "temperatureSetpoint",
+    "setpointDeviation",
+    "batteryRemaining",
+)
+OBJECT_COLUMNS = (
+    "locationId",
+    "deviceId",
+    "deviceType",
+    "deviceClass",
+    "name",
+    "mode",
+    "isAlive",
+    "waterPresent",
+    "isDeviceOffline",
+)
+COLUMNS = OBJECT_COLUMNS + NUMERIC_COLUMNS
+
+_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+def _number(value):
+    """Return value as a float, or None when it is not a number."""
+
+    if isinstance(value, bool):
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _row(locationId, device):
+    """Flatten a device payload into a fleet row."""
+
+    changeableValues = device.get("changeableValues") or {}
+    currentSensorReadings = device.get("currentSensorReadings") or {}
+    mode = changeableValues.get("mode")
+    heatSetpoint = _number(changeableValues.get("heatSetpoint"))
+    coolSetpoint = _number(changeableValues.get("coolSetpoint"))
+    temperatureSetpoint = heatSetpoint if mode == "Heat" else coolSetpoint
+
+    indoorTemperature = _number(device.get("indoorTemperature"))
+    if indoorTemperature is None:
+        indoorTemperature = _number(currentSensorReadings.get("temperature"))
+    indoorHumidity = _number(device.get("indoorHumidity"))
+    if indoorHumidity is None:
+        indoorHumidity = _number(currentSensorReadings.get("humidity"))
+
+    setpointDeviation = None
+    if indoorTemperature is not None and temperatureSetpoint is not None:
+        setpointDeviation = abs(indoorTemperature - temperatureSetpoint)
+
+    return {
+        "locationId": locationId,
+        "deviceId": device.get("deviceID"),
+        "deviceType": device.get("deviceType"),
+        "deviceClass": device.get("deviceClass"),
+        "name": device.get("name", device.get("userDefinedDeviceName")),
+        "mode": mode,
+        "isAlive": device.get("isAlive"),
+        "waterPresent": device.get("waterPresent"),
+        "isDeviceOffline": device.get("isDeviceOffline"),
+        "indoorTemperature": indoorTemperature,
+        "outdoorTemperature": _number(device.get("outdoorTemperature")),
+        "indoorHumidity": indoorHumidity,
+        "heatSetpoint": heatSetpoint,
+        "coolSetpoint": coolSetpoint,
+        "temperatureSetpoint": temperatureSetpoint,
+        "setpointDeviation": setpointDeviation,
+        "batteryRemaining": _number(device.get("batteryRemaining")),
+    }
+
+
+class FleetState(object):
+    """Columnar snapshot of the cached state of every device."""
+
+    def __init__(self, columns, use_numpy=None):
+        """Initialize FleetState from a mapping of column name to values."""
+
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        if use_numpy and numpy is None:
+            raise ValueError("numpy is not installed")
+        self._numpy = use_numpy
+        self._columns = {}
+        for name in COLUMNS:
+            values = columns.get(name, [])
+            if use_numpy and not isinstance(values, numpy.ndarray):
+                if name in NUMERIC_COLUMNS:
+                    values = numpy.array(
+                        [numpy.nan if value is None else value for value in values],
+                        dtype=float,
+                    )
+                else:
+                    values = numpy.array(values, dtype=object)
+            self._columns[name] = values
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s devices>" % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        """Return the number of devices."""
+
+        return len(self._columns["deviceId"])
+
+    @classmethod
+    def from_locations(cls, locations, use_numpy=None):
+        """Build FleetState from a locations payload."""
+
+        columns = {name: [] for name in COLUMNS}
+        for location in locations or []:
+            locationId = location.get("locationID")
+            for device in location.get("devices") or []:
+                for name, value in _row(locationId, device).items():
+                    columns[name].append(value)
+        return cls(columns, use_numpy)
+
+    @classmethod
+    def from_lyric(cls, *lyric_apis, **kwargs):
+        """Build FleetState from the cached locations of one or more accounts."""
+
+        locations = []
+        for lyric_api in lyric_apis:
+            locations.extend(lyric_api._locations or [])
+        return cls.from_locations(locations, **kwargs)
+
+    def column(self, name):
+        """Return a column as a list, missing numbers are None."""
+
+        values = self._columns[name]
+        if self._numpy:
+            if name in NUMERIC_COLUMNS:
+                return [
+                    None if numpy.isnan(value) else float(value) for value in values
+                ]
+            return values.tolist()
+        return list(values)
+
+    def rows(self):
+        """Return the devices as a list of dicts."""
+
+        columns = [(name, self.column(name)) for name in COLUMNS]
+        return [
+            {name: values[index] for name, values in columns}
+            for index in range(len(self))
+        ]
+
+    def _mask(self, name, op, value):
+        """Return the selection mask of a condition."""
+
+        values = self._columns[name]
+        if op == "in":
+            value = set(value)
+            if self._numpy:
+                return numpy.array([item in value for item in values], dtype=bool)
+            return [item in value for item in values]
+        if op not in _OPERATORS:
+            raise ValueError("Unsupported operator: %s" % op)
+        compare = _OPERATORS[op]
+        if self._numpy:
+            if name in NUMERIC_COLUMNS:
+                # NaN compares unequal to everything, missing never matches.
+                with numpy.errstate(invalid="ignore"):
+                    return compare(values, value) & ~numpy.isnan(values)
+            return numpy.array([compare(item, value) for item in values], dtype=bool)
+        if name in NUMERIC_COLUMNS:
+            return [item is not None and compare(item, value) for item in values]
+        return [compare(item, value) for item in values]
+
+    def where(self, name, op, value):
+        """Return the devices whose column matches a condition.
+
+        ``op`` is one of ``<``, ``<=``, ``>``, ``>=``, ``==``, ``!=`` or
+        ``in``. Devices missing a numeric value never match.
+        """
+
+        mask = self._mask(name, op, value)
+        if self._numpy:
+            columns = {key: values[mask] for key, values in self._columns.items()}
+        else:
+            columns = {
+                key: [item for item, keep in zip(values, mask) if keep]
+                for key, values in self._columns.items()
+            }
+        return FleetState(columns, self._numpy)
+
+    def aggregate(self, name, how="mean", by=None):
+        """Aggregate a column, optionally grouped by another column.
+
+        ``how`` is one of ``count``, ``sum``, ``mean``, ``min`` or ``max``.
+        Missing numbers are ignored and empty groups aggregate to None.
+        """
+
+        if how not in ("count", "sum", "mean", "min", "max"):
+            raise ValueError("how must be one of count, sum, mean, min or max")
+        if by is None:
+            return self._aggregate(self._columns[name], name, how)
+
+        groups = {}
+        for index, key in enumerate(self._columns[by]):
+            groups.setdefault(key, []).append(index)
+        result = {}
+        for key, indexes in groups.items():
+            if self._numpy:
+                values = self._columns[name][numpy.array(indexes, dtype=int)]
+            else:
+                values = [self._columns[name][index] for index in indexes]
+            result[key] = self._aggregate(values, name, how)
+        return result
+
+    def _aggregate(self, values, name, how):
+        """Aggregate the values of one group."""
+
+        if name not in NUMERIC_COLUMNS:
+            if how != "count":
+                raise ValueError("Only count is supported for column %s" % name)
+            return sum(1 for value in values if value is not None)
+
+        if self._numpy:
+            values = values[~numpy.isnan(values)]
+            if how == "count":
+                return int(values.size)
+            if not values.size:
+                return None
+            return float(getattr(numpy, how)(values))
+
+        values = [value for value in values if value is not None]
+        if how == "count":
+            return len(values)
+        if not values:
+            return None
+        if how == "mean":
+            return sum(values) / len(values)
+        return {"sum": sum, "min": min, "max": max}[how](values)
@@ -0,0 +1,334 @@
+#  -*- coding:utf-8 -*-
+
+"""Durable queue of device commands retried in the background."""
+
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+from . import _merge
+from .context import RequestContext, current_context, use_context
+from .exceptions import (
+    CircuitOpenError,
+    DeadlineExceeded,
+    HTTPError,
+    LyricError,
+    TransportError,
+)
+
+_LOGGER = logging.getLogger(__name__)
+
+# Status codes worth retrying, other client errors will never succeed.
+RETRY_STATUS_CODES = (401, 408, 409, 423, 429)
+
+
+class CommandQueue(object):
+    """Store commands in SQLite and post them until they succeed.
+
+    A command for an endpoint that still has a pending command is merged
+    into it, so only the latest setpoint or mode is ever sent and earlier
+    changes to other values are kept. The merged command keeps its id and
+    the callbacks of all the commands merged into it. ``on_complete`` is
+    called as ``on_complete(command_id, status_code, error)`` once a command
+    succeeded or failed permanently. Only client errors with a status code
+    not in RETRY_STATUS_CODES fail a command permanently, other errors are
+    retried with backoff.
+
+    A command keeps the deadline and priority of the request context it was
+    queued in. It is posted and retried at that priority, and fails with
+    DeadlineExceeded instead of being sent once the deadline passed.
+    """
+
+    def __init__(
+        self,
+        path,
+        backoff=5,
+        max_backoff=300,
+        max_attempts=None,
+        on_complete=None,
+    ):
+        """Initialize and configure the CommandQueue class."""
+
+        self._path = path
+        self._backoff = backoff
+        self._max_backoff = max_backoff
+        self._max_attempts = max_attempts
+        self._on_complete = on_complete
+        self._callbacks = {}
+        self._lyric_api = None
+        self._thread = None
+        self._inflight = None
+        self._stopped = False
+        self._condition = threading.Condition()
+
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS commands ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "endpoint TEXT NOT NULL UNIQUE, "
+                "data TEXT NOT NULL, "
+                "params TEXT NOT NULL, "
+                "attempts INTEGER NOT NULL DEFAULT 0, "
+                "next_attempt REAL NOT NULL, "
+                "deadline REAL, "
+                "priority INTEGER NOT NULL DEFAULT 1)"
+            )
+            columns = [
+                row[1] for row in self._db.execute("PRAGMA table_info(commands)")
+            ]
+            if "deadline" not in columns:
+                # Queue created before commands had a deadline.
+                self._db.execute("ALTER TABLE commands ADD COLUMN deadline REAL")
+                self._db.execute(
+                    "ALTER TABLE commands "
+                    "ADD COLUMN priority INTEGER NOT NULL DEFAULT 1"
+                )
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s pending>" % (self.__class__.__name__, len(self))
+
+    def __len__(self):
+        """Return the number of pending commands."""
+
+        with self._condition:
+            return self._db.execute("SELECT COUNT(*) FROM commands").fetchone()[0]
+
+    def start(self, lyric_api):
+        """Start posting commands through a Lyric instance."""
+
+        self._lyric_api = lyric_api
+        if self._thread is None:
+            self._stopped = False
+            self._thread = threading.Thread(
+                target=self._run, name="lyric-command-queue", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop the background worker, pending commands stay on disk."""
+
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def close(self):
+        """Stop the worker and close the database."""
+
+        self.stop()
+        self._db.close()
+
+    def put(self, endpoint, data, callback=None, **params):
+        """Queue a command, merging it into a pending one for the endpoint.
+
+        Returns the id of the command carrying the changes.
+        """
+
+        context = current_context()
+        deadline = None
+        if context.deadline is not None:
+            # Stored as wall clock time, the queue outlives the process.
+            deadline = time.time() + context.remaining()
+        with self._condition:
+            pending = self._db.execute(
+                "SELECT id, data, priority FROM commands WHERE endpoint = ?",
+                (endpoint,),
+            ).fetchone()
+            with self._db:
+                if pending is not None:
+                    data = _merge(json.loads(pending[1]), data)
+                if pending is not None and pending[0] != self._inflight:
+                    command_id = pending[0]
+                    self._db.execute(
+                        "UPDATE commands SET data = ?, params = ?, deadline = ?, "
+                        "priority = ? WHERE id = ?",
+                        (
+                            json.dumps(data),
+                            json.dumps(params),
+                            deadline,
+                            min(pending[2], context.priority),
+                            command_id,
+                        ),
+                    )
+                else:
+                    if pending is not None:
+                        # Being posted, it reports its own outcome once its
+                        # post returns, this command carries its changes on.
+                        self._db.execute(
+                            "DELETE FROM commands WHERE id = ?", (pending[0],)
+                        )
+                    cursor = self._db.execute(
+                        "INSERT INTO commands "
+                        "(endpoint, data, params, next_attempt, deadline, priority) "
+                        "VALUES (?, ?, ?, ?, ?, ?)",
+                        (
+                            endpoint,
+                            json.dumps(data),
+                            json.dumps(params),
+                            time.time(),
+                            deadline,
+                            context.priority,
+                        ),
+                    )
+                    command_id = cursor.lastrowid
+            if callback is not None:
+                self._callbacks.setdefault(command_id, []).append(callback)
+            self._condition.notify_all()
+        return command_id
+
+    def pending(self, endpoint):
+        """Return the body of the command queued for an endpoint, or None."""
+
+        with self._condition:
+            row = self._db.execute(
+                "SELECT data FROM commands WHERE endpoint = ?", (endpoint,)
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def _next(self):
+        """Return the next command to post, waiting until one is due.
+
+        Of the commands that are due, those of higher priority go first.
+        """
+
+        with self._condition:
+            while not self._stopped:
+                row = self._db.execute(
+                    "SELECT id, endpoint, data, params, attempts, next_attempt, "
+                    "deadline, priority "
+                    "FROM commands ORDER BY next_attempt > ?, priority, next_attempt "
+                    "LIMIT 1",
+                    (time.time(),),
+                ).fetchone()
+                if row is None:
+                    self._condition.wait()
+                    continue
+                wait = row[5] - time.time()
+                if wait <= 0:
+                    self._inflight = row[0]
+                    return row
+                self._condition.wait(wait)
+
+    def _run(self):
+        """Post due commands until stopped."""
+
+        while True:
+            row = self._next()
+            if row is None:
+                return
+            command_id, endpoint, data, params, attempts, _, deadline, priority = row
+            context = RequestContext(None, priority)
+            if deadline is not None:
+                context.deadline = time.monotonic() + deadline - time.time()
+            try:
+                with use_context(context):
+                    try:
+                        status_code = self._lyric_api._post_raw(
+                            endpoint, json.loads(data), **json.loads(params)
+                        )
+                    except HTTPError as e:
+                        if e.status_code == 401:
+                            self._lyric_api._lyricReauth()
+                        raise
+            except HTTPError as e:
+                status_code = e.status_code
+                _LOGGER.error("HTTP Error Lyric API: %s" % e)
+                if status_code in RETRY_STATUS_CODES or status_code >= 500:
+                    self._retry(command_id, attempts, deadline, status_code, e)
+                else:
+                    self._finish(command_id, status_code, e)
+            except TransportError as e:
+                _LOGGER.error("Error Lyric API: %s with data: %s" % (e, data))
+                self._retry(command_id, attempts, deadline, None, e)
+            except CircuitOpenError as e:
+                self._retry(command_id, attempts, deadline, None, e, e.retry_after)
+            except DeadlineExceeded as e:
+                _LOGGER.warning("Dropped command %s: %s" % (command_id, e))
+                self._finish(command_id, None, e)
+            except LyricError as e:
+                # Such as no token being available yet.
+                _LOGGER.error("Error Lyric API: %s with data: %s" % (e, data))
+                self._retry(command_id, attempts, deadline, None, e)
+            except Exception as e:  # noqa: B902
+                _LOGGER.exception("Unexpected error posting command %s" % command_id)
+                self._finish(command_id, None, e)
+            else:
+                with use_context(context):
+                    self._refresh(endpoint, json.loads(params))
+                self._finish(command_id, status_code, None)
+
+    def _refresh(self, endpoint, params):
+        """Refresh the device a command was posted to.
+
+        Falls back to dropping the cache when the device can't be fetched.
+        """
+
+        # A device endpoint, or one of its settings such as .../fan.
+        device_endpoint = "/".join(endpoint.split("/")[:3])
+        if not self._lyric_api._refresh_device(
+            params.get("locationId"), device_endpoint
+        ):
+            self._lyric_api._bust_cache_all()
+
+    def _retry(self, command_id, attempts, deadline, status_code, error, delay=None):
+        """Schedule a failed command again with exponential backoff.
+
+        A command whose next attempt would come after its deadline fails now.
+        """
+
+        attempts += 1
+        if self._max_attempts is not None and attempts >= self._max_attempts:
+            self._finish(command_id, status_code, error)
+            return
+        if delay is None:
+            delay = getattr(error, "retry_after", None)
+        if delay is None:
+            delay = min(self._max_backoff, self._backoff * 2 ** (attempts - 1))
+        if deadline is not None and time.time() + delay > deadline:
+            _LOGGER.warning("Dropped command %s, retry past its deadline" % command_id)
+            self._finish(
+                command_id,
+                status_code,
+                DeadlineExceeded("Deadline passed before retrying: %s" % error),
+            )
+            return
+        with self._condition:
+            self._inflight = None
+            with self._db:
+                cursor = self._db.execute(
+                    "UPDATE commands SET attempts = ?, next_attempt = ? WHERE id = ?",
+                    (attempts, time.time() + delay, command_id),
+                )
+        if cursor.rowcount == 0:
+            # Superseded while it was being posted.
+            self._complete(command_id, status_code, error)
+
+    def _finish(self, command_id, status_code, error):
+        """Remove a command and report its outcome."""
+
+        with self._condition:
+            self._inflight = None
+            with self._db:
+                self._db.execute("DELETE FROM commands WHERE id = ?", (command_id,))
+        self._complete(command_id, status_code, error)
+
+    def _complete(self, command_id, status_code, error):
+        """Call the callbacks of a command."""
+
+        callbacks = self._callbacks.pop(command_id, []) + [self._on_complete]
+        for callback in callbacks:
+            if callback is None:
+                continue
+            try:
+                callback(command_id, status_code, error)
+            except Exception:  # noqa: B902
+                _LOGGER.exception("Error in command callback")
@@ -0,0 +1,126 @@
+#  -*- coding:utf-8 -*-
+
+"""Deadlines and priorities of the requests made on a thread."""
+
+import contextlib
+import threading
+import time
+
+from .exceptions import DeadlineExceeded
+
+# Priority classes, lower values are sent first.
+INTERACTIVE = 0
+NORMAL = 1
+BACKGROUND = 2
+
+_local = threading.local()
+
+
+class RequestContext(object):
+    """Deadline and priority of the requests made within it.
+
+    ``deadline`` is a ``time.monotonic()`` value, or None for no deadline.
+    """
+
+    def __init__(self, deadline=None, priority=NORMAL):
+        """Initialize and configure the RequestContext class."""
+
+        self.deadline = deadline
+        self.priority = priority
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: priority %s, %s>" % (
+            self.__class__.__name__,
+            self.priority,
+            "no deadline"
+            if self.deadline is None
+            else "%.3fs left" % self.remaining(),
+        )
+
+    def remaining(self):
+        """Return the seconds left until the deadline, or None without one."""
+
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def expired(self):
+        """Return whether the deadline passed."""
+
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+    def check(self, what):
+        """Raise DeadlineExceeded if the deadline passed before what."""
+
+        if self.expired():
+            raise DeadlineExceeded("Deadline passed before %s" % what)
+
+    def timeout(self, what):
+        """Return the timeout for what, or None without a deadline.
+
+        Raises DeadlineExceeded instead of returning a timeout that is not
+        positive, which HTTP clients reject.
+        """
+
+        if self.deadline is None:
+            return None
+        timeout = self.deadline - time.monotonic()
+        if timeout <= 0:
+            raise DeadlineExceeded("Deadline passed before %s" % what)
+        return timeout
+
+
+_DEFAULT = RequestContext()
+
+
+def current_context():
+    """Return the request context of the current thread."""
+
+    return getattr(_local, "context", None) or _DEFAULT
+
+
+@contextlib.contextmanager
+def use_context(context):
+    """Make the requests of the current thread within context.
+
+    Used to carry a context over to worker threads.
+    """
+
+    previous = getattr(_local, "context", None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+
+def request_context(timeout=None, priority=None):
+    """Bound the requests made within the returned context manager.
+
+    Requests made after timeout seconds from now are dropped with
+    DeadlineExceeded instead of being sent, and waiting for a connection,
+    the rate limiter or a token refresh gives up at that point. Requests
+    of higher priority get a connection first. Nested contexts can only
+    shorten the deadline of the context around them, and inherit its
+    priority unless one is given.
+    """
+
+    outer = current_context()
+    deadline = outer.deadline
+    if timeout is not None:
+        deadline = time.monotonic() + timeout
+        if outer.deadline is not None:
+            deadline = min(deadline, outer.deadline)
+    if priority is None:
+        priority = outer.priority
+    return use_context(RequestContext(deadline, priority))
+
+
+def default_context(priority):
+    """Run at priority unless the caller made its own request context."""
+
+    if getattr(_local, "context", None) is not None:
+        return contextlib.nullcontext()
+    return use_context(RequestContext(None, priority))
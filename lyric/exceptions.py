@@ -0,0 +1,64 @@
+#  -*- coding:utf-8 -*-
+
+"""Exceptions raised by the lyric library."""
+
+
+class LyricError(Exception):
+    """Base class of lyric errors."""
+
+
+class TransportError(LyricError):
+    """Request failed before a response was received."""
+
+
+class HTTPError(LyricError):
+    """API responded with an error status code."""
+
+    def __init__(self, message, response=None):
+        """Initialize the error with the response that caused it."""
+
+        super(HTTPError, self).__init__(message)
+        self.response = response
+
+    @property
+    def status_code(self):
+        """Return the status code of the response."""
+
+        if self.response is not None:
+            return self.response.status_code
+
+
+class AuthError(HTTPError):
+    """Request was not authorized, the token needs to be refreshed."""
+
+
+class RateLimitError(HTTPError):
+    """Request was throttled, retry after retry_after seconds."""
+
+    def __init__(self, message, response=None, retry_after=None):
+        """Initialize the error with the delay requested by the API."""
+
+        super(RateLimitError, self).__init__(message, response)
+        self.retry_after = retry_after
+
+
+class TransientError(HTTPError):
+    """API failed temporarily, the request may succeed when retried."""
+
+
+class PermanentError(HTTPError):
+    """Request was rejected and will fail again when retried."""
+
+
+class CircuitOpenError(LyricError):
+    """Endpoint failed repeatedly and is not called until retry_after passed."""
+
+    def __init__(self, message, retry_after=None):
+        """Initialize the error with the time left until the next attempt."""
+
+        super(CircuitOpenError, self).__init__(message)
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(LyricError):
+    """Deadline of the request context passed before the request completed."""
@@ -0,0 +1,105 @@
+#  -*- coding:utf-8 -*-
+
+"""Immutable, interned payloads sharing unchanged parts between refreshes."""
+
+import sys
+
+# Keys identifying the items of payload lists.
+_ID_KEYS = ("deviceID", "locationID", "userID")
+
+
+class FrozenDict(dict):
+    """Dict that cannot be changed after it is created."""
+
+    __slots__ = ()
+
+    def _readonly(self, *args, **kwargs):
+        """Refuse to change the dict."""
+
+        raise TypeError("%s is read-only" % self.__class__.__name__)
+
+    __setitem__ = _readonly
+    __delitem__ = _readonly
+    __ior__ = _readonly
+    clear = _readonly
+    pop = _readonly
+    popitem = _readonly
+    setdefault = _readonly
+    update = _readonly
+
+    def __reduce__(self):
+        """Copy and pickle through a plain dict."""
+
+        return (self.__class__, (dict(self),))
+
+    def __copy__(self):
+        """Return self, it cannot change."""
+
+        return self
+
+    def __deepcopy__(self, memo):
+        """Return self, it cannot change."""
+
+        return self
+
+
+def _item_id(value):
+    """Return the id of a payload list item, or None."""
+
+    if isinstance(value, dict):
+        for key in _ID_KEYS:
+            if key in value:
+                return value[key]
+    return None
+
+
+def freeze(value, previous=None):
+    """Return value as interned, immutable structures.
+
+    Strings are interned, dicts become FrozenDicts and lists become tuples.
+    Parts equal to the matching part of previous, an earlier frozen payload,
+    are replaced by it so unchanged subtrees are shared between refreshes.
+    """
+
+    if isinstance(value, str):
+        return sys.intern(value)
+    if isinstance(value, (bool, int, float)):
+        if type(previous) is type(value) and previous == value:
+            return previous
+        return value
+    if isinstance(value, dict):
+        if not isinstance(previous, dict):
+            previous = {}
+        frozen = {}
+        shared = len(previous) == len(value)
+        for key, item in value.items():
+            before = previous.get(key)
+            item = freeze(item, before)
+            if item is not before or key not in previous:
+                shared = False
+            frozen[sys.intern(key)] = item
+        if shared and isinstance(previous, FrozenDict):
+            return previous
+        return FrozenDict(frozen)
+    if isinstance(value, (list, tuple)):
+        if not isinstance(previous, tuple):
+            previous = ()
+        by_id = {}
+        for item in previous:
+            itemId = _item_id(item)
+            if itemId is not None:
+                by_id[itemId] = item
+        frozen = []
+        for index, item in enumerate(value):
+            itemId = _item_id(item)
+            if itemId is not None:
+                before = by_id.get(itemId)
+            else:
+                before = previous[index] if index < len(previous) else None
+            frozen.append(freeze(item, before))
+        if len(frozen) == len(previous) and all(
+            item is before for item, before in zip(frozen, previous)
+        ):
+            return previous
+        return tuple(frozen)
+    return value
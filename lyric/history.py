@@ -0,0 +1,303 @@
+#  -*- coding:utf-8 -*-
+
+"""Time-series history of thermostat and water leak detector readings."""
+
+import math
+import os
+import sys
+import threading
+import time
+from array import array
+
+THERMOSTAT_FIELDS = (
+    "indoorTemperature",
+    "indoorHumidity",
+    "outdoorTemperature",
+    "heatSetpoint",
+    "coolSetpoint",
+)
+WATER_LEAK_DETECTOR_FIELDS = ("temperature", "humidity", "batteryRemaining")
+
+_NAN = float("nan")
+
+
+def _thermostat_readings(device):
+    """Return the recorded readings of a thermostat payload."""
+
+    changeableValues = device.get("changeableValues") or {}
+    return (
+        device.get("indoorTemperature"),
+        device.get("indoorHumidity"),
+        device.get("outdoorTemperature"),
+        changeableValues.get("heatSetpoint"),
+        changeableValues.get("coolSetpoint"),
+    )
+
+
+def _water_leak_detector_readings(device):
+    """Return the recorded readings of a water leak detector payload."""
+
+    currentSensorReadings = device.get("currentSensorReadings") or {}
+    return (
+        currentSensorReadings.get("temperature"),
+        currentSensorReadings.get("humidity"),
+        device.get("batteryRemaining"),
+    )
+
+
+_RECORDERS = {
+    "Thermostat": (THERMOSTAT_FIELDS, _thermostat_readings),
+    "Water Leak Detector": (WATER_LEAK_DETECTOR_FIELDS, _water_leak_detector_readings),
+}
+
+
+def _to_float(value):
+    """Convert a reading to a float, missing readings become NaN."""
+
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return _NAN
+
+
+def _from_float(value):
+    """Convert a stored float back to a reading, NaN becomes None."""
+
+    return None if math.isnan(value) else value
+
+
+class _Series(object):
+    """Columnar ring buffer of readings for a single device."""
+
+    def __init__(self, fields, capacity, segment_file=None, segment_rows=256):
+        """Initialize the ring buffer."""
+
+        self.fields = fields
+        self._capacity = capacity
+        self._width = len(fields) + 1
+        self._rows = array("d", [_NAN]) * (capacity * self._width)
+        self._head = 0
+        self._count = 0
+        self._segment_file = segment_file
+        self._segment_rows = segment_rows
+        self._pending = array("d")
+
+    def __len__(self):
+        """Return the number of rows held in memory."""
+
+        return self._count
+
+    def append(self, timestamp, values):
+        """Append a row, evicting the oldest row once the buffer is full."""
+
+        offset = self._head * self._width
+        if self._count == self._capacity:
+            if self._segment_file is not None:
+                self._pending.extend(self._rows[offset : offset + self._width])
+                if len(self._pending) >= self._segment_rows * self._width:
+                    self.flush()
+        else:
+            self._count += 1
+
+        self._rows[offset] = timestamp
+        for index, value in enumerate(values, 1):
+            self._rows[offset + index] = _to_float(value)
+        self._head = (self._head + 1) % self._capacity
+
+    def flush(self):
+        """Write evicted rows to the on-disk segment."""
+
+        if self._segment_file is None or not self._pending:
+            return
+        pending = self._pending
+        if sys.byteorder == "big":
+            pending = array("d", pending)
+            pending.byteswap()
+        with open(self._segment_file, "ab") as f:
+            pending.tofile(f)
+        self._pending = array("d")
+
+    def _segment(self):
+        """Return the rows stored on disk."""
+
+        rows = array("d")
+        if self._segment_file is not None and os.path.exists(self._segment_file):
+            with open(self._segment_file, "rb") as f:
+                rows.frombytes(f.read())
+            if sys.byteorder == "big":
+                rows.byteswap()
+        return rows
+
+    def rows(self, start=None, end=None, include_segment=True):
+        """Yield rows between start and end in chronological order."""
+
+        chunks = []
+        if include_segment:
+            chunks.append(self._segment())
+            chunks.append(self._pending)
+        first = (self._head - self._count) % self._capacity
+        if first + self._count <= self._capacity:
+            chunks.append(
+                self._rows[first * self._width : (first + self._count) * self._width]
+            )
+        else:
+            chunks.append(self._rows[first * self._width :])
+            chunks.append(self._rows[: self._head * self._width])
+
+        for chunk in chunks:
+            for offset in range(0, len(chunk) - self._width + 1, self._width):
+                timestamp = chunk[offset]
+                if start is not None and timestamp < start:
+                    continue
+                if end is not None and timestamp > end:
+                    continue
+                yield timestamp, chunk[offset + 1 : offset + self._width]
+
+
+class History(object):
+    """Record refreshed device readings into per-device ring buffers.
+
+    Each device keeps its last ``capacity`` readings in memory. When
+    ``directory`` is given, rows evicted from memory are appended to a
+    per-device segment file there so range queries can reach further back.
+    """
+
+    def __init__(self, capacity=2880, directory=None, segment_rows=256):
+        """Initialize and configure the History class."""
+
+        self._capacity = capacity
+        self._directory = directory
+        self._segment_rows = segment_rows
+        self._series = {}
+        self._lock = threading.Lock()
+
+        if directory is not None and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s devices>" % (self.__class__.__name__, len(self._series))
+
+    def _series_for(self, deviceId, fields):
+        """Return the series of a device, creating it if needed."""
+
+        series = self._series.get(deviceId)
+        if series is None:
+            segment_file = None
+            if self._directory is not None:
+                segment_file = os.path.join(self._directory, "%s.seg" % deviceId)
+            series = _Series(fields, self._capacity, segment_file, self._segment_rows)
+            self._series[deviceId] = series
+        return series
+
+    def record(self, locations, timestamp=None):
+        """Record the readings of every known device in a locations payload."""
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            for location in locations or []:
+                for device in location.get("devices") or []:
+                    recorder = _RECORDERS.get(device.get("deviceType"))
+                    if recorder is None:
+                        continue
+                    fields, readings = recorder
+                    series = self._series_for(device.get("deviceID"), fields)
+                    series.append(timestamp, readings(device))
+
+    def flush(self):
+        """Write all pending evicted rows to disk."""
+
+        with self._lock:
+            for series in self._series.values():
+                series.flush()
+
+    @property
+    def devices(self):
+        """Return the ids of recorded devices."""
+
+        return list(self._series)
+
+    def fields(self, deviceId):
+        """Return the recorded fields of a device."""
+
+        series = self._series.get(deviceId)
+        if series is not None:
+            return series.fields
+
+    def query(self, deviceId, start=None, end=None, fields=None):
+        """Return the readings of a device between start and end.
+
+        The result maps ``time`` and each requested field to a list of
+        values, missing readings are returned as None.
+        """
+
+        series = self._series.get(deviceId)
+        if series is None:
+            return None
+        if fields is None:
+            fields = series.fields
+        columns = [series.fields.index(field) for field in fields]
+
+        result = {"time": []}
+        for field in fields:
+            result[field] = []
+        with self._lock:
+            for timestamp, values in series.rows(start, end):
+                result["time"].append(timestamp)
+                for field, column in zip(fields, columns):
+                    result[field].append(_from_float(values[column]))
+        return result
+
+    def downsample(
+        self, deviceId, interval, start=None, end=None, fields=None, how="mean"
+    ):
+        """Return readings of a device aggregated into buckets of interval seconds.
+
+        ``how`` is one of ``mean``, ``min``, ``max`` or ``last``. Buckets are
+        aligned on multiples of interval and missing readings are skipped.
+        """
+
+        if how not in ("mean", "min", "max", "last"):
+            raise ValueError("how must be one of mean, min, max or last")
+        series = self._series.get(deviceId)
+        if series is None:
+            return None
+        if fields is None:
+            fields = series.fields
+        columns = [series.fields.index(field) for field in fields]
+
+        buckets = []
+        current = None
+        with self._lock:
+            for timestamp, values in series.rows(start, end):
+                bucket = timestamp - timestamp % interval
+                if current is None or current[0] != bucket:
+                    current = (bucket, [[] for _ in columns])
+                    buckets.append(current)
+                for readings, column in zip(current[1], columns):
+                    if not math.isnan(values[column]):
+                        readings.append(values[column])
+
+        result = {"time": [bucket for bucket, _ in buckets]}
+        for index, field in enumerate(fields):
+            result[field] = [
+                _aggregate(readings[index], how) for _, readings in buckets
+            ]
+        return result
+
+
+def _aggregate(readings, how):
+    """Aggregate the readings of one bucket."""
+
+    if not readings:
+        return None
+    if how == "mean":
+        return sum(readings) / len(readings)
+    if how == "min":
+        return min(readings)
+    if how == "max":
+        return max(readings)
+    return readings[-1]
@@ -0,0 +1,145 @@
+#  -*- coding:utf-8 -*-
+
+"""Parse large responses and build their index in a pool of processes."""
+
+import concurrent.futures
+import hashlib
+import json
+import logging
+import threading
+from concurrent.futures.process import BrokenProcessPool
+
+from . import _index_location
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _digest(location):
+    """Return a digest of the content of a location payload."""
+
+    content = json.dumps(location, separators=(",", ":")).encode("utf-8")
+    return hashlib.blake2b(content, digest_size=16).digest()
+
+
+def _parse(content, endpoint, known=frozenset()):
+    """Decode a response body in a worker process.
+
+    Returns the decoded body, or for a locations payload None and a list
+    holding per location either its digest, when it is in known, or its
+    digest, payload and index entry. Only changed locations are pickled
+    back, and each comes with an entry referring to its own dicts.
+    """
+
+    value = json.loads(content)
+    if endpoint != "locations" or not isinstance(value, list):
+        return value, None
+    items = []
+    for location in value:
+        digest = _digest(location)
+        if digest in known:
+            items.append(digest)
+        else:
+            items.append((digest, location, _index_location(location)))
+    return None, items
+
+
+class IngestPool(object):
+    """Decode and index responses in worker processes.
+
+    Pass it to Lyric as ``ingest`` to move JSON decoding of responses of at
+    least ``min_size`` bytes off the main process. For a locations payload
+    the worker also indexes the locations and their derived thermostat
+    state. It sends back only the locations that changed since the previous
+    payload of the same Lyric instance. Unchanged locations keep their
+    previous dicts and index entries, so the main process neither decodes
+    nor unpickles them, and the search index and frozen payloads skip them
+    by identity. Smaller responses are decoded in process, where the round
+    trip costs more than it saves. Share one pool between the Lyric
+    instances of a poller that fetches accounts from several threads to
+    spread the work over cores, see benchmarks/ingest.py.
+    """
+
+    def __init__(self, max_workers=None, min_size=64 * 1024):
+        """Initialize and configure the IngestPool class."""
+
+        self._max_workers = max_workers
+        self._min_size = min_size
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s workers>" % (
+            self.__class__.__name__,
+            self._max_workers or "cpu count",
+        )
+
+    def __enter__(self):
+        """Return self."""
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Shut the pool down."""
+
+        self.close()
+        return False
+
+    def _pool(self):
+        """Return the process pool, starting it on first use."""
+
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ProcessPoolExecutor(
+                    self._max_workers
+                )
+            return self._executor
+
+    def parse(self, content, endpoint, known=None):
+        """Return the decoded body of a response, its index and its locations.
+
+        ``known`` maps the location digests of the previous parse to their
+        payload and index entry, as returned by that parse. The index and
+        the new mapping are None unless a locations payload was decoded in
+        a worker. Raises ValueError when the body is not valid JSON.
+        """
+
+        if len(content) < self._min_size:
+            return json.loads(content), None, None
+        known = known or {}
+        try:
+            value, items = (
+                self._pool()
+                .submit(_parse, content, endpoint, frozenset(known))
+                .result()
+            )
+        except BrokenProcessPool:
+            _LOGGER.warning("Ingest pool broke, parsing in process")
+            with self._lock:
+                self._executor = None
+            return json.loads(content), None, None
+        if items is None:
+            return value, None, None
+
+        value = []
+        index = {}
+        locations = {}
+        for item in items:
+            if isinstance(item, bytes):
+                digest = item
+                location, entry = known[digest]
+            else:
+                digest, location, entry = item
+            value.append(location)
+            index[location.get("locationID")] = entry
+            locations[digest] = (location, entry)
+        return value, index, locations
+
+    def close(self):
+        """Shut the worker processes down."""
+
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
@@ -0,0 +1,357 @@
+#  -*- coding:utf-8 -*-
+
+"""Thermostat schedules evaluated locally in the location's time zone."""
+
+import bisect
+import collections
+import datetime
+import logging
+import threading
+import time
+
+try:
+    import zoneinfo
+except ImportError:  # pragma: no cover
+    zoneinfo = None
+
+from .context import BACKGROUND, default_context
+from .exceptions import DeadlineExceeded
+
+_LOGGER = logging.getLogger(__name__)
+
+DAYS = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+# Time zone names used by the Lyric API mapped to IANA names.
+TIME_ZONES = {
+    "Eastern": "America/New_York",
+    "Central": "America/Chicago",
+    "Mountain": "America/Denver",
+    "Arizona": "America/Phoenix",
+    "Pacific": "America/Los_Angeles",
+    "Alaska": "America/Anchorage",
+    "Hawaii": "Pacific/Honolulu",
+    "Atlantic": "America/Halifax",
+    "Newfoundland": "America/St_Johns",
+    "Saskatchewan": "America/Regina",
+    "GMT Standard Time": "Europe/London",
+    "W. Europe Standard Time": "Europe/Amsterdam",
+    "Romance Standard Time": "Europe/Paris",
+    "Central Europe Standard Time": "Europe/Budapest",
+    "Central European Standard Time": "Europe/Warsaw",
+    "E. Europe Standard Time": "Europe/Chisinau",
+    "FLE Standard Time": "Europe/Helsinki",
+    "GTB Standard Time": "Europe/Bucharest",
+}
+
+_WEEK = 7 * 24 * 3600
+
+Period = collections.namedtuple(
+    "Period", ["day", "period", "start", "heatSetpoint", "coolSetpoint"]
+)
+
+
+def time_zone(name, daylightSavingTimeEnabled=True):
+    """Return the tzinfo of a Lyric time zone name, or None if unknown.
+
+    Locations without daylight saving time get the zone's standard offset.
+    """
+
+    if not name or zoneinfo is None:
+        return None
+    try:
+        zone = zoneinfo.ZoneInfo(TIME_ZONES.get(name, name))
+    except (zoneinfo.ZoneInfoNotFoundError, ValueError):
+        _LOGGER.warning("Unknown time zone %s, using local time" % name)
+        return None
+    if daylightSavingTimeEnabled is False:
+        now = datetime.datetime.now(zone)
+        return datetime.timezone(now.utcoffset() - now.dst(), name)
+    return zone
+
+
+def _seconds(value):
+    """Return the seconds since midnight of a HH:MM:SS string."""
+
+    parts = [int(part) for part in value.split(":")]
+    parts += [0] * (3 - len(parts))
+    return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+
+def _week_seconds(now):
+    """Return the seconds since Monday midnight of a datetime."""
+
+    return now.weekday() * 86400 + now.hour * 3600 + now.minute * 60 + now.second
+
+
+class Schedule(object):
+    """Weekly schedule of a thermostat.
+
+    Parses the ``timedSchedule`` of a schedule payload, or the sleep mode
+    of a ``geofenceSchedule``, into a sorted list of period starts so the
+    current and next period can be found without asking the API.
+    """
+
+    def __init__(self, payload, tz=None):
+        """Initialize the schedule from a devices/schedule payload."""
+
+        self.payload = payload
+        self.tz = tz
+        self._starts = []
+        self._periods = []
+
+        entries = []
+        timedSchedule = payload.get("timedSchedule")
+        if timedSchedule:
+            for day in timedSchedule.get("days") or []:
+                if day.get("day") not in DAYS:
+                    continue
+                offset = DAYS.index(day["day"]) * 86400
+                for period in day.get("periods") or []:
+                    if period.get("isCancelled") or not period.get("startTime"):
+                        continue
+                    name = period.get("periodType") or period.get("periodName")
+                    start = offset + _seconds(period["startTime"])
+                    entries.append((start, day["day"], name, period))
+
+        sleepMode = (payload.get("geofenceSchedule") or {}).get("sleepMode")
+        if not entries and sleepMode:
+            homePeriod = payload["geofenceSchedule"].get("homePeriod") or {}
+            for index, day in enumerate(DAYS):
+                if sleepMode.get("startTime"):
+                    entries.append(
+                        (
+                            index * 86400 + _seconds(sleepMode["startTime"]),
+                            day,
+                            "Sleep",
+                            sleepMode,
+                        )
+                    )
+                if sleepMode.get("endTime"):
+                    entries.append(
+                        (
+                            index * 86400 + _seconds(sleepMode["endTime"]),
+                            day,
+                            "Home",
+                            homePeriod,
+                        )
+                    )
+
+        entries.sort(key=lambda entry: entry[0])
+        self._starts = [entry[0] for entry in entries]
+        self._periods = [entry[1:] for entry in entries]
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s periods>" % (self.__class__.__name__, len(self._starts))
+
+    def __bool__(self):
+        """Return whether the schedule has any periods."""
+
+        return bool(self._starts)
+
+    def _now(self, now=None):
+        """Return now as a datetime in the schedule's time zone."""
+
+        if now is None:
+            now = time.time()
+        if isinstance(now, datetime.datetime):
+            if now.tzinfo is not None and self.tz is not None:
+                return now.astimezone(self.tz)
+            return now
+        return datetime.datetime.fromtimestamp(now, self.tz)
+
+    def _period(self, index, now, week_offset=0):
+        """Return the period at index, starting in the week of now plus offset."""
+
+        day, name, period = self._periods[index]
+        start_seconds = self._starts[index] + week_offset * _WEEK
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0, tzinfo=None)
+        start = midnight + datetime.timedelta(
+            days=start_seconds // 86400 - now.weekday(), seconds=start_seconds % 86400
+        )
+        # Attach the zone to the wall clock time so it survives DST changes.
+        start = start.replace(tzinfo=now.tzinfo)
+        return Period(
+            day,
+            name,
+            start,
+            period.get("heatSetPoint", period.get("heatSetpoint")),
+            period.get("coolSetPoint", period.get("coolSetpoint")),
+        )
+
+    def current(self, now=None):
+        """Return the period in effect at now, or None without periods."""
+
+        if not self._starts:
+            return None
+        now = self._now(now)
+        now_seconds = _week_seconds(now)
+        index = bisect.bisect_right(self._starts, now_seconds) - 1
+        if index < 0:
+            return self._period(len(self._starts) - 1, now, -1)
+        return self._period(index, now)
+
+    def next(self, now=None):
+        """Return the first period starting after now, or None without periods."""
+
+        if not self._starts:
+            return None
+        now = self._now(now)
+        now_seconds = _week_seconds(now)
+        index = bisect.bisect_right(self._starts, now_seconds)
+        if index == len(self._starts):
+            return self._period(0, now, 1)
+        return self._period(index, now)
+
+
+class ScheduleEngine(object):
+    """Fetch thermostat schedules once and refresh thermostats at boundaries.
+
+    Schedules are cached for ``ttl`` seconds, and a failed fetch is
+    remembered for ``negative_ttl`` seconds. A watched thermostat is
+    refreshed from its own endpoint ``margin`` seconds after each period
+    boundary, instead of polling the whole account to see the period change,
+    and ``callback(thermostat)`` is called after each such refresh.
+    """
+
+    def __init__(self, ttl=24 * 3600, margin=5, callback=None, negative_ttl=60):
+        """Initialize and configure the ScheduleEngine class."""
+
+        self._ttl = ttl
+        self._negative_ttl = negative_ttl
+        self._margin = margin
+        self._callback = callback
+        self._schedules = {}
+        self._timers = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s watched>" % (self.__class__.__name__, len(self._timers))
+
+    def schedule(self, thermostat):
+        """Return the Schedule of a thermostat, fetching it when not cached.
+
+        A failed fetch keeps serving the previous schedule, if there is one,
+        and is not retried for negative_ttl seconds.
+        """
+
+        deviceId = thermostat.id
+        with self._lock:
+            cached = self._schedules.get(deviceId)
+        now = time.time()
+        previous = None
+        if cached is not None:
+            previous, last_update = cached
+            ttl = self._ttl if previous is not None else self._negative_ttl
+            if now - last_update <= ttl:
+                return previous
+
+        lyric_api = thermostat._lyric_api
+        try:
+            with default_context(BACKGROUND):
+                payload = lyric_api._location_get(
+                    thermostat._locationId, "devices/schedule/" + deviceId
+                )
+        except DeadlineExceeded:
+            # Dropped for the caller's deadline, the API did not fail.
+            return previous
+        if not payload:
+            with self._lock:
+                if previous is None:
+                    self._schedules[deviceId] = (None, now)
+                else:
+                    self._schedules[deviceId] = (
+                        previous,
+                        now - self._ttl + self._negative_ttl,
+                    )
+            return previous
+
+        location = thermostat._location
+        schedule = Schedule(
+            payload,
+            time_zone(location.timeZone, location.daylightSavingTimeEnabled),
+        )
+        with self._lock:
+            self._schedules[deviceId] = (schedule, now)
+        return schedule
+
+    def invalidate(self, deviceId=None):
+        """Forget the cached schedule of a device, or of all devices."""
+
+        with self._lock:
+            if deviceId is None:
+                self._schedules.clear()
+            else:
+                self._schedules.pop(deviceId, None)
+
+    def current(self, thermostat, now=None):
+        """Return the current Period of a thermostat."""
+
+        schedule = self.schedule(thermostat)
+        if schedule is not None:
+            return schedule.current(now)
+
+    def next(self, thermostat, now=None):
+        """Return the next Period of a thermostat."""
+
+        schedule = self.schedule(thermostat)
+        if schedule is not None:
+            return schedule.next(now)
+
+    def watch(self, thermostat):
+        """Refresh a thermostat just after each of its period boundaries."""
+
+        period = self.next(thermostat)
+        if period is None:
+            return False
+        delay = max(0, period.start.timestamp() - time.time()) + self._margin
+        timer = threading.Timer(delay, self._boundary, (thermostat,))
+        timer.daemon = True
+        with self._lock:
+            previous = self._timers.get(thermostat.id)
+            self._timers[thermostat.id] = timer
+        if previous is not None:
+            previous.cancel()
+        timer.start()
+        return True
+
+    def watch_all(self, lyric_api):
+        """Watch every thermostat of a Lyric instance."""
+
+        for location in lyric_api.locations or []:
+            for thermostat in location.thermostats:
+                self.watch(thermostat)
+
+    def unwatch(self, thermostat):
+        """Stop refreshing a thermostat at its boundaries."""
+
+        with self._lock:
+            timer = self._timers.pop(thermostat.id, None)
+        if timer is not None:
+            timer.cancel()
+
+    def stop(self):
+        """Stop all boundary refreshes."""
+
+        with self._lock:
+            timers = list(self._timers.values())
+            self._timers.clear()
+        for timer in timers:
+            timer.cancel()
+
+    def _boundary(self, thermostat):
+        """Refresh a thermostat after a boundary and arm the next one."""
+
+        with self._lock:
+            if self._timers.get(thermostat.id) is not threading.current_thread():
+                return
+        try:
+            thermostat.refresh()
+            if self._callback is not None:
+                self._callback(thermostat)
+        except Exception:  # noqa: B902
+            _LOGGER.exception("Error refreshing %r at schedule boundary" % thermostat)
+        self.watch(thermostat)
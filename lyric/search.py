@@ -0,0 +1,195 @@
+#  -*- coding:utf-8 -*-
+
+"""Inverted indexes over cached locations, users and devices."""
+
+import threading
+
+from . import Device, Location, Thermostat, User, WaterLeakDetector
+
+DEVICE_FIELDS = (
+    "deviceID",
+    "name",
+    "userDefinedDeviceName",
+    "macID",
+    "deviceClass",
+    "deviceType",
+    "isAlive",
+    "isDeviceOffline",
+)
+LOCATION_FIELDS = ("locationID", "name", "city", "state", "zipcode", "country")
+USER_FIELDS = ("userID", "username", "firstname", "lastname")
+
+_FIELDS = {"device": DEVICE_FIELDS, "location": LOCATION_FIELDS, "user": USER_FIELDS}
+
+_DEVICE_CLASSES = {"Thermostat": Thermostat, "Water Leak Detector": WaterLeakDetector}
+
+
+def _normalize(value):
+    """Return the indexed form of a value, strings match case-insensitively."""
+
+    if isinstance(value, str):
+        return value.casefold()
+    return value
+
+
+def _values(kind, payload):
+    """Return the normalized indexed values of a payload."""
+
+    values = {field: _normalize(payload.get(field)) for field in _FIELDS[kind]}
+    if kind == "device" and values["name"] is None:
+        values["name"] = values["userDefinedDeviceName"]
+    return values
+
+
+class SearchIndex(object):
+    """Find locations, users and devices by field values without scanning.
+
+    Pass it to one or more Lyric instances as ``search_index`` and it is
+    updated whenever their locations are fetched or a device is refreshed.
+    Only payloads that changed since the previous update are reindexed.
+    Queries return the same Location, User and device objects as walking
+    ``Lyric.locations``, for every account sharing the index.
+    """
+
+    def __init__(self):
+        """Initialize and configure the SearchIndex class."""
+
+        self._postings = {
+            kind: {field: {} for field in fields} for kind, fields in _FIELDS.items()
+        }
+        self._docs = {}
+        self._accounts = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s entries>" % (self.__class__.__name__, len(self._docs))
+
+    def __len__(self):
+        """Return the number of indexed locations, users and devices."""
+
+        return len(self._docs)
+
+    def update(self, lyric_api, locations):
+        """Reindex a locations payload of a Lyric instance."""
+
+        seen = set()
+        with self._lock:
+            for location in locations or []:
+                locationId = location.get("locationID")
+                self._add(("location", lyric_api, locationId), location, seen)
+                for user in location.get("users") or []:
+                    key = ("user", lyric_api, locationId, user.get("userID"))
+                    self._add(key, user, seen)
+                for device in location.get("devices") or []:
+                    key = ("device", lyric_api, locationId, device.get("deviceID"))
+                    self._add(key, device, seen)
+
+            for key in self._accounts.get(lyric_api, set()) - seen:
+                self._remove(key)
+            self._accounts[lyric_api] = seen
+
+    def update_device(self, lyric_api, locationId, device):
+        """Reindex a single refreshed device of a Lyric instance."""
+
+        key = ("device", lyric_api, locationId, device.get("deviceID"))
+        with self._lock:
+            self._add(key, device, self._accounts.setdefault(lyric_api, set()))
+
+    def _add(self, key, payload, seen):
+        """Index a payload under key unless it is unchanged."""
+
+        seen.add(key)
+        doc = self._docs.get(key)
+        if doc is not None and doc[0] is payload:
+            return
+        kind = key[0]
+        values = _values(kind, payload)
+        if doc is not None and doc[1] == values:
+            self._docs[key] = (payload, values)
+            return
+
+        postings = self._postings[kind]
+        for field, value in values.items():
+            if doc is not None:
+                old = doc[1][field]
+                if old == value:
+                    continue
+                self._discard(postings[field], old, key)
+            postings[field].setdefault(value, set()).add(key)
+        self._docs[key] = (payload, values)
+
+    def _remove(self, key):
+        """Remove a payload from the index."""
+
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        postings = self._postings[key[0]]
+        for field, value in doc[1].items():
+            self._discard(postings[field], value, key)
+
+    @staticmethod
+    def _discard(posting, value, key):
+        """Remove key from the posting list of value."""
+
+        keys = posting.get(value)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del posting[value]
+
+    def _match(self, kind, criteria):
+        """Return the keys of kind matching every field value in criteria."""
+
+        postings = self._postings[kind]
+        for field in criteria:
+            if field not in postings:
+                raise ValueError("%s is not an indexed %s field" % (field, kind))
+
+        with self._lock:
+            if not criteria:
+                return [key for key in self._docs if key[0] == kind]
+            matches = sorted(
+                (
+                    postings[field].get(_normalize(value), ())
+                    for field, value in criteria.items()
+                ),
+                key=len,
+            )
+            keys = set(matches[0])
+            for match in matches[1:]:
+                keys &= match
+            return list(keys)
+
+    def devices(self, **criteria):
+        """Return the devices whose fields equal the given values."""
+
+        devices = []
+        for key in self._match("device", criteria):
+            _, lyric_api, locationId, deviceId = key
+            doc = self._docs.get(key)
+            if doc is None:
+                continue
+            cls = _DEVICE_CLASSES.get(doc[0].get("deviceType"), Device)
+            location = Location(locationId, lyric_api, lyric_api._local_time)
+            devices.append(cls(deviceId, location, lyric_api, lyric_api._local_time))
+        return devices
+
+    def locations(self, **criteria):
+        """Return the locations whose fields equal the given values."""
+
+        return [
+            Location(locationId, lyric_api, lyric_api._local_time)
+            for _, lyric_api, locationId in self._match("location", criteria)
+        ]
+
+    def users(self, **criteria):
+        """Return the users whose fields equal the given values."""
+
+        users = []
+        for _, lyric_api, locationId, userId in self._match("user", criteria):
+            location = Location(locationId, lyric_api, lyric_api._local_time)
+            users.append(User(userId, location, lyric_api, lyric_api._local_time))
+        return users
@@ -0,0 +1,337 @@
+#  -*- coding:utf-8 -*-
+
+"""Poller keeping the Lyric cache warm and a local HTTP API serving it."""
+
+import collections
+import http.server
+import json
+import logging
+import os
+import socketserver
+import threading
+import time
+import urllib.parse
+
+from . import _build_index
+from .context import BACKGROUND, request_context
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_PORT = 8473
+
+
+def _changes(old, new):
+    """Return the top level keys whose value differs between two payloads."""
+
+    return {
+        key: [old.get(key), new.get(key)]
+        for key in set(old) | set(new)
+        if old.get(key) != new.get(key)
+    }
+
+
+class Poller(object):
+    """Refresh the locations of Lyric on a schedule and record change events.
+
+    Events are dicts with a ``seq`` number, ``time``, ``type`` (one of
+    ``location_changed``, ``device_added``, ``device_changed`` or
+    ``device_removed``), ``locationId``, ``deviceId`` and the changed
+    top level ``changes`` as ``[old, new]`` pairs. The payload of the last
+    poll is kept as a snapshot, together with its devices and their derived
+    state, so readers never fetch from the API themselves.
+    """
+
+    def __init__(self, lyric_api, interval=None, max_events=1000):
+        """Initialize and configure the Poller class."""
+
+        self._lyric_api = lyric_api
+        self._interval = interval if interval is not None else lyric_api._cache_ttl
+        self._events = collections.deque(maxlen=max_events)
+        self._seq = 0
+        self._locations = None
+        self._devices = []
+        self._last_poll = None
+        self._condition = threading.Condition()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: every %ss>" % (self.__class__.__name__, self._interval)
+
+    @property
+    def lyric_api(self):
+        """Return the polled Lyric instance."""
+
+        return self._lyric_api
+
+    @property
+    def last_poll(self):
+        """Return the time of the last successful poll."""
+
+        return self._last_poll
+
+    @property
+    def locations(self):
+        """Return the locations payload of the last poll."""
+
+        return self._locations or []
+
+    def devices(self, deviceType=None):
+        """Return the devices of the last poll with their derived state."""
+
+        devices = self._devices
+        if deviceType is None:
+            return devices
+        return [device for device in devices if device.get("deviceType") == deviceType]
+
+    @property
+    def seq(self):
+        """Return the sequence number of the last event."""
+
+        return self._seq
+
+    def start(self):
+        """Start polling in a background thread."""
+
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="lyric-poller", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        """Poll until stopped."""
+
+        while not self._stopped.is_set():
+            try:
+                # Give way to interactive requests, and drop a poll the
+                # next one would replace.
+                with request_context(self._interval, BACKGROUND):
+                    self.poll()
+            except Exception:  # noqa: B902
+                _LOGGER.exception("Error polling Lyric API")
+            self._stopped.wait(self._interval)
+
+    def poll(self):
+        """Refresh locations now and record what changed."""
+
+        locations = self._lyric_api.refresh()
+        if not locations or locations is self._locations:
+            return
+        now = time.time()
+        events = list(self._diff(self._locations or [], locations))
+        devices = self._snapshot_devices(locations)
+        with self._condition:
+            for event in events:
+                self._seq += 1
+                event["seq"] = self._seq
+                event["time"] = now
+                self._events.append(event)
+            self._locations = locations
+            self._devices = devices
+            self._last_poll = now
+            self._condition.notify_all()
+
+    def _snapshot_devices(self, locations):
+        """Return the devices of a payload with their derived state."""
+
+        index = _build_index(locations)
+        devices = []
+        for location in locations:
+            locationId = location.get("locationID")
+            derived = index[locationId].derived
+            for device in location.get("devices") or []:
+                device = dict(device)
+                device["locationID"] = locationId
+                device["derived"] = derived.get(device.get("deviceID"), {})
+                devices.append(device)
+        return devices
+
+    def _diff(self, old_locations, new_locations):
+        """Yield the events between two locations payloads."""
+
+        old = {location.get("locationID"): location for location in old_locations}
+        for location in new_locations:
+            locationId = location.get("locationID")
+            previous = old.get(locationId) or {}
+            changes = _changes(
+                {k: v for k, v in previous.items() if k != "devices"},
+                {k: v for k, v in location.items() if k != "devices"},
+            )
+            if changes and previous:
+                yield {
+                    "type": "location_changed",
+                    "locationId": locationId,
+                    "deviceId": None,
+                    "changes": changes,
+                }
+
+            devices = {
+                device.get("deviceID"): device
+                for device in previous.get("devices") or []
+            }
+            for device in location.get("devices") or []:
+                deviceId = device.get("deviceID")
+                before = devices.pop(deviceId, None)
+                if before is None:
+                    event_type, changes = "device_added", _changes({}, device)
+                else:
+                    event_type, changes = "device_changed", _changes(before, device)
+                if changes:
+                    yield {
+                        "type": event_type,
+                        "locationId": locationId,
+                        "deviceId": deviceId,
+                        "changes": changes,
+                    }
+            for deviceId in devices:
+                yield {
+                    "type": "device_removed",
+                    "locationId": locationId,
+                    "deviceId": deviceId,
+                    "changes": {},
+                }
+
+    def events(self, since=0, timeout=0):
+        """Return the events after sequence number since.
+
+        Waits up to timeout seconds for a new event when there is none yet.
+        """
+
+        deadline = time.time() + timeout
+        with self._condition:
+            while self._seq <= since:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            return [event for event in self._events if event["seq"] > since]
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    """Serve the state of a Poller as JSON."""
+
+    server_version = "python-lyric"
+    poller = None
+    max_wait = 60
+
+    def address_string(self):
+        """Return the client address, empty for Unix sockets."""
+
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "unix"
+
+    def log_message(self, format, *args):
+        """Log requests through logging."""
+
+        _LOGGER.debug("%s - %s" % (self.address_string(), format % args))
+
+    def _send(self, status, value):
+        """Send a JSON response."""
+
+        body = json.dumps(value).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Handle a GET request."""
+
+        url = urllib.parse.urlsplit(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        parts = [part for part in url.path.split("/") if part]
+        lyric_api = self.poller.lyric_api
+
+        try:
+            if parts == ["health"]:
+                error = lyric_api.last_error
+                return self._send(
+                    200,
+                    {
+                        "lastPoll": self.poller.last_poll,
+                        "seq": self.poller.seq,
+                        "lastError": str(error) if error is not None else None,
+                    },
+                )
+            if parts == ["events"]:
+                since = int(query.get("since", 0))
+                timeout = min(float(query.get("timeout", 0)), self.max_wait)
+                events = self.poller.events(since, timeout)
+                return self._send(200, {"seq": self.poller.seq, "events": events})
+
+            # Served from the snapshot of the last poll, reading the Lyric
+            # cache would fetch from the API once it expired.
+            locations = self.poller.locations
+            if parts == ["locations"]:
+                return self._send(200, locations)
+            if len(parts) == 2 and parts[0] == "locations":
+                for location in locations:
+                    if str(location.get("locationID")) == parts[1]:
+                        return self._send(200, location)
+            if parts in (["devices"], ["thermostats"], ["waterLeakDetectors"]):
+                deviceType = {
+                    "thermostats": "Thermostat",
+                    "waterLeakDetectors": "Water Leak Detector",
+                }.get(parts[0])
+                return self._send(200, self.poller.devices(deviceType))
+            if len(parts) == 2 and parts[0] == "devices":
+                for device in self.poller.devices():
+                    if device.get("deviceID") == parts[1]:
+                        return self._send(200, device)
+        except ValueError as e:
+            return self._send(400, {"error": str(e)})
+        return self._send(404, {"error": "Not found"})
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """HTTP server listening on a Unix socket."""
+
+    daemon_threads = True
+
+
+def make_server(poller, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None):
+    """Return an HTTP server serving the state of poller.
+
+    Listens on socket_path when given, otherwise on host and port.
+    """
+
+    handler = type("Handler", (_Handler,), {"poller": poller})
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return _UnixHTTPServer(socket_path, handler)
+    return http.server.ThreadingHTTPServer((host, port), handler)
+
+
+def serve(
+    lyric_api, host="127.0.0.1", port=DEFAULT_PORT, socket_path=None, interval=None
+):
+    """Poll lyric_api and serve its state until interrupted."""
+
+    poller = Poller(lyric_api, interval)
+    server = make_server(poller, host, port, socket_path)
+    poller.start()
+    _LOGGER.info("Serving Lyric state on %s" % (socket_path or "%s:%s" % (host, port)))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        poller.stop()
+        if socket_path is not None and os.path.exists(socket_path):
+            os.remove(socket_path)
@@ -0,0 +1,281 @@
+#  -*- coding:utf-8 -*-
+
+"""Split polling of many accounts across nodes by consistent hashing."""
+
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import threading
+import time
+
+from .context import BACKGROUND, request_context
+
+_LOGGER = logging.getLogger(__name__)
+
+
+def _hash(key):
+    """Return the position of a key on the ring."""
+
+    return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+
+class HashRing(object):
+    """Consistent hash ring mapping keys to nodes.
+
+    Each node is placed on the ring ``vnodes`` times so keys spread evenly,
+    and adding or removing a node only moves the keys of that node.
+    """
+
+    def __init__(self, nodes=(), vnodes=64):
+        """Initialize and configure the HashRing class."""
+
+        self._vnodes = vnodes
+        self._nodes = set()
+        self._positions = []
+        self._owners = []
+        for node in nodes:
+            self.add(node)
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s nodes>" % (self.__class__.__name__, len(self._nodes))
+
+    def __len__(self):
+        """Return the number of nodes."""
+
+        return len(self._nodes)
+
+    @property
+    def nodes(self):
+        """Return the nodes on the ring."""
+
+        return sorted(self._nodes)
+
+    def add(self, node):
+        """Place a node on the ring."""
+
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for index in range(self._vnodes):
+            position = _hash("%s#%s" % (node, index))
+            offset = bisect.bisect(self._positions, position)
+            self._positions.insert(offset, position)
+            self._owners.insert(offset, node)
+
+    def remove(self, node):
+        """Take a node off the ring."""
+
+        if node not in self._nodes:
+            return
+        self._nodes.discard(node)
+        kept = [
+            (position, owner)
+            for position, owner in zip(self._positions, self._owners)
+            if owner != node
+        ]
+        self._positions = [position for position, _ in kept]
+        self._owners = [owner for _, owner in kept]
+
+    def node_for(self, key):
+        """Return the node owning a key, or None on an empty ring."""
+
+        if not self._positions:
+            return None
+        offset = bisect.bisect(self._positions, _hash(str(key)))
+        return self._owners[offset % len(self._owners)]
+
+
+class FileCoordinator(object):
+    """Track the live poller nodes through heartbeat files in a directory.
+
+    Every node touches ``<node_id>.node`` in the shared directory every
+    interval seconds. Nodes whose file is older than timeout are considered
+    gone.
+    """
+
+    def __init__(self, directory, node_id=None, interval=5, timeout=15):
+        """Initialize and configure the FileCoordinator class."""
+
+        self._directory = directory
+        self._node_id = node_id or "%s-%s" % (socket.gethostname(), os.getpid())
+        self._interval = interval
+        self._timeout = timeout
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s>" % (self.__class__.__name__, self._node_id)
+
+    @property
+    def node_id(self):
+        """Return the id of this node."""
+
+        return self._node_id
+
+    @property
+    def interval(self):
+        """Return the seconds between heartbeats."""
+
+        return self._interval
+
+    def _path(self, node_id):
+        """Return the heartbeat file of a node."""
+
+        return os.path.join(self._directory, "%s.node" % node_id)
+
+    def heartbeat(self):
+        """Announce this node as alive."""
+
+        path = self._path(self._node_id)
+        with open(path, "a"):
+            pass
+        os.utime(path)
+
+    def leave(self):
+        """Announce this node is leaving."""
+
+        try:
+            os.remove(self._path(self._node_id))
+        except OSError:
+            pass
+
+    def members(self):
+        """Return the ids of the live nodes."""
+
+        now = time.time()
+        members = []
+        for name in os.listdir(self._directory):
+            if not name.endswith(".node"):
+                continue
+            try:
+                mtime = os.stat(os.path.join(self._directory, name)).st_mtime
+            except OSError:
+                continue
+            if now - mtime <= self._timeout:
+                members.append(name[: -len(".node")])
+        return sorted(members)
+
+
+class ShardedPoller(object):
+    """Poll only the accounts this node owns on the hash ring.
+
+    ``accounts`` maps a stable account name, the same on every node, to its
+    Lyric instance. The node sends heartbeats and rebuilds the ring when
+    nodes join or leave, and every interval seconds refreshes the locations
+    of the accounts it owns. An account's locations come from a single
+    ``locations`` call, so accounts are the unit of sharding.
+    ``callback(name, lyric_api)`` is called after each refreshed account.
+    """
+
+    def __init__(
+        self, accounts, coordinator, interval=None, vnodes=64, callback=None
+    ):
+        """Initialize and configure the ShardedPoller class."""
+
+        self._accounts = dict(accounts)
+        self._coordinator = coordinator
+        if interval is None:
+            interval = min(
+                [lyric_api._cache_ttl for lyric_api in self._accounts.values()]
+                or [270]
+            )
+        self._interval = interval
+        self._vnodes = vnodes
+        self._callback = callback
+        self._ring = HashRing(vnodes=vnodes)
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s of %s accounts>" % (
+            self.__class__.__name__,
+            len(self.owned()),
+            len(self._accounts),
+        )
+
+    @property
+    def ring(self):
+        """Return the current hash ring."""
+
+        return self._ring
+
+    def owned(self):
+        """Return the names of the accounts this node polls."""
+
+        node_id = self._coordinator.node_id
+        return [
+            name for name in self._accounts if self._ring.node_for(name) == node_id
+        ]
+
+    def rebalance(self):
+        """Send a heartbeat and update the ring to the live nodes."""
+
+        self._coordinator.heartbeat()
+        members = self._coordinator.members()
+        if members != self._ring.nodes:
+            _LOGGER.info("Poller nodes changed to %s" % ", ".join(members))
+            self._ring = HashRing(members, self._vnodes)
+
+    def poll(self):
+        """Refresh the accounts this node owns once."""
+
+        self.rebalance()
+        self._poll_owned()
+
+    def _poll_owned(self):
+        """Refresh the accounts this node owns on the current ring."""
+
+        with request_context(self._interval, BACKGROUND):
+            for name in self.owned():
+                lyric_api = self._accounts[name]
+                try:
+                    # Stay alive for the other nodes during long polls.
+                    self._coordinator.heartbeat()
+                    lyric_api.refresh()
+                    if self._callback is not None:
+                        self._callback(name, lyric_api)
+                except Exception:  # noqa: B902
+                    _LOGGER.exception("Error polling account %s" % name)
+
+    def start(self):
+        """Start polling in a background thread."""
+
+        if self._thread is None:
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="lyric-sharded-poller", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self, timeout=None):
+        """Stop polling and leave the ring."""
+
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        self._coordinator.leave()
+
+    def _run(self):
+        """Poll until stopped."""
+
+        next_poll = 0
+        while not self._stopped.is_set():
+            try:
+                self.rebalance()
+            except OSError:
+                _LOGGER.exception("Error updating poller nodes")
+            if time.time() >= next_poll:
+                next_poll = time.time() + self._interval
+                self._poll_owned()
+            self._stopped.wait(
+                min(self._coordinator.interval, max(0, next_poll - time.time()))
+            )
@@ -0,0 +1,578 @@
+#  -*- coding:utf-8 -*-
+
+"""Simulated thermostats and water leak detectors served as a transport.
+
+Simulation models a fleet of virtual devices and SimulatorTransport serves
+it behind the endpoints of the Lyric API, so Lyric, Thermostat and
+WaterLeakDetector work unchanged without hardware or network::
+
+    simulation = Simulation(locations=1000, speed=60)
+    lyric_api = simulation.lyric(cache_ttl=30)
+"""
+
+import datetime
+import json
+import math
+import random
+import threading
+import time
+import urllib.parse
+
+from . import Lyric
+from .exceptions import TransportError
+from .schedule import Schedule, time_zone
+from .transport import Response, Transport
+
+# Timed schedule of every simulated thermostat, with heat and cool setpoints.
+SCHEDULE_PERIODS = (
+    ("Wake", "06:00:00", 21.0, 25.0),
+    ("Away", "08:00:00", 17.0, 29.0),
+    ("Home", "18:00:00", 21.0, 25.0),
+    ("Sleep", "22:00:00", 18.0, 27.0),
+)
+
+# Degrees per hour the equipment heats or cools.
+EQUIPMENT_RATE = 3.0
+# Fraction of the indoor to outdoor difference lost per hour.
+LEAK_FACTOR = 0.05
+# Degrees the indoor temperature may pass a setpoint before switching.
+HYSTERESIS = 0.3
+# Longest step of the simulation, in seconds.
+MAX_STEP = 300
+
+
+def _schedule_payload(deviceId):
+    """Return the devices/schedule payload of a simulated thermostat."""
+
+    days = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday")
+    days += ("Saturday", "Sunday")
+    return {
+        "deviceID": deviceId,
+        "scheduleType": "Timed",
+        "scheduleSubType": "NA",
+        "timedSchedule": {
+            "days": [
+                {
+                    "day": day,
+                    "periods": [
+                        {
+                            "isCancelled": False,
+                            "periodType": period,
+                            "startTime": startTime,
+                            "heatSetPoint": heatSetpoint,
+                            "coolSetPoint": coolSetpoint,
+                        }
+                        for period, startTime, heatSetpoint, coolSetpoint in (
+                            SCHEDULE_PERIODS
+                        )
+                    ],
+                }
+                for day in days
+            ]
+        },
+    }
+
+
+class _Thermostat(object):
+    """State and dynamics of a simulated thermostat."""
+
+    def __init__(self, simulation, location, deviceId, index, now):
+        """Initialize the thermostat."""
+
+        rng = simulation._random
+        self.location = location
+        self.schedule_payload = _schedule_payload(deviceId)
+        self.schedule = Schedule(self.schedule_payload, simulation._tz)
+        self.temperature = rng.uniform(17.0, 23.0)
+        self.outdoor_base = rng.uniform(-5.0, 25.0)
+        self.updated = now
+        self.tz = simulation._tz
+        self.hold_until = None
+        self.next_boundary = self.schedule.next(now).start.timestamp()
+        period = self.schedule.current(now)
+        self.payload = {
+            "deviceID": deviceId,
+            "deviceType": "Thermostat",
+            "deviceClass": "Thermostat",
+            "deviceModel": "T6",
+            "name": "Thermostat %s" % index,
+            "userDefinedDeviceName": "Thermostat %s" % index,
+            "macID": deviceId[4:],
+            "units": "Celsius",
+            "isAlive": True,
+            "isUpgrading": False,
+            "isProvisioned": True,
+            "indoorTemperature": round(self.temperature, 1),
+            "indoorHumidity": rng.randint(30, 60),
+            "outdoorTemperature": round(self.outdoor_base, 1),
+            "displayedOutdoorHumidity": rng.randint(30, 90),
+            "allowedModes": ["Heat", "Off", "Cool", "Auto"],
+            "deadband": 1.5,
+            "minHeatSetpoint": 4.5,
+            "maxHeatSetpoint": 32.0,
+            "minCoolSetpoint": 10.0,
+            "maxCoolSetpoint": 37.0,
+            "allowedTimeIncrements": 15,
+            "thermostatVersion": "02.00.19.33",
+            "scheduleStatus": "Resume",
+            "scheduleType": {"scheduleType": "Timed", "scheduleSubType": "NA"},
+            "scheduleCapabilities": {
+                "availableScheduleTypes": ["None", "Geofenced", "TimedNorthAmerica"],
+                "schedulableFan": False,
+            },
+            "currentSchedulePeriod": {"day": period.day, "period": period.period},
+            "changeableValues": {
+                "mode": "Heat",
+                "autoChangeoverActive": False,
+                "heatSetpoint": period.heatSetpoint,
+                "coolSetpoint": period.coolSetpoint,
+                "thermostatSetpointStatus": "NoHold",
+                "nextPeriodTime": self.schedule.next(now).start.strftime("%H:%M:00"),
+                "heatCoolMode": "Heat",
+            },
+            "operationStatus": {
+                "mode": "EquipmentOff",
+                "fanRequest": False,
+                "circulationFanRequest": False,
+            },
+            "settings": {
+                "fan": {
+                    "allowedModes": ["On", "Auto", "Circulate"],
+                    "changeableValues": {"mode": "Auto"},
+                }
+            },
+        }
+
+    def advance(self, now):
+        """Run the dynamics up to now."""
+
+        while self.updated < now:
+            # Coarser steps keep catching up after long idle periods cheap.
+            step = min(now - self.updated, max(MAX_STEP, (now - self.updated) / 200))
+            self.updated += step
+            self._step(step)
+        self.payload["indoorTemperature"] = round(self.temperature, 1)
+
+    def _outdoor(self, when):
+        """Return the outdoor temperature, peaking in the afternoon."""
+
+        hour = (when % 86400) / 3600.0
+        return self.outdoor_base + 5 * math.sin(2 * math.pi * (hour - 9) / 24)
+
+    def _next_time(self, periodTime):
+        """Return the timestamp of the next HH:MM:SS after the current time."""
+
+        parts = [int(part) for part in periodTime.split(":")]
+        current = datetime.datetime.fromtimestamp(self.updated, self.tz)
+        when = current.replace(hour=parts[0], minute=parts[1], second=0, microsecond=0)
+        if when <= current:
+            when += datetime.timedelta(days=1)
+        return when.timestamp()
+
+    def _follow_schedule(self, force=False):
+        """Expire holds and apply the scheduled period at boundaries."""
+
+        changeableValues = self.payload["changeableValues"]
+        expired = self.hold_until is not None and self.updated >= self.hold_until
+        if expired:
+            # Temporary holds end at nextPeriodTime.
+            self.hold_until = None
+            changeableValues["thermostatSetpointStatus"] = "NoHold"
+        if not (force or expired or self.updated >= self.next_boundary):
+            return
+
+        period = self.schedule.current(self.updated)
+        following = self.schedule.next(self.updated)
+        self.next_boundary = following.start.timestamp()
+        self.payload["currentSchedulePeriod"] = {
+            "day": period.day,
+            "period": period.period,
+        }
+        if changeableValues.get("thermostatSetpointStatus") == "NoHold":
+            changeableValues["heatSetpoint"] = period.heatSetpoint
+            changeableValues["coolSetpoint"] = period.coolSetpoint
+            changeableValues["nextPeriodTime"] = following.start.strftime("%H:%M:00")
+
+    def _step(self, seconds):
+        """Advance the dynamics by seconds."""
+
+        self._follow_schedule()
+        changeableValues = self.payload["changeableValues"]
+        mode = changeableValues.get("mode")
+        heatSetpoint = changeableValues.get("heatSetpoint")
+        coolSetpoint = changeableValues.get("coolSetpoint")
+        operationStatus = self.payload["operationStatus"]
+        equipment = operationStatus["mode"]
+
+        if mode in ("Heat", "Auto") and equipment != "Cool":
+            if self.temperature < heatSetpoint - HYSTERESIS:
+                equipment = "Heat"
+            elif self.temperature > heatSetpoint + HYSTERESIS:
+                equipment = "EquipmentOff"
+        if mode in ("Cool", "Auto") and equipment != "Heat":
+            if self.temperature > coolSetpoint + HYSTERESIS:
+                equipment = "Cool"
+            elif self.temperature < coolSetpoint - HYSTERESIS:
+                equipment = "EquipmentOff"
+        if mode == "Off" or (mode == "Heat" and equipment == "Cool"):
+            equipment = "EquipmentOff"
+        if mode == "Cool" and equipment == "Heat":
+            equipment = "EquipmentOff"
+
+        hours = seconds / 3600.0
+        outdoor = self._outdoor(self.updated)
+        self.temperature += LEAK_FACTOR * (outdoor - self.temperature) * hours
+        if equipment == "Heat":
+            self.temperature += EQUIPMENT_RATE * hours
+        elif equipment == "Cool":
+            self.temperature -= EQUIPMENT_RATE * hours
+
+        operationStatus["mode"] = equipment
+        operationStatus["fanRequest"] = equipment != "EquipmentOff"
+        self.payload["outdoorTemperature"] = round(outdoor, 1)
+
+    def update(self, data, now):
+        """Apply a thermostat update, returning an error message or None."""
+
+        payload = self.payload
+        mode = data.get("mode", payload["changeableValues"]["mode"])
+        if mode not in payload["allowedModes"]:
+            return "Invalid mode %s" % mode
+        for setpoint in ("heat", "cool"):
+            value = data.get(setpoint + "Setpoint")
+            if value is None:
+                continue
+            minimum = payload["min%sSetpoint" % setpoint.capitalize()]
+            maximum = payload["max%sSetpoint" % setpoint.capitalize()]
+            if not minimum <= value <= maximum:
+                return "%sSetpoint %s out of range" % (setpoint, value)
+
+        changeableValues = payload["changeableValues"]
+        changed = any(
+            data.get(key) is not None and data[key] != changeableValues.get(key)
+            for key in ("heatSetpoint", "coolSetpoint")
+        )
+        for key in ("mode", "heatSetpoint", "coolSetpoint", "autoChangeoverActive"):
+            if key in data:
+                changeableValues[key] = data[key]
+        status = data.get("thermostatSetpointStatus")
+        if status is None and changed:
+            status = "TemporaryHold"
+        if status is not None:
+            changeableValues["thermostatSetpointStatus"] = status
+        self.hold_until = None
+        if status in ("TemporaryHold", "HoldUntil"):
+            nextPeriodTime = data.get("nextPeriodTime") or self.schedule.next(
+                now
+            ).start.strftime("%H:%M:00")
+            changeableValues["nextPeriodTime"] = nextPeriodTime
+            self.hold_until = self._next_time(nextPeriodTime)
+        changeableValues["heatCoolMode"] = mode
+        if status == "NoHold" and not changed:
+            # Resuming the schedule, new setpoints last until the next period.
+            self._follow_schedule(force=True)
+        return None
+
+
+class _WaterLeakDetector(object):
+    """State of a simulated water leak detector."""
+
+    def __init__(self, simulation, location, deviceId, index, now):
+        """Initialize the detector."""
+
+        rng = simulation._random
+        self.location = location
+        self.updated = now
+        self.leak_until = None
+        self.payload = {
+            "deviceID": deviceId,
+            "deviceType": "Water Leak Detector",
+            "deviceClass": "LeakDetector",
+            "name": "Leak Detector %s" % index,
+            "userDefinedDeviceName": "Leak Detector %s" % index,
+            "macID": deviceId[4:],
+            "waterPresent": False,
+            "currentAlarms": [],
+            "batteryRemaining": rng.randint(50, 100),
+            "isRegistered": True,
+            "hasDeviceCheckedIn": True,
+            "isDeviceOffline": False,
+            "wifiSignalStrength": rng.randint(-80, -40),
+            "lastCheckin": _isoformat(now),
+            "currentSensorReadings": {
+                "temperature": round(rng.uniform(10.0, 22.0), 1),
+                "humidity": rng.randint(30, 80),
+            },
+        }
+
+    def advance(self, simulation, now):
+        """Raise and clear leaks up to now."""
+
+        seconds = now - self.updated
+        if seconds <= 0:
+            return
+        self.updated = now
+        if self.leak_until is not None and now >= self.leak_until:
+            self.clear()
+        elif self.leak_until is None and simulation._leak_rate:
+            probability = 1 - math.exp(-simulation._leak_rate * seconds)
+            if simulation._random.random() < probability:
+                self.leak(now, simulation._leak_duration)
+        self.payload["lastCheckin"] = _isoformat(now)
+
+    def leak(self, now, duration=None):
+        """Start a leak."""
+
+        self.leak_until = now + duration if duration is not None else float("inf")
+        self.payload["waterPresent"] = True
+        self.payload["currentAlarms"] = [
+            {"alarmType": "WaterPresent", "time": _isoformat(now)}
+        ]
+
+    def clear(self):
+        """End a leak."""
+
+        self.leak_until = None
+        self.payload["waterPresent"] = False
+        self.payload["currentAlarms"] = []
+
+
+def _isoformat(when):
+    """Return a timestamp as the API formats it."""
+
+    when = datetime.datetime.fromtimestamp(when, datetime.timezone.utc)
+    return when.strftime("%Y-%m-%dT%H:%M:%S")
+
+
+class Simulation(object):
+    """Fleet of simulated thermostats and water leak detectors.
+
+    Each location gets ``thermostats`` thermostats and ``leak_detectors``
+    water leak detectors. Indoor temperatures drift toward the outdoor
+    temperature and are driven to the setpoints by the equipment, shown in
+    ``operationStatus``. Thermostats follow a timed schedule, temporary
+    holds expire at ``nextPeriodTime`` and detectors raise a leak alarm at
+    ``leak_rate`` per second, cleared after ``leak_duration`` seconds.
+    Simulated time runs ``speed`` times faster than the clock and devices
+    only catch up when they are read, so large fleets stay cheap.
+    """
+
+    def __init__(
+        self,
+        locations=1,
+        thermostats=2,
+        leak_detectors=1,
+        timeZone="Eastern",
+        speed=1.0,
+        leak_rate=0.0,
+        leak_duration=1800,
+        seed=None,
+        clock=time.time,
+    ):
+        """Initialize and configure the Simulation class."""
+
+        self._random = random.Random(seed)
+        self._timeZone = timeZone
+        self._tz = time_zone(timeZone)
+        self._speed = speed
+        self._leak_rate = leak_rate
+        self._leak_duration = leak_duration
+        self._clock = clock
+        self._started = clock()
+        self._offset = 0.0
+        self._lock = threading.Lock()
+        self._locations = []
+        self._locations_by_id = {}
+        self._devices = {}
+        self._requests = 0
+
+        now = self.now()
+        for index in range(locations):
+            locationId = 1000000 + index
+            location = {
+                "locationID": locationId,
+                "name": "Location %s" % index,
+                "streetAddress": "%s Simulated Street" % index,
+                "city": "Simcity",
+                "state": "NY",
+                "country": "US",
+                "zipcode": "%05d" % (10000 + index % 90000),
+                "timeZone": timeZone,
+                "daylightSavingTimeEnabled": True,
+                "geoFenceEnabled": False,
+                "users": [
+                    {
+                        "userID": 2000000 + index,
+                        "username": "user%s@example.com" % index,
+                        "firstname": "User",
+                        "lastname": str(index),
+                        "isOptOut": "False",
+                    }
+                ],
+                "devices": [],
+            }
+            for number in range(thermostats):
+                deviceId = "LCC-%012X" % (index * 256 + number)
+                device = _Thermostat(self, location, deviceId, number, now)
+                self._devices[deviceId] = device
+                location["devices"].append(device.payload)
+            for number in range(leak_detectors):
+                deviceId = "WLD-%012X" % (index * 256 + number)
+                device = _WaterLeakDetector(self, location, deviceId, number, now)
+                self._devices[deviceId] = device
+                location["devices"].append(device.payload)
+            self._locations.append(location)
+            self._locations_by_id[str(locationId)] = location
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s locations, %s devices>" % (
+            self.__class__.__name__,
+            len(self._locations),
+            len(self._devices),
+        )
+
+    @property
+    def requests(self):
+        """Return the number of requests served."""
+
+        return self._requests
+
+    def now(self):
+        """Return the simulated time."""
+
+        elapsed = (self._clock() - self._started) * self._speed
+        return self._started + elapsed + self._offset
+
+    def advance(self, seconds):
+        """Move simulated time forward by seconds."""
+
+        with self._lock:
+            self._offset += seconds
+
+    def _device(self, deviceId, now):
+        """Return a device brought up to now, or None."""
+
+        device = self._devices.get(deviceId)
+        if device is None:
+            return None
+        if isinstance(device, _Thermostat):
+            device.advance(now)
+        else:
+            device.advance(self, now)
+        return device
+
+    def leak(self, deviceId, duration=None):
+        """Start a leak on a water leak detector."""
+
+        with self._lock:
+            self._devices[deviceId].leak(self.now(), duration)
+
+    def clear(self, deviceId):
+        """End a leak on a water leak detector."""
+
+        with self._lock:
+            self._devices[deviceId].clear()
+
+    def lyric(self, **kwargs):
+        """Return a Lyric instance talking to this simulation."""
+
+        transport = SimulatorTransport(self, kwargs.pop("latency", 0))
+        return Lyric("simulator", "simulator", transport=transport, **kwargs)
+
+    def handle(self, method, path, params, data=None):
+        """Return the status code and body of an API request."""
+
+        with self._lock:
+            self._requests += 1
+            now = self.now()
+            parts = [part for part in path.split("/") if part]
+            locationId = params.get("locationId")
+
+            if method == "GET" and parts == ["locations"]:
+                for deviceId in self._devices:
+                    self._device(deviceId, now)
+                return 200, self._locations
+
+            if parts[:1] != ["devices"]:
+                return 404, {"code": 404, "message": "Not found"}
+            location = self._location(locationId)
+            if location is None:
+                return 404, {"code": 404, "message": "Location not found"}
+
+            if method == "GET" and len(parts) <= 2:
+                deviceType = {
+                    "thermostats": "Thermostat",
+                    "waterLeakDetectors": "Water Leak Detector",
+                }.get(parts[1] if len(parts) == 2 else None)
+                devices = []
+                for payload in location["devices"]:
+                    if deviceType is None or payload["deviceType"] == deviceType:
+                        devices.append(self._device(payload["deviceID"], now).payload)
+                return 200, devices
+
+            device = self._device(parts[2], now)
+            if device is None or device.location is not location:
+                return 404, {"code": 404, "message": "Device not found"}
+            if parts[1] == "schedule" and isinstance(device, _Thermostat):
+                return 200, device.schedule_payload
+            if method == "GET" and len(parts) == 3:
+                return 200, device.payload
+            if method == "POST" and isinstance(device, _Thermostat):
+                if len(parts) == 3:
+                    error = device.update(data or {}, now)
+                    if error is not None:
+                        return 400, {"code": 400, "message": error}
+                    return 200, None
+                if parts[3:] == ["fan"] and data and "mode" in data:
+                    fan = device.payload["settings"]["fan"]
+                    if data["mode"] not in fan["allowedModes"]:
+                        return 400, {"code": 400, "message": "Invalid fan mode"}
+                    fan["changeableValues"] = {"mode": data["mode"]}
+                    return 200, None
+            return 404, {"code": 404, "message": "Not found"}
+
+    def _location(self, locationId):
+        """Return a location by its id from a query parameter."""
+
+        return self._locations_by_id.get(str(locationId))
+
+
+class SimulatorTransport(Transport):
+    """Serve the API endpoints from a Simulation.
+
+    ``latency`` adds that many seconds to every request, requests with a
+    shorter timeout fail with TransportError once it elapsed.
+    """
+
+    def __init__(self, simulation, latency=0):
+        """Initialize and configure the SimulatorTransport class."""
+
+        self._simulation = simulation
+        self._latency = latency
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Return the simulated response of a request."""
+
+        if timeout is not None and self._latency > timeout:
+            time.sleep(timeout)
+            raise TransportError("Simulated request timed out after %.3fs" % timeout)
+        if self._latency:
+            time.sleep(self._latency)
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path.split("/v2/", 1)[-1]
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        status_code, body = self._simulation.handle(
+            method.upper(), path, params, json
+        )
+        content = _dumps(body) if body is not None else b""
+        return Response(
+            status_code, content, {"Content-Type": "application/json"}, url
+        )
+
+
+def _dumps(value):
+    """Return value as JSON bytes."""
+
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
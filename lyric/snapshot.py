@@ -0,0 +1,431 @@
+#  -*- coding:utf-8 -*-
+
+"""Compact binary snapshots of the cached state, with delta frames.
+
+A frame is ``LYS\\x01``, a kind byte (``F`` for a full snapshot, ``D`` for a
+delta), the varint sequence number of the frame and of the frame it applies
+to, followed by a zlib compressed body. The body holds a table of every
+distinct string followed by a single value, encoded as a tag byte and its
+data with strings referring to the table.
+
+Deltas work at location and device granularity: a changed device is sent
+whole, unchanged devices are not sent at all.
+"""
+
+import collections.abc
+import struct
+import zlib
+
+from . import Lyric
+from .exceptions import LyricError
+from .transport import Transport
+
+_MAGIC = b"LYS\x01"
+_FULL = b"F"
+_DELTA = b"D"
+
+_NONE = 0
+_TRUE = 1
+_FALSE = 2
+_INT = 3
+_FLOAT = 4
+_STR = 5
+_LIST = 6
+_DICT = 7
+
+_DOUBLE = struct.Struct("<d")
+
+
+def _write_varint(out, value):
+    """Append an unsigned varint."""
+
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(data, offset):
+    """Return an unsigned varint and the offset after it."""
+
+    value = 0
+    shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, offset
+        shift += 7
+
+
+class _Encoder(object):
+    """Encode a value, collecting its strings into a table."""
+
+    def __init__(self):
+        """Initialize the encoder."""
+
+        self.strings = {}
+        self.out = bytearray()
+
+    def string(self, value):
+        """Append a reference to a string."""
+
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+        _write_varint(self.out, index)
+
+    def value(self, value):
+        """Append a value."""
+
+        out = self.out
+        if value is None:
+            out.append(_NONE)
+        elif value is True:
+            out.append(_TRUE)
+        elif value is False:
+            out.append(_FALSE)
+        elif isinstance(value, int):
+            out.append(_INT)
+            _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+        elif isinstance(value, float):
+            out.append(_FLOAT)
+            out += _DOUBLE.pack(value)
+        elif isinstance(value, str):
+            out.append(_STR)
+            self.string(value)
+        elif isinstance(value, collections.abc.Mapping):
+            out.append(_DICT)
+            _write_varint(out, len(value))
+            for key, item in value.items():
+                self.string(key)
+                self.value(item)
+        elif isinstance(value, (list, tuple)):
+            out.append(_LIST)
+            _write_varint(out, len(value))
+            for item in value:
+                self.value(item)
+        else:
+            raise TypeError("Cannot encode %r" % type(value))
+
+    def body(self):
+        """Return the string table followed by the encoded values."""
+
+        table = bytearray()
+        _write_varint(table, len(self.strings))
+        for value in self.strings:
+            encoded = value.encode("utf-8")
+            _write_varint(table, len(encoded))
+            table += encoded
+        return bytes(table + self.out)
+
+
+class _Decoder(object):
+    """Decode a body written by _Encoder."""
+
+    def __init__(self, data):
+        """Initialize the decoder and read the string table."""
+
+        self.data = data
+        count, offset = _read_varint(data, 0)
+        self.strings = []
+        for _ in range(count):
+            length, offset = _read_varint(data, offset)
+            self.strings.append(data[offset : offset + length].decode("utf-8"))
+            offset += length
+        self.offset = offset
+
+    def value(self):
+        """Return the next value."""
+
+        data = self.data
+        tag = data[self.offset]
+        self.offset += 1
+        if tag == _NONE:
+            return None
+        if tag == _TRUE:
+            return True
+        if tag == _FALSE:
+            return False
+        if tag == _INT:
+            value, self.offset = _read_varint(data, self.offset)
+            return value >> 1 if not value & 1 else -((value + 1) >> 1)
+        if tag == _FLOAT:
+            value = _DOUBLE.unpack_from(data, self.offset)[0]
+            self.offset += _DOUBLE.size
+            return value
+        if tag == _STR:
+            index, self.offset = _read_varint(data, self.offset)
+            return self.strings[index]
+        if tag == _DICT:
+            count, self.offset = _read_varint(data, self.offset)
+            result = {}
+            for _ in range(count):
+                index, self.offset = _read_varint(data, self.offset)
+                result[self.strings[index]] = self.value()
+            return result
+        if tag == _LIST:
+            count, self.offset = _read_varint(data, self.offset)
+            return [self.value() for _ in range(count)]
+        raise ValueError("Unknown tag %s in snapshot" % tag)
+
+
+def encode(value):
+    """Return the compressed binary encoding of a JSON compatible value."""
+
+    encoder = _Encoder()
+    encoder.value(value)
+    return zlib.compress(encoder.body())
+
+
+def decode(data):
+    """Return the value of a compressed binary encoding."""
+
+    return _Decoder(zlib.decompress(data)).value()
+
+
+def _frame(kind, seq, base, value):
+    """Return a frame."""
+
+    header = bytearray(_MAGIC + kind)
+    _write_varint(header, seq)
+    _write_varint(header, base)
+    return bytes(header) + encode(value)
+
+
+def _location_fields(location):
+    """Return a location payload without its devices."""
+
+    return {key: value for key, value in location.items() if key != "devices"}
+
+
+def _diff(old, new):
+    """Return the delta turning locations payload old into new."""
+
+    before = {location.get("locationID"): location for location in old}
+    changes = []
+    for location in new:
+        locationId = location.get("locationID")
+        previous = before.get(locationId)
+        if previous is location:
+            continue
+        devices = location.get("devices") or []
+        order = [device.get("deviceID") for device in devices]
+        if previous is None:
+            changes.append(
+                {
+                    "locationID": locationId,
+                    "fields": _location_fields(location),
+                    "devices": devices,
+                    "order": order,
+                }
+            )
+            continue
+
+        change = {"locationID": locationId}
+        fields = _location_fields(location)
+        if fields != _location_fields(previous):
+            change["fields"] = fields
+        previous_devices = {
+            device.get("deviceID"): device for device in previous.get("devices") or []
+        }
+        changed = []
+        for device in devices:
+            other = previous_devices.get(device.get("deviceID"))
+            if other is not device and other != device:
+                changed.append(device)
+        if changed:
+            change["devices"] = changed
+        if order != list(previous_devices):
+            change["order"] = order
+        if len(change) > 1:
+            changes.append(change)
+
+    delta = {"locations": changes}
+    order = [location.get("locationID") for location in new]
+    if order != list(before):
+        delta["order"] = order
+    return delta
+
+
+def _apply(old, delta):
+    """Return locations payload old with a delta applied.
+
+    Unchanged locations and devices are shared with old.
+    """
+
+    before = {location.get("locationID"): location for location in old}
+    for change in delta["locations"]:
+        locationId = change["locationID"]
+        previous = before.get(locationId) or {}
+        location = change.get("fields")
+        if location is None:
+            location = _location_fields(previous)
+        devices = {
+            device.get("deviceID"): device for device in previous.get("devices") or []
+        }
+        for device in change.get("devices") or []:
+            devices[device.get("deviceID")] = device
+        order = change.get("order")
+        if order is None:
+            order = list(devices)
+        location["devices"] = [
+            devices[deviceId] for deviceId in order if deviceId in devices
+        ]
+        before[locationId] = location
+    order = delta.get("order")
+    if order is None:
+        order = list(before)
+    return [before[locationId] for locationId in order]
+
+
+class SnapshotWriter(object):
+    """Encode successive locations payloads as full and delta frames.
+
+    The first frame is a full snapshot, later frames are deltas against the
+    previous frame. Every ``full_every`` frames a full snapshot is written
+    again so new readers can join.
+    """
+
+    def __init__(self, full_every=None):
+        """Initialize and configure the SnapshotWriter class."""
+
+        self._full_every = full_every
+        self._previous = None
+        self._seq = 0
+        self._since_full = 0
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: frame %s>" % (self.__class__.__name__, self._seq)
+
+    @property
+    def seq(self):
+        """Return the sequence number of the last frame."""
+
+        return self._seq
+
+    def full(self, locations):
+        """Return a full snapshot frame of a locations payload."""
+
+        self._seq += 1
+        self._since_full = 0
+        self._previous = locations
+        return _frame(_FULL, self._seq, 0, locations)
+
+    def write(self, locations):
+        """Return a frame of a locations payload, a delta when possible."""
+
+        locations = locations or []
+        if self._previous is None or (
+            self._full_every is not None and self._since_full + 1 >= self._full_every
+        ):
+            return self.full(locations)
+        delta = _diff(self._previous, locations)
+        base = self._seq
+        self._seq += 1
+        self._since_full += 1
+        self._previous = locations
+        return _frame(_DELTA, self._seq, base, delta)
+
+    def export(self, lyric_api):
+        """Return a frame of the cached state of a Lyric instance."""
+
+        return self.write(lyric_api._locations)
+
+
+class SnapshotLoader(object):
+    """Rebuild a locations payload from snapshot frames."""
+
+    def __init__(self):
+        """Initialize and configure the SnapshotLoader class."""
+
+        self._locations = None
+        self._seq = None
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: frame %s>" % (self.__class__.__name__, self._seq)
+
+    @property
+    def seq(self):
+        """Return the sequence number of the last loaded frame."""
+
+        return self._seq
+
+    @property
+    def locations(self):
+        """Return the loaded locations payload."""
+
+        return self._locations
+
+    def load(self, frame):
+        """Load a full or delta frame.
+
+        Raises ValueError for malformed frames and for deltas that do not
+        apply to the last loaded frame.
+        """
+
+        if frame[: len(_MAGIC)] != _MAGIC:
+            raise ValueError("Not a snapshot frame")
+        offset = len(_MAGIC)
+        kind = frame[offset : offset + 1]
+        try:
+            seq, offset = _read_varint(frame, offset + 1)
+            base, offset = _read_varint(frame, offset)
+            value = decode(frame[offset:])
+        except (zlib.error, IndexError, UnicodeDecodeError) as e:
+            raise ValueError("Malformed snapshot frame: %s" % e)
+
+        if kind == _FULL:
+            self._locations = value
+        elif kind == _DELTA:
+            if self._seq != base:
+                raise ValueError(
+                    "Delta %s applies to frame %s, loaded %s" % (seq, base, self._seq)
+                )
+            self._locations = _apply(self._locations, value)
+        else:
+            raise ValueError("Unknown snapshot frame kind %r" % kind)
+        self._seq = seq
+        return seq
+
+    def lyric(self, local_time=False):
+        """Return a read-only Lyric serving the loaded state."""
+
+        return SnapshotLyric(self, local_time)
+
+
+class SnapshotLyric(Lyric):
+    """Read-only Lyric serving the state of a SnapshotLoader.
+
+    Locations, users and devices read like on any Lyric instance, requests
+    to the API fail with LyricError.
+    """
+
+    def __init__(self, loader, local_time=False):
+        """Initialize the view."""
+
+        self._loader = loader
+        super(SnapshotLyric, self).__init__(
+            None, None, local_time=local_time, transport=Transport()
+        )
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: frame %s>" % (self.__class__.__name__, self._loader.seq)
+
+    @property
+    def _locations(self):
+        """Return the loaded locations."""
+
+        return self._loader.locations
+
+    def _request(self, method, endpoint, data=None, **params):
+        """Refuse requests, snapshots are read-only."""
+
+        raise LyricError("Snapshot views are read-only")
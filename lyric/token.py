@@ -0,0 +1,251 @@
+#  -*- coding:utf-8 -*-
+
+"""Token persistence shared between threads and processes."""
+
+import json
+import os
+import threading
+import time
+
+from .exceptions import DeadlineExceeded
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+# Refresh tokens this many seconds before they expire.
+EXPIRY_MARGIN = 30
+
+
+def token_expired(token, margin=EXPIRY_MARGIN):
+    """Return whether a token expired or is about to."""
+
+    expires_at = token.get("expires_at")
+    if expires_at is None:
+        return False
+    return float(expires_at) - margin < time.time()
+
+
+def read_token(path):
+    """Return the token stored in a file, or None."""
+
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def write_token(path, token):
+    """Write a token to a file atomically.
+
+    The token is written to a temporary file next to path which then
+    replaces it, so readers never see a partially written token.
+    """
+
+    tmp_path = "%s.%s-%s.tmp" % (path, os.getpid(), threading.get_ident())
+    try:
+        with os.fdopen(
+            os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w"
+        ) as f:
+            json.dump(token, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class FileLock(object):
+    """Exclusive lock held through a lock file, shared between processes.
+
+    Falls back to a lock within the current process on platforms without
+    fcntl or msvcrt.
+    """
+
+    def __init__(self, path):
+        """Initialize the lock."""
+
+        self._path = path
+        self._lock = threading.RLock()
+        self._fd = None
+        self._depth = 0
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s>" % (self.__class__.__name__, self._path)
+
+    def acquire(self, timeout=None):
+        """Block until the lock is held, or timeout seconds passed.
+
+        Returns whether the lock is held.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._lock.acquire(timeout=-1 if timeout is None else timeout):
+            return False
+        self._depth += 1
+        if self._depth > 1:
+            return True
+        try:
+            self._fd = os.open(self._path, os.O_RDWR | os.O_CREAT, 0o600)
+            if fcntl is not None or msvcrt is not None:
+                while not self._lock_fd(deadline is not None):
+                    if time.monotonic() >= deadline:
+                        self._release_fd()
+                        self._depth -= 1
+                        self._lock.release()
+                        return False
+                    time.sleep(min(0.05, max(0, deadline - time.monotonic())))
+        except Exception:
+            self._release_fd()
+            self._depth -= 1
+            self._lock.release()
+            raise
+        return True
+
+    def _lock_fd(self, nonblocking):
+        """Lock the lock file, returning False if it is held elsewhere."""
+
+        try:
+            if fcntl is not None:
+                flags = fcntl.LOCK_EX | (fcntl.LOCK_NB if nonblocking else 0)
+                fcntl.flock(self._fd, flags)
+            else:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                mode = msvcrt.LK_NBLCK if nonblocking else msvcrt.LK_LOCK
+                msvcrt.locking(self._fd, mode, 1)
+        except OSError:
+            # Held elsewhere, flock and locking signal it with an OSError.
+            if not nonblocking:
+                raise
+            return False
+        return True
+
+    def release(self):
+        """Release the lock."""
+
+        self._depth -= 1
+        if self._depth == 0:
+            self._release_fd()
+        self._lock.release()
+
+    def _release_fd(self):
+        """Unlock and close the lock file."""
+
+        if self._fd is None:
+            return
+        try:
+            if fcntl is not None:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+            elif msvcrt is not None:
+                os.lseek(self._fd, 0, os.SEEK_SET)
+                msvcrt.locking(self._fd, msvcrt.LK_UNLCK, 1)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+    def __enter__(self):
+        """Acquire the lock."""
+
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Release the lock."""
+
+        self.release()
+        return False
+
+
+class TokenBroker(object):
+    """Token store shared by every process using the same account.
+
+    The token lives in a file guarded by a lock file. The first process to
+    find the token expired refreshes it while holding the lock; the others
+    wait for the lock and then pick up the refreshed token from the file
+    without a token request of their own.
+    """
+
+    def __init__(self, path, lock_path=None):
+        """Initialize and configure the TokenBroker class."""
+
+        self._path = path
+        self._lock = FileLock(lock_path or path + ".lock")
+        self._stat = None
+        self._token = None
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s>" % (self.__class__.__name__, self._path)
+
+    @property
+    def path(self):
+        """Return the path of the token file."""
+
+        return self._path
+
+    def _file_stat(self):
+        """Return what identifies the current version of the token file."""
+
+        try:
+            stat = os.stat(self._path)
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def changed(self):
+        """Return whether the token file changed since it was last loaded."""
+
+        return self._file_stat() != self._stat
+
+    def load(self):
+        """Return the stored token, reading the file only when it changed."""
+
+        stat = self._file_stat()
+        if stat != self._stat:
+            self._token = read_token(self._path)
+            self._stat = stat
+        return self._token
+
+    def save(self, token):
+        """Store a token."""
+
+        with self._lock:
+            write_token(self._path, token)
+            self._token = token
+            self._stat = self._file_stat()
+
+    def refresh(self, stale_token, refresher, timeout=None):
+        """Return a fresh token, calling refresher only if nobody else did.
+
+        ``refresher`` is called with the current token and returns the new
+        one, it only runs while this process holds the lock. Raises
+        DeadlineExceeded when the lock is not free within timeout seconds.
+        """
+
+        stale_access_token = (stale_token or {}).get("access_token")
+        if not self._lock.acquire(timeout):
+            raise DeadlineExceeded("Deadline passed waiting for the token lock")
+        try:
+            stored = self.load()
+            if (
+                stored
+                and stored.get("access_token") != stale_access_token
+                and not token_expired(stored)
+            ):
+                return stored
+            token = refresher(stored or stale_token)
+            self.save(token)
+            return token
+        finally:
+            self._lock.release()
@@ -0,0 +1,228 @@
+#  -*- coding:utf-8 -*-
+
+"""Opt-in tracing of property reads, cache lookups, scans and requests."""
+
+import collections
+import os
+import threading
+import traceback
+
+import lyric
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Classes whose properties are traced.
+_CLASSES = (
+    lyric.lyricDevice,
+    lyric.Device,
+    lyric.Thermostat,
+    lyric.WaterLeakDetector,
+    lyric.Location,
+    lyric.User,
+)
+
+# Lyric methods counted as cache lookups, scans and requests.
+_LOOKUPS = ("_checkCache", "_index_entry", "_device", "_derived", "_user")
+_SCANS = ("_device_type", "_users", "_reindex")
+_REQUESTS = ("_request",)
+
+_COUNTERS = ("reads", "lookups", "scans", "requests")
+
+
+class _Stats(object):
+    """Counters of a single property."""
+
+    def __init__(self):
+        """Initialize the counters."""
+
+        self.counts = dict.fromkeys(_COUNTERS, 0)
+        self.callers = collections.Counter()
+
+
+class Tracer(object):
+    """Attribute cache lookups, scans and HTTP requests to property reads.
+
+    While installed, every property of the device, Location and User
+    classes counts its reads, and every cache lookup, linear scan and
+    request made while it is being read, including through nested
+    properties. For reads coming from outside the library the calling
+    ``stack_depth`` frames are recorded. Installing patches the classes,
+    so it traces every Lyric instance in the process.
+    """
+
+    def __init__(self, stack_depth=3):
+        """Initialize and configure the Tracer class."""
+
+        self._stack_depth = stack_depth
+        self._stats = collections.defaultdict(_Stats)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._patched = []
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s: %s properties>" % (self.__class__.__name__, len(self._stats))
+
+    def __enter__(self):
+        """Install the tracer."""
+
+        self.install()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Uninstall the tracer."""
+
+        self.uninstall()
+        return False
+
+    def install(self):
+        """Start tracing."""
+
+        if self._patched:
+            return
+        for cls in _CLASSES:
+            for name, value in list(vars(cls).items()):
+                if isinstance(value, property) and value.fget is not None:
+                    self._patch(cls, name, self._traced_property(name, value))
+        for counter, names in (
+            ("lookups", _LOOKUPS),
+            ("scans", _SCANS),
+            ("requests", _REQUESTS),
+        ):
+            for name in names:
+                method = vars(lyric.Lyric)[name]
+                self._patch(lyric.Lyric, name, self._counted(counter, method))
+        self._patch(
+            lyric.Lyric,
+            "_locations",
+            self._counted_property("lookups", vars(lyric.Lyric)["_locations"]),
+        )
+
+    def uninstall(self):
+        """Stop tracing and restore the patched classes."""
+
+        while self._patched:
+            owner, name, original = self._patched.pop()
+            setattr(owner, name, original)
+
+    def _patch(self, owner, name, replacement):
+        """Replace an attribute, remembering the original."""
+
+        self._patched.append((owner, name, vars(owner)[name]))
+        setattr(owner, name, replacement)
+
+    def _stack(self):
+        """Return the stack of properties being read on this thread."""
+
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    def _count(self, counter):
+        """Count an event for every property being read."""
+
+        stack = self._stack()
+        if not stack:
+            return
+        with self._lock:
+            for name in set(stack):
+                self._stats[name].counts[counter] += 1
+
+    def _caller(self):
+        """Return the frames outside the library reading a property."""
+
+        frames = [
+            frame
+            for frame in traceback.extract_stack()
+            if not os.path.abspath(frame.filename).startswith(_PACKAGE_DIR)
+        ]
+        return tuple(
+            "%s:%s in %s" % (frame.filename, frame.lineno, frame.name)
+            for frame in frames[-self._stack_depth :]
+        )
+
+    def _traced_property(self, name, prop):
+        """Return prop counting its reads and what they cause."""
+
+        tracer = self
+        fget = prop.fget
+
+        def traced(instance):
+            stack = tracer._stack()
+            key = "%s.%s" % (type(instance).__name__, name)
+            caller = tracer._caller() if not stack else None
+            with tracer._lock:
+                stats = tracer._stats[key]
+                stats.counts["reads"] += 1
+                if caller is not None:
+                    stats.callers[caller] += 1
+            stack.append(key)
+            try:
+                return fget(instance)
+            finally:
+                stack.pop()
+
+        return property(traced, prop.fset, prop.fdel, prop.__doc__)
+
+    def _counted(self, counter, function):
+        """Return function counting its calls as counter."""
+
+        tracer = self
+
+        def counted(*args, **kwargs):
+            tracer._count(counter)
+            return function(*args, **kwargs)
+
+        counted.__doc__ = function.__doc__
+        return counted
+
+    def _counted_property(self, counter, prop):
+        """Return prop counting its reads as counter."""
+
+        return property(self._counted(counter, prop.fget), prop.fset, prop.fdel)
+
+    def reset(self):
+        """Forget the recorded counts."""
+
+        with self._lock:
+            self._stats.clear()
+
+    def stats(self):
+        """Return the counts and callers recorded per property."""
+
+        with self._lock:
+            return {
+                name: dict(stats.counts, callers=dict(stats.callers))
+                for name, stats in self._stats.items()
+            }
+
+    def report(self, limit=20, callers=3):
+        """Return a report of the most expensive properties.
+
+        Properties are ordered by requests, then scans, then cache lookups.
+        """
+
+        with self._lock:
+            items = sorted(
+                self._stats.items(),
+                key=lambda item: (
+                    item[1].counts["requests"],
+                    item[1].counts["scans"],
+                    item[1].counts["lookups"],
+                    item[1].counts["reads"],
+                ),
+                reverse=True,
+            )[:limit]
+            lines = ["%-40s %8s %8s %8s %8s" % (("property",) + _COUNTERS)]
+            for name, stats in items:
+                lines.append(
+                    "%-40s %8s %8s %8s %8s"
+                    % ((name,) + tuple(stats.counts[key] for key in _COUNTERS))
+                )
+                for caller, count in stats.callers.most_common(callers):
+                    lines.append(
+                        "    %6s x %s" % (count, " <- ".join(reversed(caller)))
+                    )
+        return "\n".join(lines)
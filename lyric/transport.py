@@ -0,0 +1,294 @@
+#  -*- coding:utf-8 -*-
+
+"""Transports sending the HTTP requests of Lyric.
+
+A transport implements ``request(lyric_api, method, url, json=None)`` and
+returns a response with ``status_code``, ``headers``, ``content`` and
+``json()``. Network failures are raised as TransportError. Requests made
+within a request context that has a deadline also pass ``timeout``, the
+seconds left to complete them.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import urllib.parse
+
+from .exceptions import LyricError, TransportError
+
+
+class Response(object):
+    """Minimal HTTP response."""
+
+    def __init__(self, status_code, content=b"", headers=None, url=None):
+        """Initialize the response."""
+
+        self.status_code = status_code
+        self.content = content
+        self.headers = headers or {}
+        self.url = url
+
+    def __repr__(self):
+        """Debug string representation."""
+
+        return "<%s [%s]>" % (self.__class__.__name__, self.status_code)
+
+    @property
+    def text(self):
+        """Return the body as text."""
+
+        return self.content.decode("utf-8")
+
+    def json(self):
+        """Return the decoded JSON body."""
+
+        return json.loads(self.text)
+
+
+class Transport(object):
+    """Base class of transports."""
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Send a request and return its response."""
+
+        raise NotImplementedError
+
+    def close(self):
+        """Release the resources of the transport."""
+
+
+class RequestsTransport(Transport):
+    """Send requests through the OAuth2 session of Lyric.
+
+    This is the default transport. ``pool_maxsize`` raises the number of
+    pooled connections per host for concurrent requests.
+    """
+
+    def __init__(self, pool_maxsize=None, timeout=None):
+        """Initialize and configure the RequestsTransport class."""
+
+        self._pool_maxsize = pool_maxsize
+        self._timeout = timeout
+        self._mounted = None
+
+    def _session(self, lyric_api):
+        """Return the session of Lyric with the connection pool configured."""
+
+        session = lyric_api._lyricApi
+        if session is None:
+            raise LyricError("No token available, authorize first")
+        if self._pool_maxsize is not None and session is not self._mounted:
+            from requests.adapters import HTTPAdapter
+
+            adapter = HTTPAdapter(
+                pool_connections=self._pool_maxsize, pool_maxsize=self._pool_maxsize
+            )
+            session.mount("https://", adapter)
+            self._mounted = session
+        return session
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Send a request through the OAuth2 session."""
+
+        import requests
+
+        if timeout is None:
+            timeout = self._timeout
+        elif isinstance(self._timeout, (int, float)):
+            timeout = min(timeout, self._timeout)
+        try:
+            return self._session(lyric_api).request(
+                method,
+                url,
+                json=json,
+                timeout=timeout,
+                client_id=lyric_api._client_id,
+                client_secret=lyric_api._client_secret,
+            )
+        except requests.exceptions.RequestException as e:
+            raise TransportError(e)
+
+
+class HttpxTransport(Transport):
+    """Send requests through a pooled httpx client, using HTTP/2 if available.
+
+    Requires the optional httpx package, HTTP/2 also needs h2.
+    """
+
+    def __init__(self, http2=True, max_connections=100, timeout=30):
+        """Initialize and configure the HttpxTransport class."""
+
+        import httpx
+
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                http2 = False
+        self._httpx = httpx
+        self._timeout = timeout
+        self._client = httpx.Client(
+            http2=http2,
+            limits=httpx.Limits(max_connections=max_connections),
+            timeout=timeout,
+        )
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Send a request with the bearer token of Lyric."""
+
+        headers = {"Accept": "application/json"}
+        token = lyric_api.token
+        if token and token.get("access_token"):
+            headers["Authorization"] = "Bearer %s" % token["access_token"]
+        kwargs = {}
+        if timeout is not None:
+            if isinstance(self._timeout, (int, float)):
+                timeout = min(timeout, self._timeout)
+            kwargs["timeout"] = timeout
+        try:
+            response = self._client.request(
+                method, url, json=json, headers=headers, **kwargs
+            )
+        except self._httpx.HTTPError as e:
+            raise TransportError(e)
+        return Response(
+            response.status_code, response.content, dict(response.headers), url
+        )
+
+    def close(self):
+        """Close the pooled connections."""
+
+        self._client.close()
+
+
+def _record_name(method, url):
+    """Return the file name of the recording of a request."""
+
+    parsed = urllib.parse.urlsplit(url)
+    query = sorted(
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(parsed.query)
+        if key != "apikey"
+    )
+    path = parsed.path.split("/v2/", 1)[-1]
+    key = "%s %s?%s" % (method.upper(), path, urllib.parse.urlencode(query))
+    readable = "".join(char if char.isalnum() else "_" for char in path)[:60]
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+    return "%s_%s_%s.json" % (method.lower(), readable, digest)
+
+
+class RecordingTransport(Transport):
+    """Record the responses of another transport to a directory.
+
+    Repeated requests are appended to the same recording, so a replay
+    serves them in the order they were captured.
+    """
+
+    def __init__(self, directory, transport=None):
+        """Initialize and configure the RecordingTransport class."""
+
+        self._directory = directory
+        self._transport = transport or RequestsTransport()
+        self._lock = threading.Lock()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Send a request and record its response."""
+
+        kwargs = {}
+        if timeout is not None:
+            kwargs["timeout"] = timeout
+        response = self._transport.request(lyric_api, method, url, json=json, **kwargs)
+        path = os.path.join(self._directory, _record_name(method, url))
+        entry = {
+            "status_code": response.status_code,
+            "headers": {
+                key: value
+                for key, value in response.headers.items()
+                if key.lower() in ("content-type", "retry-after")
+            },
+            "body": response.content.decode("utf-8"),
+        }
+        with self._lock:
+            recording = _load_recording(path) or {
+                "method": method.upper(),
+                "url": _strip_apikey(url),
+                "responses": [],
+            }
+            recording["responses"].append(entry)
+            with open(path, "w") as f:
+                _json_dump(recording, f)
+        return response
+
+    def close(self):
+        """Close the recorded transport."""
+
+        self._transport.close()
+
+
+class ReplayTransport(Transport):
+    """Serve recorded responses from a directory without any network.
+
+    Recordings holding several responses are served in order and start
+    over when exhausted. Requests without a recording get a 404 response.
+    """
+
+    def __init__(self, directory, loop=True):
+        """Initialize and configure the ReplayTransport class."""
+
+        self._directory = directory
+        self._loop = loop
+        self._recordings = {}
+        self._positions = {}
+        self._lock = threading.Lock()
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Return the next recorded response of a request."""
+
+        name = _record_name(method, url)
+        with self._lock:
+            if name not in self._recordings:
+                self._recordings[name] = _load_recording(
+                    os.path.join(self._directory, name)
+                )
+            recording = self._recordings[name]
+            if not recording or not recording["responses"]:
+                return Response(404, b"", url=url)
+            responses = recording["responses"]
+            position = self._positions.get(name, 0)
+            if position >= len(responses):
+                position = 0 if self._loop else len(responses) - 1
+            self._positions[name] = position + 1
+            entry = responses[position]
+        return Response(
+            entry["status_code"], entry["body"].encode("utf-8"), entry["headers"], url
+        )
+
+
+def _strip_apikey(url):
+    """Return url without the apikey query parameter."""
+
+    parsed = urllib.parse.urlsplit(url)
+    query = [
+        (key, value)
+        for key, value in urllib.parse.parse_qsl(parsed.query)
+        if key != "apikey"
+    ]
+    return urllib.parse.urlunsplit(parsed._replace(query=urllib.parse.urlencode(query)))
+
+
+def _load_recording(path):
+    """Return the recording stored at path, or None."""
+
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def _json_dump(value, f):
+    """Write JSON readable in diffs."""
+
+    json.dump(value, f, indent=2, sort_keys=True)
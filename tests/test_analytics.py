@@ -0,0 +1,200 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of fleet analytics, with and without numpy."""
+
+import unittest
+
+from lyric import analytics
+from lyric.analytics import FleetState
+from lyric.simulator import Simulation
+
+LOCATIONS = [
+    {
+        "locationID": 1,
+        "devices": [
+            {
+                "deviceID": "LCC-1",
+                "deviceType": "Thermostat",
+                "name": "Living",
+                "indoorTemperature": 21.0,
+                "changeableValues": {
+                    "mode": "Heat",
+                    "heatSetpoint": 20.0,
+                    "coolSetpoint": 25.0,
+                },
+            },
+            {
+                "deviceID": "LCC-2",
+                "deviceType": "Thermostat",
+                "name": "Bedroom",
+                "indoorTemperature": 18.0,
+                "changeableValues": {
+                    "mode": "Cool",
+                    "heatSetpoint": 16.0,
+                    "coolSetpoint": 24.0,
+                },
+            },
+        ],
+    },
+    {
+        "locationID": 2,
+        "devices": [
+            {
+                "deviceID": "LCC-3",
+                "deviceType": "Thermostat",
+                "userDefinedDeviceName": "Office",
+                "changeableValues": {"mode": "Heat", "heatSetpoint": 19.0},
+            },
+            {
+                "deviceID": "WLD-1",
+                "deviceType": "Water Leak Detector",
+                "name": "Basement",
+                "waterPresent": True,
+                "batteryRemaining": 80,
+                "currentSensorReadings": {"temperature": 12.5, "humidity": 70},
+            },
+        ],
+    },
+]
+
+
+class FleetStateTests(object):
+    """Queries answered alike with and without numpy."""
+
+    use_numpy = False
+
+    def setUp(self):
+        """Build the fleet state of the payload."""
+
+        self.fleet = FleetState.from_locations(LOCATIONS, use_numpy=self.use_numpy)
+
+    def test_rows(self):
+        """Devices are flattened into rows, missing numbers are None."""
+
+        self.assertEqual(len(self.fleet), 4)
+        rows = {row["deviceId"]: row for row in self.fleet.rows()}
+        self.assertEqual(rows["LCC-1"]["temperatureSetpoint"], 20.0)
+        self.assertEqual(rows["LCC-2"]["temperatureSetpoint"], 24.0)
+        self.assertEqual(rows["LCC-2"]["setpointDeviation"], 6.0)
+        self.assertEqual(rows["LCC-3"]["name"], "Office")
+        self.assertIsNone(rows["LCC-3"]["indoorTemperature"])
+        self.assertIsNone(rows["LCC-3"]["setpointDeviation"])
+        self.assertEqual(rows["WLD-1"]["indoorTemperature"], 12.5)
+        self.assertEqual(rows["WLD-1"]["indoorHumidity"], 70.0)
+
+    def test_where_numeric(self):
+        """Numeric conditions never match missing numbers."""
+
+        self.assertEqual(
+            self.fleet.where("indoorTemperature", ">", 15).column("deviceId"),
+            ["LCC-1", "LCC-2"],
+        )
+        self.assertEqual(
+            self.fleet.where("indoorTemperature", "!=", 21).column("deviceId"),
+            ["LCC-2", "WLD-1"],
+        )
+
+    def test_where_object(self):
+        """Object columns compare as is and support in."""
+
+        self.assertEqual(
+            self.fleet.where("mode", "==", "Heat").column("deviceId"),
+            ["LCC-1", "LCC-3"],
+        )
+        self.assertEqual(
+            self.fleet.where("locationId", "in", [2]).column("deviceId"),
+            ["LCC-3", "WLD-1"],
+        )
+        self.assertEqual(len(self.fleet.where("waterPresent", "==", True)), 1)
+
+    def test_where_chained(self):
+        """Conditions narrow down in sequence."""
+
+        fleet = self.fleet.where("deviceType", "==", "Thermostat").where(
+            "setpointDeviation", ">=", 1
+        )
+        self.assertEqual(fleet.column("deviceId"), ["LCC-1", "LCC-2"])
+        self.assertEqual(len(fleet.where("mode", "==", "Off")), 0)
+
+    def test_where_unsupported(self):
+        """Unknown operators are rejected."""
+
+        with self.assertRaises(ValueError):
+            self.fleet.where("indoorTemperature", "~", 1)
+
+    def test_aggregate(self):
+        """Aggregates skip missing numbers."""
+
+        self.assertEqual(self.fleet.aggregate("indoorTemperature", "count"), 3)
+        self.assertAlmostEqual(self.fleet.aggregate("indoorTemperature"), 51.5 / 3)
+        self.assertEqual(self.fleet.aggregate("indoorTemperature", "min"), 12.5)
+        self.assertEqual(self.fleet.aggregate("heatSetpoint", "max"), 20.0)
+        self.assertEqual(self.fleet.aggregate("heatSetpoint", "sum"), 55.0)
+        self.assertEqual(self.fleet.aggregate("name", "count"), 4)
+
+    def test_aggregate_by(self):
+        """Aggregates grouped by a column, empty groups are None."""
+
+        self.assertEqual(
+            self.fleet.aggregate("indoorTemperature", "mean", by="locationId"),
+            {1: 19.5, 2: 12.5},
+        )
+        self.assertEqual(
+            self.fleet.aggregate("coolSetpoint", "max", by="deviceType"),
+            {"Thermostat": 25.0, "Water Leak Detector": None},
+        )
+
+    def test_aggregate_unsupported(self):
+        """Unknown aggregates and numeric aggregates of objects are rejected."""
+
+        with self.assertRaises(ValueError):
+            self.fleet.aggregate("indoorTemperature", "median")
+        with self.assertRaises(ValueError):
+            self.fleet.aggregate("name", "max")
+
+    def test_empty(self):
+        """An empty fleet aggregates to None."""
+
+        fleet = self.fleet.where("deviceId", "==", "missing")
+        self.assertEqual(len(fleet), 0)
+        self.assertEqual(fleet.rows(), [])
+        self.assertIsNone(fleet.aggregate("indoorTemperature"))
+        self.assertEqual(fleet.aggregate("indoorTemperature", "count"), 0)
+
+
+class ListFleetStateTest(FleetStateTests, unittest.TestCase):
+    """Fleet state held in lists."""
+
+    use_numpy = False
+
+
+@unittest.skipIf(analytics.numpy is None, "numpy is not installed")
+class NumpyFleetStateTest(FleetStateTests, unittest.TestCase):
+    """Fleet state held in numpy arrays."""
+
+    use_numpy = True
+
+
+class LyricFleetStateTest(unittest.TestCase):
+    """Fleet state of Lyric instances."""
+
+    def test_from_lyric(self):
+        """The cached locations of several accounts are combined."""
+
+        accounts = [
+            Simulation(locations=2, thermostats=2, leak_detectors=1, seed=seed).lyric()
+            for seed in (1, 2)
+        ]
+        for lyric_api in accounts:
+            lyric_api.refresh()
+        fleet = FleetState.from_lyric(*accounts, use_numpy=False)
+        self.assertEqual(len(fleet), 12)
+        self.assertEqual(len(accounts[0].fleet_state(use_numpy=False)), 6)
+        self.assertEqual(
+            fleet.aggregate("deviceId", "count", by="deviceType"),
+            {"Thermostat": 8, "Water Leak Detector": 4},
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,162 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of the durable command queue."""
+
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from lyric.commands import CommandQueue
+from lyric.exceptions import HTTPError, LyricError
+from lyric.simulator import Simulation
+
+
+class CommandQueueTest(unittest.TestCase):
+    """Queued thermostat updates against the simulator."""
+
+    def setUp(self):
+        """Create a simulated account with a paused command queue."""
+
+        self.directory = tempfile.mkdtemp()
+        self.outcomes = []
+        self.queue = CommandQueue(
+            os.path.join(self.directory, "commands.db"), backoff=0.01
+        )
+        self.simulation = Simulation(locations=1, thermostats=1, seed=1)
+        self.lyric_api = self.simulation.lyric(command_queue=self.queue)
+        self.queue.stop()
+        self.thermostat = self.lyric_api.locations[0].thermostats[0]
+
+    def tearDown(self):
+        """Close the queue and remove its database."""
+
+        self.queue.close()
+        shutil.rmtree(self.directory)
+
+    def callback(self, command_id, status_code, error):
+        """Record the outcome of a command."""
+
+        self.outcomes.append((command_id, status_code, error))
+
+    def drain(self):
+        """Post the queued commands and wait until they are done."""
+
+        self.queue.start(self.lyric_api)
+        deadline = time.monotonic() + 5
+        while len(self.queue) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.queue.stop()
+        self.assertEqual(len(self.queue), 0)
+
+    def test_queued_updates_are_merged(self):
+        """A second update keeps the changes of the first one still queued."""
+
+        self.thermostat.updateThermostat(heatSetpoint=23, callback=self.callback)
+        self.thermostat.updateThermostat(mode="Cool", callback=self.callback)
+        self.assertEqual(
+            self.queue.pending("devices/thermostats/" + self.thermostat.id)[
+                "heatSetpoint"
+            ],
+            23,
+        )
+
+        self.drain()
+        self.assertEqual(self.thermostat.heatSetpoint, 23)
+        self.assertEqual(self.thermostat.operationMode, "Cool")
+        self.assertEqual(len(self.outcomes), 2)
+        for _, status_code, error in self.outcomes:
+            self.assertEqual(status_code, 200)
+            self.assertIsNone(error)
+
+    def test_revert_of_queued_update_is_sent(self):
+        """Setting a value back to the cached one undoes a queued update."""
+
+        cached = self.thermostat.heatSetpoint
+        self.thermostat.updateThermostat(heatSetpoint=cached + 2)
+        self.assertIsNotNone(self.thermostat.updateThermostat(heatSetpoint=cached))
+
+        self.drain()
+        self.assertEqual(self.thermostat.heatSetpoint, cached)
+
+    def test_update_matching_queued_update_is_skipped(self):
+        """Repeating a queued update does not queue anything."""
+
+        self.thermostat.updateThermostat(heatSetpoint=23)
+        self.assertIsNone(self.thermostat.updateThermostat(heatSetpoint=23))
+
+    def test_posted_device_is_refreshed(self):
+        """A posted command refetches its device, not the whole account."""
+
+        self.thermostat.updateThermostat(heatSetpoint=23)
+        self.drain()
+        requests = self.simulation.requests
+        self.assertEqual(self.thermostat.heatSetpoint, 23)
+        self.assertEqual(self.simulation.requests, requests)
+
+    def test_lyric_error_is_retried(self):
+        """A command failing without a status code is retried."""
+
+        post_raw = self.lyric_api._post_raw
+        errors = [LyricError("No token available")]
+
+        def post(*args, **kwargs):
+            if errors:
+                raise errors.pop()
+            return post_raw(*args, **kwargs)
+
+        self.thermostat.updateThermostat(heatSetpoint=23, callback=self.callback)
+        with mock.patch.object(self.lyric_api, "_post_raw", side_effect=post):
+            self.drain()
+        self.assertEqual(self.outcomes, [(mock.ANY, 200, None)])
+        self.assertEqual(self.thermostat.heatSetpoint, 23)
+
+    def test_client_error_fails_permanently(self):
+        """A rejected command is not retried and reports its error."""
+
+        self.thermostat.updateFan("Sideways", callback=self.callback)
+        self.drain()
+        [(_, status_code, error)] = self.outcomes
+        self.assertEqual(status_code, 400)
+        self.assertIsInstance(error, HTTPError)
+
+
+class DirectUpdateTest(unittest.TestCase):
+    """Thermostat updates posted without a command queue."""
+
+    def setUp(self):
+        """Create a simulated account."""
+
+        self.outcomes = []
+        self.simulation = Simulation(locations=1, thermostats=1, seed=1)
+        self.lyric_api = self.simulation.lyric()
+        self.thermostat = self.lyric_api.locations[0].thermostats[0]
+
+    def callback(self, command_id, status_code, error):
+        """Record the outcome of an update."""
+
+        self.outcomes.append((command_id, status_code, error))
+
+    def test_error_is_passed_to_callback(self):
+        """A rejected update passes its typed error to the callback."""
+
+        self.assertEqual(self.thermostat.updateFan("Sideways", self.callback), 400)
+        [(command_id, status_code, error)] = self.outcomes
+        self.assertIsNone(command_id)
+        self.assertEqual(status_code, 400)
+        self.assertIsInstance(error, HTTPError)
+        self.assertEqual(error.status_code, 400)
+
+    def test_skipped_update_calls_callback(self):
+        """An update that changes nothing still reports its outcome."""
+
+        self.thermostat.updateThermostat(
+            heatSetpoint=self.thermostat.heatSetpoint, callback=self.callback
+        )
+        self.assertEqual(self.outcomes, [(None, None, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
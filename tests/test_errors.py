@@ -0,0 +1,214 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of typed API errors."""
+
+import time
+import unittest
+import urllib.parse
+
+from lyric import Lyric, _CircuitBreaker
+from lyric.exceptions import AuthError, CircuitOpenError, RateLimitError, TransientError
+from lyric.simulator import Simulation, SimulatorTransport
+from lyric.transport import Response
+
+
+class FailingTransport(SimulatorTransport):
+    """Answer with queued error responses before asking the simulation."""
+
+    def __init__(self, simulation):
+        """Initialize and configure the FailingTransport class."""
+
+        super().__init__(simulation)
+        self.failures = []
+        self.broken = set()
+        self.requests = 0
+
+    def request(self, lyric_api, method, url, json=None, timeout=None):
+        """Return the next queued error, or the simulated response.
+
+        Requests for broken locations fail with a server error.
+        """
+
+        self.requests += 1
+        if self.failures:
+            status_code, headers = self.failures.pop(0)
+            return Response(status_code, b"{}", headers, url)
+        params = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(url).query))
+        if params.get("locationId") in self.broken:
+            return Response(503, b"{}", {}, url)
+        return super().request(lyric_api, method, url, json, timeout)
+
+
+class RefreshErrorTest(unittest.TestCase):
+    """Errors of refreshing the locations."""
+
+    def setUp(self):
+        """Create a simulated account behind a failing transport."""
+
+        self.simulation = Simulation(locations=1, thermostats=1, seed=1)
+        self.transport = FailingTransport(self.simulation)
+        self.lyric_api = Lyric("simulator", "simulator", transport=self.transport)
+
+    def test_refresh_raises_typed_error(self):
+        """A throttled refresh raises RateLimitError with its retry after."""
+
+        self.transport.failures.append((429, {"Retry-After": "30"}))
+        with self.assertRaises(RateLimitError) as raised:
+            self.lyric_api.refresh(raise_errors=True)
+        self.assertEqual(raised.exception.retry_after, 30)
+
+    def test_backed_off_refresh_raises_last_error(self):
+        """A refresh backed off after a failure raises that failure."""
+
+        self.transport.failures.append((503, {}))
+        self.assertIsNone(self.lyric_api.refresh())
+        with self.assertRaises(TransientError):
+            self.lyric_api.refresh(raise_errors=True)
+        self.assertEqual(self.simulation.requests, 0)
+
+    def test_refresh_keeps_cached_locations(self):
+        """A failed refresh returns the cached locations unless raising."""
+
+        locations = self.lyric_api.refresh()
+        self.assertTrue(locations)
+        self.transport.failures.append((401, {}))
+        self.assertIs(self.lyric_api.refresh(), locations)
+        self.transport.failures.append((401, {}))
+        self.lyric_api._backoff.clear()
+        with self.assertRaises(AuthError):
+            self.lyric_api.refresh(raise_errors=True)
+
+
+class CircuitBreakerTest(unittest.TestCase):
+    """Opening, half-opening and closing the circuit of an endpoint."""
+
+    def setUp(self):
+        """Create a circuit breaker opening after two failures."""
+
+        self.breaker = _CircuitBreaker(threshold=2, cooldown=0.05, max_cooldown=0.15)
+
+    def trip(self):
+        """Fail the endpoint until its circuit opens."""
+
+        for _ in range(2):
+            self.breaker.check("locations")
+            self.breaker.failure("locations")
+
+    def test_opens_after_threshold(self):
+        """The circuit opens after threshold consecutive failures."""
+
+        self.breaker.failure("locations")
+        self.breaker.check("locations")
+        self.breaker.failure("locations")
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.check("locations")
+        self.assertGreater(raised.exception.retry_after, 0)
+        self.assertLessEqual(raised.exception.retry_after, 0.05)
+        self.breaker.check("devices")
+
+    def test_success_resets_failures(self):
+        """A success in between failures keeps the circuit closed."""
+
+        self.breaker.failure("locations")
+        self.breaker.success("locations")
+        self.breaker.failure("locations")
+        self.breaker.check("locations")
+
+    def test_half_open_lets_one_trial_through(self):
+        """After the cooldown a single trial request is let through."""
+
+        self.trip()
+        time.sleep(0.06)
+        self.breaker.check("locations")
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check("locations")
+
+    def test_successful_trial_closes(self):
+        """A successful trial request closes the circuit."""
+
+        self.trip()
+        time.sleep(0.06)
+        self.breaker.check("locations")
+        self.breaker.success("locations")
+        self.breaker.check("locations")
+        self.breaker.check("locations")
+
+    def test_failed_trial_doubles_cooldown(self):
+        """A failed trial request opens the circuit for twice as long."""
+
+        self.trip()
+        time.sleep(0.06)
+        self.breaker.check("locations")
+        self.breaker.failure("locations")
+        with self.assertRaises(CircuitOpenError) as raised:
+            self.breaker.check("locations")
+        self.assertGreater(raised.exception.retry_after, 0.05)
+
+    def test_retry_after_opens_at_once(self):
+        """A throttled endpoint is suspended for its Retry-After."""
+
+        self.breaker.failure("locations", retry_after=0.05)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.check("locations")
+        time.sleep(0.06)
+        self.breaker.check("locations")
+
+
+
+class LocationFailureTest(unittest.TestCase):
+    """Negative caching and circuit breaking of failing locations."""
+
+    def setUp(self):
+        """Create a simulated account of two locations."""
+
+        self.simulation = Simulation(locations=2, thermostats=1, seed=1)
+        self.transport = FailingTransport(self.simulation)
+
+    def lyric(self, **kwargs):
+        """Return a Lyric instance and its locations."""
+
+        lyric_api = Lyric("simulator", "simulator", transport=self.transport, **kwargs)
+        return lyric_api, lyric_api.locations
+
+    def test_failure_is_negative_cached(self):
+        """A failed fetch is not repeated until the negative cache expires."""
+
+        _, locations = self.lyric(negative_cache_ttl=0.1)
+        self.transport.broken.add(str(locations[0].locationId))
+        self.assertIsNone(locations[0]._thermostats)
+        requests = self.transport.requests
+        self.assertIsNone(locations[0]._thermostats)
+        self.assertEqual(self.transport.requests, requests)
+
+        time.sleep(0.11)
+        self.transport.broken.clear()
+        self.assertTrue(locations[0]._thermostats)
+        self.assertEqual(self.transport.requests, requests + 1)
+
+    def test_failed_refetch_serves_previous(self):
+        """A failed refetch serves the previous value without retrying."""
+
+        _, locations = self.lyric(cache_ttl=0.05, negative_cache_ttl=10)
+        thermostats = locations[0]._thermostats
+        self.assertTrue(thermostats)
+        time.sleep(0.06)
+        self.transport.broken.add(str(locations[0].locationId))
+        self.assertEqual(locations[0]._thermostats, thermostats)
+        requests = self.transport.requests
+        self.assertEqual(locations[0]._thermostats, thermostats)
+        self.assertEqual(self.transport.requests, requests)
+
+    def test_failing_location_opens_its_circuit(self):
+        """A failing location stops being requested, the others are not."""
+
+        _, locations = self.lyric(negative_cache_ttl=0, circuit_threshold=3)
+        self.transport.broken.add(str(locations[0].locationId))
+        requests = self.transport.requests
+        for _ in range(6):
+            self.assertIsNone(locations[0]._thermostats)
+        self.assertEqual(self.transport.requests, requests + 3)
+        self.assertTrue(locations[1]._thermostats)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,151 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of the time-series history of device readings."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from lyric.history import THERMOSTAT_FIELDS, History
+from lyric.simulator import Simulation
+
+
+def _locations(indoorTemperature, heatSetpoint=20):
+    """Return a locations payload of a single thermostat."""
+
+    return [
+        {
+            "locationID": 1,
+            "devices": [
+                {
+                    "deviceID": "LCC-1",
+                    "deviceType": "Thermostat",
+                    "indoorTemperature": indoorTemperature,
+                    "changeableValues": {"heatSetpoint": heatSetpoint},
+                }
+            ],
+        }
+    ]
+
+
+class HistoryTest(unittest.TestCase):
+    """Recording and querying readings."""
+
+    def setUp(self):
+        """Create a directory for segment files."""
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        """Remove the directory."""
+
+        shutil.rmtree(self.directory)
+
+    def record(self, history, count):
+        """Record a reading every 10 seconds, the temperature counting up."""
+
+        for index in range(count):
+            history.record(_locations(float(index)), 1000 + index * 10)
+
+    def test_fields(self):
+        """Thermostats record their readings and setpoints."""
+
+        history = History()
+        self.record(history, 1)
+        self.assertEqual(history.devices, ["LCC-1"])
+        self.assertEqual(history.fields("LCC-1"), THERMOSTAT_FIELDS)
+        self.assertIsNone(history.query("LCC-2"))
+
+    def test_ring_evicts_oldest(self):
+        """Only the last capacity readings are kept in memory."""
+
+        history = History(capacity=3)
+        self.record(history, 5)
+        result = history.query("LCC-1", fields=["indoorTemperature"])
+        self.assertEqual(result["time"], [1020, 1030, 1040])
+        self.assertEqual(result["indoorTemperature"], [2.0, 3.0, 4.0])
+
+    def test_missing_readings(self):
+        """Readings missing from the payload are returned as None."""
+
+        history = History()
+        self.record(history, 1)
+        result = history.query("LCC-1")
+        self.assertEqual(result["indoorHumidity"], [None])
+        self.assertEqual(result["heatSetpoint"], [20.0])
+
+    def test_range_query(self):
+        """Queries return the readings between start and end inclusive."""
+
+        history = History()
+        self.record(history, 10)
+        result = history.query("LCC-1", 1020, 1050, ["indoorTemperature"])
+        self.assertEqual(result["time"], [1020, 1030, 1040, 1050])
+        self.assertEqual(result["indoorTemperature"], [2.0, 3.0, 4.0, 5.0])
+
+    def test_segments_keep_evicted_rows(self):
+        """Evicted readings go to the segment file and are still queried."""
+
+        history = History(capacity=3, directory=self.directory, segment_rows=2)
+        self.record(history, 8)
+        segment = os.path.join(self.directory, "LCC-1.seg")
+        size = os.path.getsize(segment)
+        self.assertGreater(size, 0)
+
+        result = history.query("LCC-1", fields=["indoorTemperature"])
+        self.assertEqual(result["indoorTemperature"], [float(i) for i in range(8)])
+        result = history.query("LCC-1", 1010, 1030, ["indoorTemperature"])
+        self.assertEqual(result["time"], [1010, 1020, 1030])
+
+        history.flush()
+        self.assertGreater(os.path.getsize(segment), size)
+        result = history.query("LCC-1", fields=["indoorTemperature"])
+        self.assertEqual(result["indoorTemperature"], [float(i) for i in range(8)])
+
+    def test_downsample(self):
+        """Readings are aggregated into aligned buckets."""
+
+        history = History()
+        self.record(history, 6)
+        for how, expected in (
+            ("mean", [0.5, 3.0, 5.0]),
+            ("min", [0.0, 2.0, 5.0]),
+            ("max", [1.0, 4.0, 5.0]),
+            ("last", [1.0, 4.0, 5.0]),
+        ):
+            result = history.downsample(
+                "LCC-1", 30, fields=["indoorTemperature"], how=how
+            )
+            self.assertEqual(result["time"], [990, 1020, 1050])
+            self.assertEqual(result["indoorTemperature"], expected)
+        with self.assertRaises(ValueError):
+            history.downsample("LCC-1", 30, how="median")
+
+    def test_downsample_skips_missing(self):
+        """Buckets without readings aggregate to None."""
+
+        history = History()
+        self.record(history, 2)
+        result = history.downsample("LCC-1", 60, fields=["indoorHumidity"])
+        self.assertEqual(result["indoorHumidity"], [None])
+
+
+class LyricHistoryTest(unittest.TestCase):
+    """History recorded by a Lyric instance."""
+
+    def test_refresh_records(self):
+        """Every fetched locations payload is recorded."""
+
+        simulation = Simulation(locations=1, thermostats=2, leak_detectors=1, seed=1)
+        history = History()
+        lyric_api = simulation.lyric(history=history)
+        lyric_api.refresh()
+        lyric_api.refresh()
+        self.assertEqual(len(history.devices), 3)
+        for deviceId in history.devices:
+            self.assertEqual(len(history.query(deviceId)["time"]), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
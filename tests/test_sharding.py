@@ -0,0 +1,148 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of consistent hashing of accounts across poller nodes."""
+
+import collections
+import shutil
+import tempfile
+import unittest
+
+from lyric.sharding import FileCoordinator, HashRing, ShardedPoller
+
+KEYS = ["account-%s" % index for index in range(2000)]
+
+
+class HashRingTest(unittest.TestCase):
+    """Placement of keys on the ring."""
+
+    def placement(self, ring):
+        """Return the node of every key."""
+
+        return {key: ring.node_for(key) for key in KEYS}
+
+    def test_empty_ring(self):
+        """An empty ring has no node for a key."""
+
+        self.assertIsNone(HashRing().node_for("account"))
+
+    def test_placement_is_stable(self):
+        """Rings of the same nodes place keys alike, whatever the order."""
+
+        self.assertEqual(
+            self.placement(HashRing(["a", "b", "c"])),
+            self.placement(HashRing(["c", "a", "b"])),
+        )
+
+    def test_keys_spread_over_nodes(self):
+        """Every node owns a fair share of the keys."""
+
+        nodes = ["a", "b", "c", "d"]
+        counts = collections.Counter(self.placement(HashRing(nodes)).values())
+        self.assertEqual(sorted(counts), nodes)
+        for count in counts.values():
+            self.assertGreater(count, len(KEYS) / len(nodes) / 2)
+
+    def test_adding_node_only_moves_keys_to_it(self):
+        """A new node takes keys from the others and moves no others."""
+
+        ring = HashRing(["a", "b", "c"])
+        before = self.placement(ring)
+        ring.add("d")
+        after = self.placement(ring)
+        moved = [key for key in KEYS if before[key] != after[key]]
+        self.assertTrue(moved)
+        self.assertLess(len(moved), len(KEYS) / 2)
+        for key in moved:
+            self.assertEqual(after[key], "d")
+
+    def test_removing_node_only_moves_its_keys(self):
+        """Keys of a removed node move, the keys of the others stay."""
+
+        ring = HashRing(["a", "b", "c"])
+        before = self.placement(ring)
+        ring.remove("b")
+        after = self.placement(ring)
+        self.assertEqual(ring.nodes, ["a", "c"])
+        for key in KEYS:
+            if before[key] == "b":
+                self.assertIn(after[key], ("a", "c"))
+            else:
+                self.assertEqual(after[key], before[key])
+
+    def test_add_and_remove_are_idempotent(self):
+        """Adding a present node or removing an absent one changes nothing."""
+
+        ring = HashRing(["a", "b"])
+        before = self.placement(ring)
+        ring.add("a")
+        ring.remove("c")
+        self.assertEqual(len(ring), 2)
+        self.assertEqual(self.placement(ring), before)
+
+
+class FakeLyric(object):
+    """Account counting its refreshes."""
+
+    _cache_ttl = 60
+
+    def __init__(self):
+        """Initialize the account."""
+
+        self.refreshes = 0
+
+    def refresh(self):
+        """Count a refresh."""
+
+        self.refreshes += 1
+
+
+class ShardedPollerTest(unittest.TestCase):
+    """Accounts shared by pollers through a coordinator directory."""
+
+    def setUp(self):
+        """Create a coordinator directory and accounts."""
+
+        self.directory = tempfile.mkdtemp()
+        self.accounts = {"account-%s" % index: FakeLyric() for index in range(50)}
+
+    def tearDown(self):
+        """Remove the coordinator directory."""
+
+        shutil.rmtree(self.directory)
+
+    def poller(self, node_id):
+        """Return a poller node of the accounts."""
+
+        return ShardedPoller(self.accounts, FileCoordinator(self.directory, node_id))
+
+    def test_nodes_split_accounts(self):
+        """Each account is polled by exactly one of the live nodes."""
+
+        first = self.poller("first")
+        second = self.poller("second")
+        first.rebalance()
+        second.rebalance()
+        first.poll()
+        second.poll()
+
+        self.assertEqual(first.ring.nodes, ["first", "second"])
+        self.assertEqual(sorted(first.owned() + second.owned()), sorted(self.accounts))
+        for lyric_api in self.accounts.values():
+            self.assertEqual(lyric_api.refreshes, 1)
+
+    def test_leaving_node_hands_over(self):
+        """The accounts of a node that left are polled by the others."""
+
+        first = self.poller("first")
+        second = self.poller("second")
+        first.rebalance()
+        second.rebalance()
+        second._coordinator.leave()
+        first.rebalance()
+
+        self.assertEqual(first.ring.nodes, ["first"])
+        self.assertEqual(sorted(first.owned()), sorted(self.accounts))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of binary snapshots and delta frames."""
+
+import copy
+import unittest
+
+from lyric.simulator import Simulation
+from lyric.snapshot import SnapshotLoader, SnapshotWriter, decode, encode
+
+
+def _locations(locations=2):
+    """Return a simulated locations payload."""
+
+    simulation = Simulation(locations=locations, thermostats=2, seed=1)
+    return copy.deepcopy(simulation.handle("GET", "locations", {}, None)[1])
+
+
+class EncodingTest(unittest.TestCase):
+    """Encoding of JSON compatible values."""
+
+    def test_round_trip(self):
+        """Every JSON type decodes to an equal value."""
+
+        value = {
+            "name": "Living é☃",
+            "ints": [0, 1, -1, 127, 128, -129, 2**40, -(2**63)],
+            "floats": [0.5, -21.25, 1e300],
+            "flags": [True, False, None],
+            "nested": [{"a": [], "b": {}}, ["a", "a", "b"]],
+        }
+        self.assertEqual(decode(encode(value)), value)
+
+    def test_round_trip_locations(self):
+        """A locations payload decodes to an equal payload."""
+
+        locations = _locations()
+        self.assertEqual(decode(encode(locations)), locations)
+
+
+class FrameTest(unittest.TestCase):
+    """Full and delta frames written and loaded in sequence."""
+
+    def setUp(self):
+        """Create a writer and a loader that loaded a full snapshot."""
+
+        self.locations = _locations()
+        self.writer = SnapshotWriter()
+        self.loader = SnapshotLoader()
+        self.full = self.writer.write(self.locations)
+        self.assertEqual(self.loader.load(self.full), 1)
+
+    def changed(self):
+        """Return a copy of the payload with one thermostat changed."""
+
+        locations = copy.copy(self.locations)
+        location = locations[1] = dict(locations[1])
+        devices = location["devices"] = list(location["devices"])
+        devices[0] = dict(devices[0], indoorTemperature=30.5)
+        return locations
+
+    def test_full_snapshot(self):
+        """A full snapshot loads the whole payload."""
+
+        self.assertEqual(self.loader.locations, self.locations)
+
+    def test_delta_applies_changed_device(self):
+        """A delta carries just the changed device."""
+
+        locations = self.changed()
+        delta = self.writer.write(locations)
+        self.assertLess(len(delta), len(self.full))
+        self.assertEqual(self.loader.load(delta), 2)
+        self.assertEqual(self.loader.locations, locations)
+        self.assertEqual(
+            self.loader.locations[1]["devices"][0]["indoorTemperature"], 30.5
+        )
+
+    def test_delta_of_removed_and_reordered(self):
+        """Removed locations and reordered devices come through a delta."""
+
+        location = dict(self.locations[0])
+        location["devices"] = list(reversed(location["devices"]))
+        locations = [location]
+        self.loader.load(self.writer.write(locations))
+        self.assertEqual(self.loader.locations, locations)
+
+    def test_unchanged_delta(self):
+        """A delta of an unchanged payload keeps the loaded payload."""
+
+        self.loader.load(self.writer.write(self.locations))
+        self.assertEqual(self.loader.locations, self.locations)
+
+    def test_delta_needs_its_base(self):
+        """A delta skipping a frame is refused."""
+
+        self.writer.write(self.changed())
+        with self.assertRaises(ValueError):
+            self.loader.load(self.writer.write(self.locations))
+
+    def test_full_every(self):
+        """Full snapshots are repeated for readers joining later."""
+
+        writer = SnapshotWriter(full_every=2)
+        writer.write(self.locations)
+        writer.write(self.changed())
+        loader = SnapshotLoader()
+        loader.load(writer.write(self.locations))
+        self.assertEqual(loader.locations, self.locations)
+
+    def test_malformed_frames(self):
+        """Malformed frames raise ValueError and keep the loaded payload."""
+
+        for frame in (
+            b"",
+            b"JSON" + self.full[4:],
+            self.full[:5],
+            self.full[:-8],
+            self.full[:4] + b"X" + self.full[5:],
+            self.full[:8] + b"\x00" * 8,
+        ):
+            with self.assertRaises(ValueError, msg=repr(frame[:12])):
+                self.loader.load(frame)
+        self.assertEqual(self.loader.seq, 1)
+        self.assertEqual(self.loader.locations, self.locations)
+
+    def test_lyric_view(self):
+        """The loaded payload reads like any Lyric instance."""
+
+        self.loader.load(self.writer.write(self.changed()))
+        lyric_api = self.loader.lyric()
+        thermostat = lyric_api.locations[1].thermostats[0]
+        self.assertEqual(thermostat.indoorTemperature, 30.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
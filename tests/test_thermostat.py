@@ -0,0 +1,89 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of validating thermostat updates before they are sent."""
+
+import unittest
+
+from lyric.simulator import Simulation
+
+
+class UpdateValidationTest(unittest.TestCase):
+    """Thermostat updates checked against the limits of the device."""
+
+    def setUp(self):
+        """Create a simulated thermostat."""
+
+        self.simulation = Simulation(locations=1, thermostats=1, seed=1)
+        self.lyric_api = self.simulation.lyric()
+        self.thermostat = self.lyric_api.locations[0].thermostats[0]
+        self.requests = self.simulation.requests
+
+    def assertRejected(self, **kwargs):
+        """Assert an update raises ValueError without a request."""
+
+        with self.assertRaises(ValueError):
+            self.thermostat.updateThermostat(**kwargs)
+        self.assertEqual(self.simulation.requests, self.requests)
+
+    def test_setpoint_limits(self):
+        """Setpoints outside the limits of the thermostat are rejected."""
+
+        self.assertRejected(heatSetpoint=self.thermostat.minHeatSetpoint - 1)
+        self.assertRejected(heatSetpoint=self.thermostat.maxHeatSetpoint + 1)
+        self.assertRejected(coolSetpoint=self.thermostat.minCoolSetpoint - 1)
+        self.assertRejected(coolSetpoint=self.thermostat.maxCoolSetpoint + 1)
+
+    def test_mode_not_allowed(self):
+        """A mode the thermostat does not support is rejected."""
+
+        self.assertNotIn("Eco", self.thermostat.allowedModes)
+        self.assertRejected(mode="Eco")
+
+    def test_deadband(self):
+        """Auto mode setpoints closer than the deadband are rejected."""
+
+        deadband = self.thermostat.device["deadband"]
+        self.assertRejected(
+            mode="Auto", heatSetpoint=20, coolSetpoint=20 + deadband / 2
+        )
+        self.assertEqual(
+            self.thermostat.updateThermostat(
+                mode="Auto", heatSetpoint=20, coolSetpoint=20 + deadband
+            ),
+            200,
+        )
+
+    def test_next_period_time(self):
+        """Period times are rounded to the allowed increment and checked."""
+
+        self.assertEqual(self.thermostat.allowedTimeIncrements, 15)
+        data = self.thermostat._update_data(nextPeriodTime="07:08")
+        self.assertEqual(data["nextPeriodTime"], "07:15:00")
+        data = self.thermostat._update_data(nextPeriodTime="23:55:00")
+        self.assertEqual(data["nextPeriodTime"], "00:00:00")
+        self.assertRejected(nextPeriodTime="24:00")
+        self.assertRejected(nextPeriodTime="07h30")
+
+    def test_unchanged_update_is_not_sent(self):
+        """An update matching the cached values sends nothing."""
+
+        self.assertIsNone(
+            self.thermostat.updateThermostat(
+                mode=self.thermostat.operationMode,
+                heatSetpoint=self.thermostat.heatSetpoint,
+            )
+        )
+        self.assertIsNone(self.thermostat.updateThermostat())
+        self.assertEqual(self.simulation.requests, self.requests)
+
+    def test_changed_update_is_sent(self):
+        """An update changing a value is sent and applied."""
+
+        heatSetpoint = self.thermostat.heatSetpoint + 1
+        status_code = self.thermostat.updateThermostat(heatSetpoint=heatSetpoint)
+        self.assertEqual(status_code, 200)
+        self.assertEqual(self.thermostat.heatSetpoint, heatSetpoint)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,275 @@
+#  -*- coding:utf-8 -*-
+
+"""Tests of the token file shared between threads and processes."""
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from lyric import Lyric
+from lyric.exceptions import DeadlineExceeded
+from lyric.simulator import Simulation
+from lyric.token import FileLock, TokenBroker, read_token, token_expired, write_token
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HOLD_LOCK = """
+import sys
+from lyric.token import FileLock
+
+lock = FileLock(sys.argv[1])
+lock.acquire()
+print("locked", flush=True)
+sys.stdin.read()
+lock.release()
+"""
+
+
+def _token(access_token, expires_in=3600):
+    """Return a token expiring in expires_in seconds."""
+
+    return {"access_token": access_token, "expires_at": time.time() + expires_in}
+
+
+class TokenFileTest(unittest.TestCase):
+    """Reading, writing and expiry of tokens."""
+
+    def setUp(self):
+        """Create a directory for the token file."""
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "token.json")
+
+    def tearDown(self):
+        """Remove the directory."""
+
+        shutil.rmtree(self.directory)
+
+    def test_write_and_read(self):
+        """A written token reads back and leaves no temporary file."""
+
+        token = _token("a")
+        write_token(self.path, token)
+        self.assertEqual(read_token(self.path), token)
+        self.assertEqual(os.listdir(self.directory), ["token.json"])
+
+    def test_read_missing_or_invalid(self):
+        """A missing or invalid token file reads as None."""
+
+        self.assertIsNone(read_token(self.path))
+        with open(self.path, "w") as f:
+            f.write("{")
+        self.assertIsNone(read_token(self.path))
+
+    def test_expired(self):
+        """Tokens expire a margin before their expiry time."""
+
+        self.assertFalse(token_expired({"access_token": "a"}))
+        self.assertFalse(token_expired(_token("a")))
+        self.assertTrue(token_expired(_token("a", 10)))
+        self.assertTrue(token_expired(_token("a", -10)))
+
+
+class FileLockTest(unittest.TestCase):
+    """Locking of the lock file."""
+
+    def setUp(self):
+        """Create a directory for the lock file."""
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "token.lock")
+
+    def tearDown(self):
+        """Remove the directory."""
+
+        shutil.rmtree(self.directory)
+
+    def test_reentrant(self):
+        """The thread holding the lock can acquire it again."""
+
+        lock = FileLock(self.path)
+        with lock:
+            self.assertTrue(lock.acquire(0))
+            lock.release()
+        self.assertTrue(FileLock(self.path).acquire(0))
+
+    def test_timeout_while_held_by_another_process(self):
+        """The lock times out while another process holds it."""
+
+        process = subprocess.Popen(
+            [sys.executable, "-c", HOLD_LOCK, self.path],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env=dict(os.environ, PYTHONPATH=ROOT),
+            universal_newlines=True,
+        )
+        try:
+            self.assertEqual(process.stdout.readline().strip(), "locked")
+            lock = FileLock(self.path)
+            started = time.monotonic()
+            self.assertFalse(lock.acquire(0.2))
+            self.assertGreaterEqual(time.monotonic() - started, 0.2)
+            process.stdin.close()
+            self.assertTrue(lock.acquire(5))
+            lock.release()
+        finally:
+            process.kill()
+            process.wait()
+            process.stdout.close()
+
+
+class TokenBrokerTest(unittest.TestCase):
+    """Refreshing a token shared by many brokers."""
+
+    def setUp(self):
+        """Store an expired token."""
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "token.json")
+        self.stale = _token("stale", -10)
+        TokenBroker(self.path).save(self.stale)
+        self.refreshes = []
+
+    def tearDown(self):
+        """Remove the directory."""
+
+        shutil.rmtree(self.directory)
+
+    def refresher(self, token):
+        """Return a new token, slowly."""
+
+        self.refreshes.append(token)
+        time.sleep(0.1)
+        return _token("fresh-%s" % len(self.refreshes))
+
+    def test_single_flight_refresh(self):
+        """Concurrent refreshes of the same stale token refresh once."""
+
+        tokens = []
+
+        def refresh():
+            tokens.append(TokenBroker(self.path).refresh(self.stale, self.refresher))
+
+        threads = [threading.Thread(target=refresh) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.refreshes), 1)
+        self.assertEqual(self.refreshes[0]["access_token"], "stale")
+        self.assertEqual({token["access_token"] for token in tokens}, {"fresh-1"})
+        self.assertEqual(read_token(self.path)["access_token"], "fresh-1")
+
+    def test_refreshed_token_is_picked_up(self):
+        """A broker holding the stale token loads the one stored since."""
+
+        broker = TokenBroker(self.path)
+        self.assertEqual(broker.load(), self.stale)
+        TokenBroker(self.path).save(_token("other"))
+        self.assertTrue(broker.changed())
+        token = broker.refresh(self.stale, self.refresher)
+        self.assertEqual(token["access_token"], "other")
+        self.assertEqual(self.refreshes, [])
+
+    def test_refresh_times_out(self):
+        """Waiting for the lock past the timeout raises DeadlineExceeded."""
+
+        held = threading.Event()
+        done = threading.Event()
+
+        def hold():
+            with FileLock(self.path + ".lock"):
+                held.set()
+                done.wait()
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        try:
+            held.wait()
+            with self.assertRaises(DeadlineExceeded):
+                TokenBroker(self.path).refresh(self.stale, self.refresher, 0.1)
+        finally:
+            done.set()
+            thread.join()
+        self.assertEqual(self.refreshes, [])
+
+
+
+class LyricTokenTest(unittest.TestCase):
+    """Refreshing the token of a Lyric instance."""
+
+    def setUp(self):
+        """Create a simulated account and a directory for the token file."""
+
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "token.json")
+        self.simulation = Simulation(locations=1, thermostats=1, seed=1)
+        self.refreshes = []
+        patcher = mock.patch.object(
+            Lyric, "_refresh_token", autospec=True, side_effect=self.refresh_token
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def tearDown(self):
+        """Remove the directory."""
+
+        shutil.rmtree(self.directory)
+
+    def refresh_token(self, lyric_api, token):
+        """Return a new token, slowly."""
+
+        self.refreshes.append(token)
+        time.sleep(0.1)
+        return _token("fresh-%s" % len(self.refreshes))
+
+    def test_threads_refresh_once(self):
+        """Threads finding the token expired refresh it once."""
+
+        lyric_api = self.simulation.lyric(token=_token("stale", -10))
+        threads = [threading.Thread(target=lyric_api.refresh) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.refreshes), 1)
+        self.assertEqual(lyric_api.token["access_token"], "fresh-1")
+
+    def test_refreshed_token_is_saved(self):
+        """A refreshed token is written to the token cache file."""
+
+        write_token(self.path, _token("stale", -10))
+        lyric_api = self.simulation.lyric(token_cache_file=self.path)
+        self.assertTrue(lyric_api.refresh())
+        self.assertEqual(read_token(self.path)["access_token"], "fresh-1")
+
+    def test_instances_share_token_file(self):
+        """Instances sharing a token file refresh once between them."""
+
+        write_token(self.path, _token("stale", -10))
+        instances = [
+            self.simulation.lyric(token_cache_file=self.path) for _ in range(4)
+        ]
+        threads = [
+            threading.Thread(target=lyric_api.refresh) for lyric_api in instances
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(self.refreshes), 1)
+        for lyric_api in instances:
+            self.assertEqual(lyric_api.token["access_token"], "fresh-1")
+
+
+if __name__ == "__main__":
+    unittest.main()